@@ -0,0 +1,97 @@
+"""
+Packed store of MSAs written by `get_msa.py`: residues of all alignments encoded as uint8 matrices (one row
+per sequence) in one binary file and an index with their offsets, shapes and sequence ids. The binary file is
+memory-mapped, so alignments are read as NumPy views without parsing .fasta files.
+"""
+import numpy as np
+import os
+
+from dataclasses import dataclass
+from functools import lru_cache
+from multiprocessing.pool import Pool
+
+STORE_DATA = "alignments.bin"
+STORE_INDEX = "alignments.tsv"
+
+
+@dataclass
+class StoredAlignment:
+    """
+    An alignment in the store given by its cluster name, byte offset, shape (number of sequences, length)
+    and sequence ids.
+    """
+    name: str
+    offset: int
+    shape: tuple[int, int]
+    names: list[str]
+
+
+def read_fasta_alignment(fasta_file: str) -> tuple[np.ndarray, list[str]]:
+    """
+    Reads an alignment from a given .fasta file (`fasta_file`) and returns it encoded as a uint8 matrix
+    (as `nj_engine.encode_alignment` does) with a list of sequence ids.
+    """
+    names, sequences = [], []
+    with open(fasta_file, "rb") as file:
+        for line in file:
+            if line.startswith(b">"):
+                names.append(line[1:].decode().split()[0])
+                sequences.append([])
+            elif line.strip():
+                sequences[-1].append(line.strip())
+    sequences = [b"".join(sequence) for sequence in sequences]
+    if len({len(sequence) for sequence in sequences}) > 1:
+        raise Exception(f"Sequences in {fasta_file} have different lengths!")
+    encoded = np.frombuffer(b"".join(sequences), dtype=np.uint8)
+    return encoded.reshape(len(names), -1 if names else 0), names
+
+
+def write_store(fasta_files: list[str], store_dir: str, pool: Pool = None):
+    """
+    Writes alignments from all given .fasta files (`fasta_files`) to the store in `store_dir`. Clusters are named
+    after the files (the part of the file name before the first dot). If `pool` is given, files are parsed by its
+    workers.
+    """
+    fasta_files = sorted(fasta_files)
+    if pool:
+        alignments = pool.imap(read_fasta_alignment, fasta_files, chunksize=16)
+    else:
+        alignments = map(read_fasta_alignment, fasta_files)
+    with open(f"{store_dir}/{STORE_DATA}", "wb") as data_file, open(f"{store_dir}/{STORE_INDEX}", "w") as index_file:
+        offset = 0
+        for fasta_file, (encoded, names) in zip(fasta_files, alignments):
+            data_file.write(encoded.tobytes())
+            cluster_name = fasta_file.split('/')[-1].split('.')[0]
+            index_file.write("\t".join([cluster_name, str(offset), *map(str, encoded.shape), *names]) + "\n")
+            offset += encoded.nbytes
+
+
+def read_store_index(store_dir: str) -> list[StoredAlignment]:
+    """
+    Reads the index of the store in `store_dir` to a list of StoredAlignment.
+    """
+    alignments = []
+    with open(f"{store_dir}/{STORE_INDEX}", "r") as index_file:
+        for line in index_file:
+            name, offset, no_sequences, length, *names = line.rstrip("\n").split("\t")
+            alignments.append(StoredAlignment(name, int(offset), (int(no_sequences), int(length)), names))
+    return alignments
+
+
+@lru_cache(maxsize=None)
+def open_store(store_dir: str) -> np.ndarray:
+    """
+    Memory-maps the binary file of the store in `store_dir` (once per process).
+    """
+    data_name = f"{store_dir}/{STORE_DATA}"
+    if not os.path.getsize(data_name):
+        return np.empty(0, dtype=np.uint8)
+    return np.memmap(data_name, dtype=np.uint8, mode="r")
+
+
+def get_alignment(store_dir: str, alignment: StoredAlignment) -> np.ndarray:
+    """
+    Returns a read-only view of a given `alignment` from the store in `store_dir` as a uint8 matrix.
+    """
+    size = alignment.shape[0] * alignment.shape[1]
+    return open_store(store_dir)[alignment.offset:alignment.offset + size].reshape(alignment.shape)
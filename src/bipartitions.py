@@ -0,0 +1,180 @@
+"""
+Leaf bitmask representation of trees read from Newick files, used to compare trees without building tree objects.
+Every leaf name gets a bit in a taxa index shared by all trees, so a clade (or one side of a split) is an int
+with bits of its leaves set.
+"""
+import numpy as np
+import re
+
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Iterator
+
+NEWICK_TOKENS = re.compile(r"\s*('[^']*'|[(),;]|:[^(),;]*|[^(),;:]+)")
+
+
+@dataclass
+class SplitTree:
+    """
+    A tree given by its name, a bitmask of its leaves, bitmasks of its clades (as rooted in the Newick string)
+    and a set of its non-trivial splits (each stored as the side without the lowest leaf).
+    """
+    name: str
+    leaves: int
+    clades: list[int]
+    splits: frozenset[int]
+
+
+def read_newick_trees(newick_file: str) -> Iterator[str]:
+    """
+    Yields Newick strings of all trees from a given file (`newick_file`), one at a time.
+    """
+    with open(newick_file, "r") as file:
+        tree = []
+        for line in file:
+            while ";" in line:
+                end, line = line.split(";", 1)
+                tree.append(end)
+                yield "".join(tree).strip() + ";"
+                tree = []
+            tree.append(line)
+        if "".join(tree).strip():
+            yield "".join(tree).strip() + ";"
+
+
+def parse_clades(newick: str, taxa: dict[str, int]) -> tuple[int, list[int]]:
+    """
+    Returns a bitmask of all leaves and a list of bitmasks of all inner clades of a given tree (`newick`).
+    New leaf names are added to the `taxa` index ({name: bit}). Labels of inner nodes and branch lengths are skipped.
+    """
+    stack = [0]
+    clades = []
+    previous = "("
+    for token in NEWICK_TOKENS.findall(newick):
+        if token == "(":
+            stack.append(0)
+        elif token == ")":
+            clade = stack.pop()
+            clades.append(clade)
+            stack[-1] |= clade
+        elif token[0] not in ",;:" and previous in "(,":
+            leaf = 1 << taxa.setdefault(token.strip("'"), len(taxa))
+            if any(clade & leaf for clade in stack):
+                raise Exception(f"Duplicated leaf name ({token}) in tree: {newick[:100]}")
+            stack[-1] |= leaf
+        if token[0] != ":":
+            previous = token
+    return stack[0], clades
+
+
+def get_splits(clades: list[int], leaves: int) -> frozenset[int]:
+    """
+    Returns non-trivial splits (both sides with at least 2 leaves) made by `clades` restricted to `leaves`.
+    Every split is stored as the side without the lowest leaf.
+    """
+    lowest = leaves & -leaves
+    no_leaves = bin(leaves).count("1")
+    splits = set()
+    for clade in clades:
+        clade &= leaves
+        if clade & lowest:
+            clade ^= leaves
+        if 1 < bin(clade).count("1") < no_leaves - 1:
+            splits.add(clade)
+    return frozenset(splits)
+
+
+def get_split_tree(name: str, newick: str, taxa: dict[str, int]) -> SplitTree:
+    """
+    Parses a given tree (`newick`) to a SplitTree using the shared `taxa` index.
+    """
+    leaves, clades = parse_clades(newick, taxa)
+    return SplitTree(name, leaves, clades, get_splits(clades, leaves))
+
+
+def read_split_trees(newick_file: str, taxa: dict[str, int]) -> Iterator[SplitTree]:
+    """
+    Yields SplitTree for every tree from a given file (`newick_file`). Trees are named `{newick_file}:{line_number}`
+    if the file contains more than one tree and `newick_file` otherwise.
+    """
+    trees = read_newick_trees(newick_file)
+    first = next(trees, None)
+    second = next(trees, None)
+    if second is None:
+        if first is not None:
+            yield get_split_tree(newick_file, first, taxa)
+        return
+    yield get_split_tree(f"{newick_file}:1", first, taxa)
+    yield get_split_tree(f"{newick_file}:2", second, taxa)
+    for i, newick in enumerate(trees, 3):
+        yield get_split_tree(f"{newick_file}:{i}", newick, taxa)
+
+
+def get_rf(first: SplitTree, second: SplitTree) -> tuple[int, int]:
+    """
+    Returns unrooted Robinson-Foulds distance between two trees and its maximal value, computed on leaves present
+    in both trees - the same values as `ete3.Tree.robinson_foulds(..., unrooted_trees=True)[:2]`.
+    """
+    if first.leaves == second.leaves:
+        first_splits, second_splits = first.splits, second.splits
+    else:
+        common = first.leaves & second.leaves
+        first_splits, second_splits = get_splits(first.clades, common), get_splits(second.clades, common)
+    return len(first_splits ^ second_splits), len(first_splits) + len(second_splits)
+
+
+def get_rf_matrix(rows: list[SplitTree], columns: list[SplitTree]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns matrices of Robinson-Foulds distances and their maximal values between all `rows` and `columns` trees.
+    For pairs of trees with the same leaves, shared splits are counted in one pass over a table of splits
+    ({(leaves, split): trees}) instead of comparing the trees one by one.
+    """
+    rows_sizes = np.array([len(tree.splits) for tree in rows], dtype=np.int64)
+    columns_sizes = np.array([len(tree.splits) for tree in columns], dtype=np.int64)
+    max_rf = rows_sizes[:, None] + columns_sizes[None, :]
+    shared = np.zeros((len(rows), len(columns)), dtype=np.int64)
+    same_leaves = np.array([[row.leaves == column.leaves for column in columns] for row in rows], dtype=bool)
+    same_leaves = same_leaves.reshape(len(rows), len(columns))
+
+    splits_table = defaultdict(lambda: ([], []))
+    for i, tree in enumerate(rows):
+        for split in tree.splits:
+            splits_table[tree.leaves, split][0].append(i)
+    for j, tree in enumerate(columns):
+        for split in tree.splits:
+            if (tree.leaves, split) in splits_table:
+                splits_table[tree.leaves, split][1].append(j)
+    for rows_indices, columns_indices in splits_table.values():
+        if columns_indices:
+            shared[np.ix_(rows_indices, columns_indices)] += 1
+    rf = max_rf - 2 * shared
+
+    for i, j in zip(*np.nonzero(~same_leaves)):
+        rf[i, j], max_rf[i, j] = get_rf(rows[i], columns[j])
+    return rf, max_rf
+
+
+def get_newick(splits: dict[int, str], leaves: int, taxa_names: list[str]) -> str:
+    """
+    Returns a Newick string of a tree made of compatible `splits` ({split: label}) of `leaves`, where bits are
+    named after `taxa_names`. Splits are given as the side without the lowest leaf, so the tree is rooted
+    at the lowest leaf's branch (as ape roots unrooted trees) and every split becomes an inner node with its label.
+    """
+    clades = sorted(splits, key=lambda split: bin(split).count("1"), reverse=True)
+    children = {leaves: []}
+    for clade in clades:
+        parent = next((other for other in reversed(list(children)) if other & clade == clade), leaves)
+        children[parent].append(clade)
+        children[clade] = []
+    for bit in range(leaves.bit_length()):
+        if leaves >> bit & 1:
+            parent = next(other for other in reversed(list(children)) if other >> bit & 1)
+            children[parent].append(1 << bit)
+
+    def to_newick(clade: int) -> str:
+        if clade not in children:
+            return taxa_names[clade.bit_length() - 1]
+        subtrees = sorted(children[clade], key=lambda child: child & -child)
+        return f"({','.join(to_newick(child) for child in subtrees)}){splits.get(clade, '')}"
+
+    return f"{to_newick(leaves)};"
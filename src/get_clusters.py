@@ -3,67 +3,92 @@ Exemplary run: `python ./src/get_clusters.py ./data/proteomes.fasta ./data/`
 """
 import click
 import os
+import telemetry
+import time
+
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable, Iterator
+
+WRITE_BUFFER_SIZE = 1 << 20
 
 
 @click.command()
 @click.argument("proteomes_file")
 @click.argument("output_path")
-def get_clusters(proteomes_file: str, output_path: str):
+@click.option("-j", "--cores", "cores", type=click.IntRange(1), required=False,
+              help="Number of threads used by MMseqs2 (default: all cores).")
+@telemetry.stage
+def get_clusters(proteomes_file: str, output_path: str, cores: int = None):
     """
-    The script runs clustering with MMSeqs2 on a given .fasta file (`proteomes_file`) and saves every received cluster
-    in a separate .fasta file. All output files are stored in `output_path`.
+    The script runs clustering with MMSeqs2 on a given .fasta file (`proteomes_file`) and saves all received clusters
+    in one packed .fasta file with a manifest describing their composition. The clustering output is streamed,
+    so memory use does not depend on its size.
+    All output files are stored in `output_path`.
     """
-    run_mmseqs(proteomes_file, output_path)
-    clusters = parse_clustering_output(output_path)
-    write_clusters_files(clusters, output_path)
+    run_mmseqs(proteomes_file, output_path, cores)
+    write_clusters_files(parse_clustering_output(output_path), output_path)
 
 
-def run_mmseqs(proteomes_file: str, output_path: str):
+def run_mmseqs(proteomes_file: str, output_path: str, cores: int = None):
     """
     Runs clustering with MMSeqs2's easy-cluster on a given .fasta file (`proteomes_file`) and saves the output
-    in `clusters/` folder in a given directory (`output_path`).
+    in `clusters/` folder in a given directory (`output_path`). If `cores` is set, MMSeqs2 uses this number of threads.
     """
     if os.path.dirname(f"{output_path}/clusters/"):
         os.makedirs(os.path.dirname(f"{output_path}/clusters/"), exist_ok=True)
-    os.system(f"mmseqs easy-cluster {proteomes_file} {output_path}/clusters/clusters {output_path}/clusters/clusters_tmp")
+    start = time.perf_counter()
+    status = os.system(f"mmseqs easy-cluster {proteomes_file} {output_path}/clusters/clusters "
+                       f"{output_path}/clusters/clusters_tmp" + (f" --threads {cores}" if cores else ""))
+    telemetry.record("tool", "mmseqs", wall=round(time.perf_counter() - start, 6),
+                     exit_code=os.waitstatus_to_exitcode(status), input_size=os.path.getsize(proteomes_file))
 
 
-def parse_clustering_output(output_path: str) -> dict[str, dict[str, str]]:
+def parse_clustering_output(output_path: str) -> Iterator[tuple[str, str, str]]:
     """
     Parses one of the MMSeqs2's output files (the one with `_all_seqs.fasta` suffix, containing all input sequences
-    ordered by clusters) to a dictionary ({cluster_name: {header: sequence}}).
+    ordered by clusters) in one pass, yielding (cluster_name, header, sequence) for every sequence in the file order.
     """
     with open(f"{output_path}/clusters/clusters_all_seqs.fasta", "r") as clustering_output:
-        clusters = {}
         cluster_name = None
         header = None
         for line in clustering_output:
             if line.startswith(">"):
                 if header:
                     cluster_name = header
-                    clusters[cluster_name] = {}
                 header = line.strip()
             else:
                 if header:
-                    clusters[cluster_name][header] = line.strip()
+                    yield cluster_name, header, line.strip()
                     header = None
                 else:
-                    raise Exception(f"Wrong file format - sequence has no header defined! Error for line: {line.strip}")
-    return clusters
+                    raise Exception(f"Wrong file format - sequence has no header defined! Error for line: {line.strip()}")
 
 
-def write_clusters_files(clusters: dict[str, dict[str, str]], output_path: str):
+def write_clusters_files(sequences: Iterable[tuple[str, str, str]], output_path: str):
     """
-    Writes a .fasta file in `clusters/parsed/` folder in a given directory (`output_path`) for every cluster
-    from a given dictionary (`clusters`: {cluster_name: {header: sequence}}).
+    Writes all clusters from given `sequences` ([(cluster_name, header, sequence)], grouped by clusters) one after
+    another to `clusters/parsed.fasta` in a given directory (`output_path`) and describes them in
+    `clusters/manifest.tsv` - a line per cluster with its name, number of sequences, byte offset and length
+    in the packed file and numbers of sequences per proteome (UniProt ID from the end of each header).
+    Both files are written through single buffered handles as clusters end.
     """
-    output_dir = f"{output_path}/clusters/parsed/"
+    output_dir = f"{output_path}/clusters/"
     if os.path.dirname(output_dir):
         os.makedirs(os.path.dirname(output_dir), exist_ok=True)
-    for cluster, headers in clusters.items():
-        with open(f"{output_dir}{len(headers)}_{cluster.strip('>')}.fasta", "a") as cluster_file:
-            for header, sequence in headers.items():
-                cluster_file.write(f"{header}\n{sequence}\n")
+    with open(f"{output_dir}parsed.fasta", "wb", buffering=WRITE_BUFFER_SIZE) as packed_file, \
+            open(f"{output_dir}manifest.tsv", "w", buffering=WRITE_BUFFER_SIZE) as manifest_file:
+        offset = 0
+        for cluster_name, cluster_sequences in groupby(sequences, key=itemgetter(0)):
+            proteomes = Counter()
+            length = 0
+            for _, header, sequence in cluster_sequences:
+                length += packed_file.write(f"{header}\n{sequence}\n".encode())
+                proteomes[header.split()[-1]] += 1
+            counts = ",".join(f"{proteome}:{count}" for proteome, count in proteomes.items())
+            manifest_file.write(f"{cluster_name.strip('>')}\t{sum(proteomes.values())}\t{offset}\t{length}\t{counts}\n")
+            offset += length
 
 
 if __name__ == "__main__":
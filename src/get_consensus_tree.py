@@ -0,0 +1,53 @@
+"""
+Exemplary run: `python ./src/get_consensus_tree.py ./data/one2one/nj_trees.nwk ./data/one2one/`
+"""
+import bipartitions
+import click
+import telemetry
+
+from collections import Counter
+
+
+@click.command()
+@click.argument("nj_trees_file")
+@click.argument("output_dir")
+@click.option("-p", "--proportion", "proportion", default=0.5, type=click.FloatRange(0.5, 1),
+              help="Minimal proportion of trees a split has to be found in to be included in the consensus tree.")
+@telemetry.stage
+def get_consensus_tree(nj_trees_file: str, output_dir: str, proportion: float = 0.5):
+    """
+    This script builds a majority-rule consensus tree (as `ape::consensus(p=0.5)`) of unrooted trees
+    from `nj_trees_file` and saves it in `output_dir/consensus_tree.nwk`. Trees are read one at a time, so memory
+    does not grow with their number. Inner nodes are labeled with the proportion of trees containing their split.
+    """
+    taxa = {}
+    counts, leaves, no_trees = count_splits(nj_trees_file, taxa)
+    if not no_trees:
+        raise Exception(f"No trees found in {nj_trees_file}!")
+    majority = {split: f"{count / no_trees:.3g}" for split, count in counts.items()
+                if count >= proportion * no_trees and (proportion > 0.5 or 2 * count > no_trees)}
+    with open(f"{output_dir}/consensus_tree.nwk", "w") as output_file:
+        output_file.write(f"{bipartitions.get_newick(majority, leaves, list(taxa))}\n")
+
+
+def count_splits(trees_file: str, taxa: dict[str, int]) -> tuple[Counter, int, int]:
+    """
+    Counts non-trivial splits of all trees from a given file (`trees_file`) using `taxa` index. Returns the counts,
+    a bitmask of leaves and the number of trees. All trees have to contain the same leaves.
+    """
+    counts = Counter()
+    leaves = None
+    no_trees = 0
+    for newick in bipartitions.read_newick_trees(trees_file):
+        tree_leaves, clades = bipartitions.parse_clades(newick, taxa)
+        if leaves is None:
+            leaves = tree_leaves
+        elif tree_leaves != leaves:
+            raise Exception(f"Tree {no_trees + 1} from {trees_file} has a different set of leaves!")
+        counts.update(bipartitions.get_splits(clades, leaves))
+        no_trees += 1
+    return counts, leaves, no_trees
+
+
+if __name__ == "__main__":
+    get_consensus_tree()
@@ -1,29 +1,49 @@
 """
-Exemplary run: `python ./src/get_filtered_clusters.py ./data/organisms.txt ./data/clusters/parsed/ ./data/clusters/full/ <-t 3>`
+Exemplary run: `python ./src/get_filtered_clusters.py ./data/organisms.txt ./data/clusters/ -o ./data/clusters/full/ <-p ./data/clusters/para/ 3>`
 """
 import click
 import glob
 import os
+import telemetry
+
+from dataclasses import dataclass
+
+
+@dataclass
+class ClusterRecord:
+    """
+    A cluster described in the manifest written by `get_clusters.py` - its name, number of sequences, byte offset
+    and length in the packed clusters file and numbers of sequences per proteome ({uniprot_id: no_sequences}).
+    """
+    name: str
+    no_sequences: int
+    offset: int
+    length: int
+    proteomes: dict[str, int]
 
 
 @click.command()
 @click.argument("species_file")
-@click.argument("input_dir")
-@click.argument("output_dir")
-@click.option("-t", "not121", required=False, type=int,
-              help='Set to allow not only "1 to 1" clusters. The value is a threshold - minimal number of seuences in a cluster.')
-def get_filtered_clusters(species_file: str, input_dir: str, output_dir: str, not121: int):
+@click.argument("clusters_dir")
+@click.option("-o", "--one2one", "one2one_dirs", multiple=True,
+              help='Directory to save "1 to 1" clusters in (can be given multiple times).')
+@click.option("-p", "--paralogs", "paralogs", multiple=True, type=(str, int),
+              help="Directory to save clusters in and a threshold - minimal number of species in a cluster (can be given multiple times).")
+@telemetry.stage
+def get_filtered_clusters(species_file: str, clusters_dir: str, one2one_dirs: tuple[str], paralogs: tuple[tuple[str, int]]):
     """
-    This script filters out all clusters from `input_dir` with one sequence for each species ("1 to 1") from `species_file`.
-    If `not121` parameter is set, filters out only clusters with fewer sequences than a given number (no_sequences < `not121`).
-    Then, replaces all headers with corresponding species names and saves the output in `output_path` directory.
+    This script selects clusters from `clusters_dir` (packed by `get_clusters.py`) using their manifest only:
+    clusters with one sequence for each species ("1 to 1") from `species_file` are saved in every `one2one_dirs`
+    directory and clusters with at least a given number of species in every `paralogs` directory.
+    Then, replaces all headers with corresponding species names - all outputs are written in one pass over the clusters.
     """
+    if not one2one_dirs and not paralogs:
+        raise click.UsageError("At least one of `--one2one` or `--paralogs` has to be given.")
     species = parse_species(species_file)
-    if not121:
-        filtered = get_all_clusters(input_dir, species, not121)
-    else:
-        filtered = get_121_clusters(input_dir, species)
-    unify_headers(output_dir, species, filtered)
+    clusters = read_manifest(clusters_dir)
+    outputs = {output_dir: get_121_clusters(clusters, species) for output_dir in one2one_dirs}
+    outputs.update({output_dir: get_all_clusters(clusters, species, threshold) for output_dir, threshold in paralogs})
+    unify_headers(clusters_dir, species, outputs)
 
 
 def parse_species(species_file: str) -> dict[str, str]:
@@ -39,67 +59,104 @@ def parse_species(species_file: str) -> dict[str, str]:
     return species
 
 
-def get_121_clusters(input_dir: str, species: dict[str, str]) -> list[str]:
+def read_manifest(clusters_dir: str) -> list[ClusterRecord]:
     """
-    Filters out all clusters from `input_dir` with exactly one sequence for each species from `species` dictionary.
+    Reads `manifest.tsv` from a given directory (`clusters_dir`) to a list of ClusterRecord.
+    """
+    clusters = []
+    with open(f"{clusters_dir}/manifest.tsv", "r") as manifest_file:
+        for line in manifest_file:
+            name, no_sequences, offset, length, counts = line.rstrip("\n").split("\t")
+            proteomes = {proteome: int(count) for proteome, count in (item.rsplit(":", 1) for item in counts.split(","))}
+            clusters.append(ClusterRecord(name, int(no_sequences), int(offset), int(length), proteomes))
+    return clusters
+
+
+def get_121_clusters(clusters: list[ClusterRecord], species: dict[str, str]) -> list[ClusterRecord]:
+    """
+    Filters out all `clusters` with exactly one sequence for each species from `species` dictionary.
     """
     no_species = len(species)
-    clusters_files = glob.glob(f"{input_dir}/{no_species}_*.fasta")
-    filtered = []
-    for cluster_file in clusters_files:
-        if get_no_unique_species(cluster_file, species) == no_species:
-            filtered.append(cluster_file)
-    return filtered
+    return [cluster for cluster in clusters
+            if cluster.no_sequences == no_species and get_no_unique_species(cluster, species) == no_species]
 
 
-def get_all_clusters(input_dir: str, species: dict[str, str], threshold: int) -> list[str]:
+def get_all_clusters(clusters: list[ClusterRecord], species: dict[str, str], threshold: int) -> list[ClusterRecord]:
     """
-    Filters out all clusters from `input_dir` with fewer sequences than a given number (no_sequences < `not121`).
+    Filters out all `clusters` with sequences of at least a given number (`threshold`) of species.
     """
-    clusters_files = glob.glob(f"{input_dir}/*.fasta")
-    for i in range(threshold):
-        clusters_files = [file for file in clusters_files if not file.split("/")[-1].startswith(f"{str(i)}_")]
-    filtered = []
-    for cluster_file in clusters_files:
-        if get_no_unique_species(cluster_file, species) >= threshold:
-            filtered.append(cluster_file)
-    return filtered
+    return [cluster for cluster in clusters
+            if cluster.no_sequences >= threshold and get_no_unique_species(cluster, species) >= threshold]
 
 
-def get_no_unique_species(cluster_file: str, species: dict[str, str]) -> int:
+def get_no_unique_species(cluster: ClusterRecord, species: dict[str, str]) -> int:
     """
-    Returns a number of unique species found in a given file (`cluster_file`).
+    Returns a number of unique species found in a given `cluster`.
     """
-    found_species = set()
-    with open(cluster_file, "r") as file:
-        for line in file:
-            if line.startswith(">"):
-                found_species.add(species[line.split()[-1]])
-    return len(found_species)
-
-
-def unify_headers(output_dir: str, species: dict[str, str], files: list[str]):
-    """
-    For each file from a `files` list, replaces all headers with corresponding species names from `species` dictionary
-    (using proteome UniProt ID from the end of each header) and saves the output in `output_path` directory.
-    Adds "$" at the end of header for every repeating header (if `not121` parameter is set).
-    """
-    if os.path.dirname(output_dir):
-        os.makedirs(os.path.dirname(output_dir), exist_ok=True)
-    for file in files:
-        with open(file, "r") as input_file, open(f"{output_dir}/unified_{file.split('/')[-1]}", "w") as output_file:
-            headers = {}  # {species_name: no_occurrences}
-            for line in input_file:
-                if line.startswith(">"):
-                    species_name = species[line.split()[-1]]
-                    if species_name in headers:
-                        headers[species_name] += 1
-                    else:
-                        headers[species_name] = 1
-                    distinction_mark = "$" * (headers[species_name] - 1)  # empty string if `not121` parameter not specified
-                    output_file.write(f">{species_name}{distinction_mark}\n")
-                else:
-                    output_file.write(line)
+    return len({species[proteome] for proteome in cluster.proteomes})
+
+
+def unify_headers(clusters_dir: str, species: dict[str, str], outputs: dict[str, list[ClusterRecord]]):
+    """
+    For each cluster selected for any output directory (`outputs`: {output_dir: clusters}), replaces all headers
+    with corresponding species names from `species` dictionary (using proteome UniProt ID from the end of each header)
+    and saves the cluster in all directories it was selected for. The packed clusters file is read once, in order.
+    Adds "$" at the end of header for every repeating header. Clusters saved in output directories by previous runs
+    and not selected now are removed.
+    """
+    selected = {}  # {offset: (cluster, [output_dir])}
+    for output_dir, clusters in outputs.items():
+        if os.path.dirname(output_dir):
+            os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+        remove_stale_clusters(output_dir, {get_cluster_file_name(cluster) for cluster in clusters})
+        for cluster in clusters:
+            selected.setdefault(cluster.offset, (cluster, []))[1].append(output_dir)
+    with open(f"{clusters_dir}/parsed.fasta", "rb") as packed_file:
+        for offset in sorted(selected):
+            cluster, output_dirs = selected[offset]
+            packed_file.seek(offset)
+            unified = get_unified_cluster(packed_file.read(cluster.length).decode(), species)
+            for output_dir in output_dirs:
+                with open(f"{output_dir}/{get_cluster_file_name(cluster)}", "w") as output_file:
+                    output_file.write(unified)
+
+
+def get_cluster_file_name(cluster: ClusterRecord) -> str:
+    """
+    Returns a name of the .fasta file a given `cluster` is saved in.
+    """
+    return f"unified_{cluster.no_sequences}_{cluster.name}.fasta"
+
+
+def remove_stale_clusters(output_dir: str, file_names: set[str]):
+    """
+    Removes cluster files from `output_dir` other than `file_names` (left by a previous run with other clusters
+    selected), so later stages do not read them.
+    """
+    for file_name in glob.glob(f"{output_dir}/unified_*.fasta"):
+        if os.path.basename(file_name) not in file_names:
+            os.remove(file_name)
+
+
+def get_unified_cluster(cluster: str, species: dict[str, str]) -> str:
+    """
+    Returns a given .fasta content (`cluster`) with headers replaced by corresponding species names
+    and "$" added at the end of header for every repeating header.
+    """
+    lines = []
+    headers = {}  # {species_name: no_occurrences}
+    for line in cluster.splitlines(keepends=True):
+        if line.startswith(">"):
+            species_name = species[line.split()[-1]]
+            if species_name in headers:
+                headers[species_name] += 1
+            else:
+                headers[species_name] = 1
+            distinction_mark = "$" * (headers[species_name] - 1)  # empty string for "1 to 1" clusters
+            lines.append(f">{species_name}{distinction_mark}\n")
+        else:
+            lines.append(line)
+    return "".join(lines)
 
 
 if __name__ == "__main__":
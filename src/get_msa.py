@@ -1,12 +1,45 @@
 """
 Exemplary run: `python ./src/get_msa.py ./data/clusters/full/ ./data/clusters/full_msa/`
 """
+import alignment_store
 import click
 import glob
 import multiprocessing
 import os
+import result_cache
+import shards
+import shlex
+import subprocess
+import telemetry
+import time
+import worker_pool
 
-from functools import partial
+from dataclasses import dataclass
+
+MAFFT_PARAMS = "--auto --inputorder --preservecase"
+MAFFT_SYMBOLS = b"ACDEFGHIKLMNPQRSTVWYBZXacdefghiklmnpqrstvwybzx-*"  # other symbols require `--anysymbol`
+POLL_INTERVAL = 0.05
+
+
+@dataclass
+class MafftJob:
+    """
+    MAFFT run for one .fasta file with its number of sequences and their total length, number of MAFFT threads
+    and information if the file requires `--anysymbol`.
+    """
+    file_name: str
+    output_name: str
+    no_sequences: int
+    length: int
+    anysymbol: bool
+    threads: int = 1
+
+    @property
+    def cost(self) -> int:
+        """
+        Estimated cost of aligning the file (number of sequences × their total length).
+        """
+        return self.no_sequences * self.length
 
 
 @click.command()
@@ -15,32 +48,171 @@ from functools import partial
 @click.option("-q", "--quiet_mafft", "is_quiet", is_flag=True, required=False,
               help="Set to use `--quiet` option in MAFFT - the program does not report progress.")
 @click.option("-m", "--mafft_path", "mafft", default="mafft", help="Command/path to run MAFFT.")
-def get_msa(input_dir: str, output_path: str, is_quiet: bool,  mafft: str="mafft"):
+@click.option("-c", "--cache_dir", "cache_dir", required=False,
+              help="Set to reuse MSAs of clusters aligned before with the same MAFFT version (cache directory).")
+@click.option("--cache_size", "cache_size", default=10000, type=click.IntRange(0),
+              help="Maximal size of the cache in MB - the least recently used results are removed.")
+@click.option("-j", "--cores", "cores", type=click.IntRange(1), required=False,
+              help="Number of cores used by MAFFT runs (default: 75% of all cores).")
+@click.option("--shard", "shard", callback=shards.parse_shard, required=False,
+              help="Set (as i/N) to align only clusters of shard i of N and save them in `output_path/shards/i_of_N/`.")
+@telemetry.stage
+def get_msa(input_dir: str, output_path: str, is_quiet: bool,  mafft: str="mafft", cache_dir: str = None,
+            cache_size: int = 10000, cores: int = None, shard: tuple[int, int] = None):
     """
     This script runs MAFFT on .fasta files from a given directory (`input_dir`) and saves obtained MSAs
-    in `output_path` directory.
+    in `output_path` directory. The most costly files are aligned first and get MAFFT threads in proportion
+    to their share of the total cost, so they do not end up at the tail of the run.
+    If `cache_dir` is set, MSAs of clusters with the same content as in previous runs are taken from it.
+    MSAs of clusters which are not in `input_dir` any more (saved by previous runs) are removed from `output_path`
+    and all MSAs left there are packed into one alignment store (see `alignment_store`) by workers of the pool shared
+    by stages run in one process (see `worker_pool`), so NJ run next in the process reuses them.
+    With `shard`, only clusters of the shard (see `shards`) are aligned and the shard is marked as completed,
+    so it is not aligned again.
     """
     input_files = glob.glob(f"{input_dir}/*.fasta")
-    no_cores = int(0.75 * multiprocessing.cpu_count())
-    with multiprocessing.Pool(no_cores) as pool:
-        pool.map(partial(run_mafft, output_path, is_quiet, mafft), input_files)
-
-
-def run_mafft(output_path: str, is_quiet: bool, mafft: str, file_name: str):
-    """
-    Runs MAFFT on given .fasta file and saves it in given directory (`output_name`) as `mafft_{family_name}.fasta`.
-    """
-    output_name = f"./{output_path}/mafft_{file_name.split('/')[-1]}"
-    quiet_param = "--quiet " if is_quiet else ""
-    if os.path.dirname(output_name):
-        os.makedirs(os.path.dirname(output_name), exist_ok=True)
-    command = '{} --auto --inputorder --preservecase {}"{}" > "{}"'.format(mafft, quiet_param, file_name, output_name)
-    os.system(command)
-    if os.stat(output_name).st_size == 0:
-        os.remove(output_name)
-        command = '{} --auto --inputorder --preservecase --anysymbol {}"{}" > "{}"'.format(mafft, quiet_param, file_name, output_name)
-        os.system(command)
-    return output_name
+    if shard:
+        output_path = shards.get_shard_dir(output_path, shard)
+        if shards.is_done(output_path):
+            print(f"Shard {shard[0]}/{shard[1]} is already completed.")
+            return
+        input_files = [file_name for file_name in input_files
+                       if shards.get_shard_index(file_name.split('/')[-1].split('.')[0], shard[1]) == shard[0]]
+    if os.path.dirname(f"{output_path}/"):
+        os.makedirs(os.path.dirname(f"{output_path}/"), exist_ok=True)
+    cache = result_cache.ResultCache(cache_dir, "msa", f"{get_mafft_version(mafft)} {MAFFT_PARAMS}") if cache_dir else None
+    jobs, keys = [], {}
+    for file_name in input_files:
+        output_name = f"{output_path}/mafft_{file_name.split('/')[-1]}"
+        if cache:
+            keys[file_name] = cache.get_key(file_name)
+            if read_cached_msa(cache, keys[file_name], output_name):
+                continue
+        jobs.append(get_mafft_job(file_name, output_name))
+    remove_stale_msas(output_path, {f"mafft_{file_name.split('/')[-1]}" for file_name in input_files})
+    no_cores = cores or max(1, int(0.75 * multiprocessing.cpu_count()))
+    set_threads(jobs, no_cores)
+    finished = run_mafft_jobs(jobs, mafft, is_quiet, no_cores)
+    if cache:
+        for job in finished:
+            with open(job.output_name, "rb") as output_file:
+                cache.put(keys[job.file_name], output_file.read())
+        cache.report(len(input_files) - len(jobs), len(input_files))
+        result_cache.evict(cache_dir, cache_size * 2**20)
+    alignment_store.write_store(glob.glob(f"{output_path}/*.fasta"), output_path, worker_pool.get_pool(no_cores))
+    if shard:
+        shards.mark_done(output_path, len(input_files))
+
+
+def remove_stale_msas(output_path: str, file_names: set[str]):
+    """
+    Removes MSA files from `output_path` other than `file_names` (left by a previous run with other clusters),
+    so they are not packed into the alignment store nor read by later stages.
+    """
+    for file_name in glob.glob(f"{output_path}/mafft_*.fasta"):
+        if os.path.basename(file_name) not in file_names:
+            os.remove(file_name)
+
+
+def read_cached_msa(cache: result_cache.ResultCache, key: str, output_name: str) -> bool:
+    """
+    Saves MSA with a given `key` from `cache` as `output_name`. Returns False if it is not cached.
+    """
+    cached = cache.get(key)
+    if cached is None:
+        return False
+    with open(output_name, "wb") as output_file:
+        output_file.write(cached)
+    return True
+
+
+def get_mafft_job(file_name: str, output_name: str) -> MafftJob:
+    """
+    Reads a given .fasta file (`file_name`) once to estimate the cost of aligning it and to check if it contains
+    symbols MAFFT accepts only with `--anysymbol`.
+    """
+    no_sequences, length, anysymbol = 0, 0, False
+    with open(file_name, "rb") as file:
+        for line in file:
+            if line.startswith(b">"):
+                no_sequences += 1
+            else:
+                sequence = line.strip()
+                length += len(sequence)
+                anysymbol = anysymbol or bool(sequence.translate(None, MAFFT_SYMBOLS))
+    return MafftJob(file_name, output_name, no_sequences, length, anysymbol)
+
+
+def set_threads(jobs: list[MafftJob], no_cores: int):
+    """
+    Sets a number of MAFFT threads of every job in proportion to its share of the total cost of all `jobs`,
+    so a job is expected to take no longer than the whole run on `no_cores` cores.
+    """
+    total_cost = sum(job.cost for job in jobs)
+    for job in jobs:
+        job.threads = max(1, min(no_cores, round(no_cores * job.cost / total_cost))) if total_cost else 1
+
+
+def run_mafft_jobs(jobs: list[MafftJob], mafft: str, is_quiet: bool, no_cores: int) -> list[MafftJob]:
+    """
+    Runs `jobs` from the most costly one, using at most `no_cores` threads at a time - the next job starts once enough
+    cores are free and smaller jobs fill the remaining ones. A failed job is rerun with `--anysymbol`
+    if it was not used. Returns jobs finished successfully.
+    """
+    pending = sorted(jobs, key=lambda job: job.cost, reverse=True)
+    running = []  # [(process, job, start_time)]
+    finished = []
+    free_cores = no_cores
+    while pending or running:
+        job = next((job for job in pending if job.threads <= free_cores), None)
+        if job:
+            pending.remove(job)
+            running.append((start_mafft(mafft, job, is_quiet), job, time.perf_counter()))
+            free_cores -= job.threads
+            continue
+        time.sleep(POLL_INTERVAL)
+        for process, job, start_time in [run for run in running if run[0].poll() is not None]:
+            running.remove((process, job, start_time))
+            free_cores += job.threads
+            telemetry.record("tool", "mafft", cluster=job.file_name.split('/')[-1].split('.')[0],
+                             wall=round(time.perf_counter() - start_time, 6), exit_code=process.returncode,
+                             threads=job.threads, no_sequences=job.no_sequences, length=job.length,
+                             anysymbol=job.anysymbol)
+            if check_mafft_output(process, job):
+                finished.append(job)
+            elif not job.anysymbol:
+                job.anysymbol = True
+                pending.insert(0, job)
+    return finished
+
+
+def start_mafft(mafft: str, job: MafftJob, is_quiet: bool) -> subprocess.Popen:
+    """
+    Starts MAFFT for a given `job` writing the MSA to its output file.
+    """
+    command = [*shlex.split(mafft), *MAFFT_PARAMS.split(), "--thread", str(job.threads)]
+    command += (["--anysymbol"] if job.anysymbol else []) + (["--quiet"] if is_quiet else []) + [job.file_name]
+    with open(job.output_name, "w") as output_file:
+        return subprocess.Popen(command, stdout=output_file)
+
+
+def check_mafft_output(process: subprocess.Popen, job: MafftJob) -> bool:
+    """
+    Checks if MAFFT run of a given `job` (`process`) exited successfully and wrote an MSA. Removes the output if not.
+    """
+    if process.returncode == 0 and os.stat(job.output_name).st_size:
+        return True
+    print(f"MAFFT failed for {job.file_name} (exit status: {process.returncode}).")
+    os.remove(job.output_name)
+    return False
+
+
+def get_mafft_version(mafft: str) -> str:
+    """
+    Returns MAFFT version reported by a given command (`mafft`).
+    """
+    process = subprocess.run(f"{mafft} --version", shell=True, capture_output=True, text=True)
+    return (process.stdout + process.stderr).strip()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+"""
+Exemplary run: `python ./src/get_multistart_supertree.py ./data/one2one/nj_trees_length_less.nwk ./data/one2one/ -f bin/fasturec`
+"""
+import click
+import get_supertree
+import glob
+import multiprocessing
+import numpy as np
+import os
+import random
+import shlex
+import subprocess
+import telemetry
+import tempfile
+import time
+
+from contextlib import ExitStack
+from dataclasses import dataclass
+
+POLL_INTERVAL = 0.1
+
+
+@dataclass
+class FasturecRun:
+    """
+    One Fasturec run started with a given `seed` in its own directory (`run_dir`), with its status
+    ("pending", "finished", "failed" or "stopped") and the lowest cost (with the supertree) it found.
+    """
+    seed: int
+    run_dir: str
+    status: str = "pending"
+    cost: float = None
+    tree: str = None
+
+
+@click.command()
+@click.argument("trees_file")
+@click.argument("output_dir")
+@click.option("-f", "--fasturec_path", "fasturec", default="fasturec", help="Command/path to run Fasturec.")
+@click.option("-n", "--runs", "no_runs", type=click.IntRange(1), required=False,
+              help="Number of Fasturec runs (default: the number of cores).")
+@click.option("-j", "--cores", "cores", type=click.IntRange(1), required=False,
+              help="Number of Fasturec runs at the same time (default: 75% of all cores).")
+@click.option("-t", "--time_limit", "time_limit", type=click.FloatRange(0, min_open=True), required=False,
+              help="Time budget in seconds - runs not finished by then are stopped and not started ones are skipped.")
+@click.option("-a", "--fasturec_args", "fasturec_args", default="-Y",
+              help="Fasturec options (besides `-G`), `{seed}` is replaced with the seed of a run.")
+@click.option("-w", "--work_dir", "work_dir", required=False,
+              help="Directory for temporary directories of runs (default: the system one).")
+@telemetry.stage
+def get_multistart_supertree(trees_file: str, output_dir: str, fasturec: str = "fasturec", no_runs: int = None,
+                             cores: int = None, time_limit: float = None, fasturec_args: str = "-Y",
+                             work_dir: str = None):
+    """
+    This script runs Fasturec `no_runs` times in parallel for trees from `trees_file` (one tree per line), each run
+    in its own temporary directory, and saves the lowest cost supertree of all runs in `output_dir/super_tree.nwk`.
+    Runs start from different input orders of the trees (the first run uses the original order) and get their seeds
+    in `fasturec_args`. Costs found by all runs are saved in `output_dir/supertree_costs.tsv`.
+    """
+    no_cores = cores or max(1, int(0.75 * multiprocessing.cpu_count()))
+    with open(trees_file, "r") as file:
+        trees = [line for line in file if line.strip()]
+    with ExitStack() as run_dirs:
+        runs = [FasturecRun(seed, run_dirs.enter_context(tempfile.TemporaryDirectory(prefix="fasturec_", dir=work_dir)))
+                for seed in range(no_runs or no_cores)]
+        for run in runs:
+            write_trees_file(trees, run)
+        run_fasturec(runs, get_command(fasturec), fasturec_args, no_cores, time_limit)
+        for run in runs:
+            read_run_output(run)
+    write_costs_file(runs, f"{output_dir}/supertree_costs.tsv")
+    finished = [run for run in runs if run.cost is not None]
+    if not finished:
+        raise Exception("No Fasturec run finished!")
+    best_run = min(finished, key=lambda run: run.cost)
+    get_supertree.write_supertree(best_run.tree, output_dir)
+    costs = [run.cost for run in finished]
+    print(f"Supertree costs of {len(finished)}/{len(runs)} Fasturec runs: best {min(costs)} (seed {best_run.seed}), "
+          f"median {np.median(costs)}, worst {max(costs)}.")
+
+
+def get_command(fasturec: str) -> list[str]:
+    """
+    Splits a given command running Fasturec, so it can be run in directories of runs (a relative path is made absolute).
+    """
+    command = shlex.split(fasturec)
+    if os.sep in command[0]:
+        command[0] = os.path.abspath(command[0])
+    return command
+
+
+def write_trees_file(trees: list[str], run: FasturecRun):
+    """
+    Writes `trees` to an input file of a given `run` - shuffled with the run's seed, except for the seed 0.
+    """
+    if run.seed:
+        trees = random.Random(run.seed).sample(trees, len(trees))
+    with open(f"{run.run_dir}/trees.txt", "w") as trees_file:
+        trees_file.writelines(trees)
+
+
+def run_fasturec(runs: list[FasturecRun], fasturec: list[str], fasturec_args: str, no_cores: int,
+                 time_limit: float = None):
+    """
+    Runs Fasturec for all given `runs`, at most `no_cores` at a time, and sets their statuses. After `time_limit`
+    seconds running runs are stopped and pending ones are not started.
+    """
+    deadline = time.monotonic() + time_limit if time_limit else None
+    pending = list(runs)
+    running = []  # [(process, run, start_time)]
+    while pending or running:
+        if deadline and time.monotonic() > deadline:
+            for process, run, start_time in running:
+                process.kill()
+                process.wait()
+                run.status = "stopped"
+                record_run(run, process, start_time)
+            for run in pending:
+                run.status = "stopped"
+            print(f"Time limit exceeded - {len(running)} Fasturec runs stopped, {len(pending)} not started.")
+            return
+        if pending and len(running) < no_cores:
+            run = pending.pop(0)
+            command = fasturec + ["-G", "trees.txt"] + shlex.split(fasturec_args.format(seed=run.seed))
+            running.append((subprocess.Popen(command, cwd=run.run_dir, stdout=subprocess.DEVNULL), run,
+                            time.perf_counter()))
+            continue
+        time.sleep(POLL_INTERVAL)
+        for process, run, start_time in [job for job in running if job[0].poll() is not None]:
+            running.remove((process, run, start_time))
+            run.status = "finished" if process.returncode == 0 else "failed"
+            record_run(run, process, start_time)
+
+
+def record_run(run: FasturecRun, process: subprocess.Popen, start_time: float):
+    """
+    Records wall time and exit code of a given Fasturec `run` in the trace (see `telemetry`).
+    """
+    telemetry.record("tool", "fasturec", seed=run.seed, status=run.status,
+                     wall=round(time.perf_counter() - start_time, 6), exit_code=process.returncode)
+
+
+def read_run_output(run: FasturecRun):
+    """
+    Sets the lowest cost supertree found by a given finished `run`. The run is marked as failed if it has no output.
+    """
+    if run.status != "finished":
+        return
+    try:
+        run.cost, run.tree = get_supertree.get_best_supertree(glob.glob(f"{run.run_dir}/*.fu.txt"))
+    except Exception as e:
+        print(f"Wrong Fasturec output for seed {run.seed}: {e}")
+        run.status = "failed"
+
+
+def write_costs_file(runs: list[FasturecRun], output_name: str):
+    """
+    Saves the seed, status and the lowest cost of every run in a .tsv file.
+    """
+    with open(output_name, "w") as output_file:
+        output_file.write("seed\tstatus\tcost\n")
+        for run in runs:
+            output_file.write(f"{run.seed}\t{run.status}\t{'' if run.cost is None else run.cost}\n")
+
+
+if __name__ == "__main__":
+    get_multistart_supertree()
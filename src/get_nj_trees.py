@@ -1,18 +1,45 @@
 """
 Exemplary run: `python ./src/get_nj_trees.py ./data/clusters/full_msa/ ./data/`
 """
+import alignment_store
 import Bio.Align
 import click
 import glob
+import large_clusters
 import multiprocessing
+import nj_engine
+import numpy as np
 import os
+import result_cache
+import shards
+import telemetry
+import worker_pool
 
-from Bio import Align, AlignIO, Phylo
+from Bio import Align, AlignIO
 from Bio.Phylo.BaseTree import Clade, Tree
 from Bio.Phylo.Consensus import bootstrap_trees, get_support
 from Bio.Phylo.TreeConstruction import DistanceCalculator, DistanceTreeConstructor
+from contextlib import ExitStack
+from dataclasses import dataclass
 from functools import partial
-from typing import Callable
+from itertools import chain
+from typing import Callable, Iterator, TextIO
+
+
+@dataclass
+class ClusterTree:
+    """
+    NJ tree of a cluster returned by workers - in Newick format with and without branch lengths (empty strings
+    if the tree is not saved), with its average bootstrap support, the number of generated bootstrap trees,
+    the number of alignment columns removed before building it and information if it was taken from the cache.
+    """
+    cluster_name: str
+    newick: str
+    length_less: str
+    support: float
+    no_replicates: int
+    no_trimmed: int = 0
+    cached: bool = False
 
 
 @click.command()
@@ -20,31 +47,301 @@ from typing import Callable
 @click.argument("output_dir")
 @click.option("-b", "--bootstrap", "bootstrap", required=False, type=click.FloatRange(0, 100),
               help="Set to use bootstrap. The value is a threshold - trees with average support lower than it won't be saved.")
-def get_nj_trees(input_dir: str, output_dir: str, bootstrap: float):
+@click.option("-t", "--threshold_output", "threshold_outputs", multiple=True, type=(str, click.FloatRange(0, 100)),
+              help="Another output directory and its bootstrap threshold - trees are built once for all outputs (can be given multiple times).")
+@click.option("-e", "--engine", "engine", default="biopython", type=click.Choice(["biopython", "numpy"]),
+              help="Engine used to compute distances and NJ trees. `numpy` is vectorized and gives the same trees.")
+@click.option("-r", "--replicates", "replicates", default=100, type=click.IntRange(1),
+              help="Number of bootstrap trees (the maximal number if `--adaptive` is set).")
+@click.option("-a", "--adaptive", "adaptive", is_flag=True, required=False,
+              help="Set to stop generating bootstrap trees once the threshold decision can no longer change (numpy engine only).")
+@click.option("--error_rate", "error_rate", default=0.05, type=click.FloatRange(0, 1, min_open=True, max_open=True),
+              help="Probability of a wrong decision allowed by `--adaptive`.")
+@click.option("-l", "--large_cluster", "large_cluster", default=300, type=click.IntRange(0),
+              help="Clusters with at least this number of sequences are split into sub-tasks run on all cores (numpy engine only, 0 to disable).")
+@click.option("--large_jobs", "large_jobs", default=4, type=click.IntRange(1),
+              help="Maximal number of large clusters processed at the same time (their alignments and distance matrices are kept in shared memory).")
+@click.option("--rapid_nj", "rapid_nj", default=1000, type=click.IntRange(0),
+              help="Clusters with at least this number of sequences use rapid NJ with bounded search (numpy engine only, 0 to disable).")
+@click.option("--max_gaps", "max_gaps", required=False, type=click.FloatRange(0, 1),
+              help="Set to remove alignment columns with a higher fraction of gaps before building trees.")
+@click.option("--conserved", "conserved", required=False, type=click.FloatRange(0, 1, min_open=True),
+              help="Set to remove alignment columns with one residue in at least this fraction of sequences before building trees (1 removes constant columns).")
+@click.option("-s", "--store", "store", is_flag=True, required=False,
+              help="Set to read MSAs from the packed alignment store written by `get_msa.py` in `input_dir` (numpy engine only).")
+@click.option("-c", "--cache_dir", "cache_dir", required=False,
+              help="Set to reuse trees of clusters built before with the same parameters (cache directory).")
+@click.option("--cache_size", "cache_size", default=10000, type=click.IntRange(0),
+              help="Maximal size of the cache in MB - the least recently used results are removed.")
+@click.option("-j", "--cores", "cores", type=click.IntRange(1), required=False,
+              help="Number of worker processes (default: 75% of all cores).")
+@click.option("--shard", "shard", callback=shards.parse_shard, required=False,
+              help="Set (as i/N) to build only trees of clusters of shard i of N and save them in `shards/i_of_N/` of every output.")
+@telemetry.stage
+def get_nj_trees(input_dir: str, output_dir: str, bootstrap: float, threshold_outputs: tuple[tuple[str, float]] = (),
+                 engine: str = "biopython", replicates: int = 100,
+                 adaptive: bool = False, error_rate: float = 0.05, large_cluster: int = 300, large_jobs: int = 4,
+                 rapid_nj: int = 1000, max_gaps: float = None, conserved: float = None, store: bool = False,
+                 cache_dir: str = None, cache_size: int = 10000, cores: int = None, shard: tuple[int, int] = None):
+    """
+    This script takes .fasta files with MSAs from a `input_dir` and saves created trees in `output_dir/nj_trees.nwk`
+    and, without branch lengths and inner node names (as required by Fasturec),
+    in `output_dir/nj_trees_length_less.nwk`. Each tree is built once and also saved in every directory
+    from `threshold_outputs` whose bootstrap threshold its average support reaches. Trees are written by the main
+    process as workers return them (of the pool shared by stages run in one process, see `worker_pool`). Clusters
+    are processed from the largest one. With the numpy engine, distance matrices, bootstrap trees and NJ of large
+    clusters are computed by all workers (bootstrap trees of them are not stopped early by `--adaptive`), at most
+    `large_jobs` clusters at a time. If bootstrap is used, numbers of bootstrap trees generated for each cluster are
+    saved in `bootstrap_replicates.tsv` of every output with a threshold. If `cache_dir` is set, trees
+    (or decisions not to save them) of alignments with the same content as in previous runs are taken from it.
+    If `store` is set, alignments are memory-mapped from the packed store in `input_dir` instead of being parsed
+    from .fasta files. If `max_gaps` or `conserved` is set, uninformative columns are removed from every alignment
+    before distances and bootstrap trees are computed (see `nj_engine.trim_alignment`) and numbers of removed columns
+    are saved in `trimmed_columns.tsv` of every output. With `shard`, only clusters of the shard (see `shards`)
+    are processed and the shard is marked as completed in every output, so it is not processed again. Shards are
+    combined by `merge_shards.py`.
+    """
+    if adaptive and engine != "numpy":
+        raise click.UsageError("`--adaptive` requires `--engine numpy`.")
+    if store and engine != "numpy":
+        raise click.UsageError("`--store` requires `--engine numpy`.")
+    if store:
+        inputs = sorted(alignment_store.read_store_index(input_dir),
+                        key=lambda alignment: alignment.shape[0] * alignment.shape[1], reverse=True)
+    else:
+        inputs = sorted(glob.glob(f"{input_dir}/*.fasta"), key=os.path.getsize, reverse=True)
+    outputs = [(output_dir, bootstrap)] + list(threshold_outputs)
+    if shard:
+        outputs = [(shards.get_shard_dir(output, shard), threshold) for output, threshold in outputs]
+        if all(shards.is_done(output) for output, _ in outputs):
+            print(f"Shard {shard[0]}/{shard[1]} is already completed.")
+            return
+        inputs = [source for source in inputs if shards.get_shard_index(get_cluster_name(source), shard[1]) == shard[0]]
+    thresholds = [threshold for _, threshold in outputs]
+    for output, _ in outputs:
+        if os.path.dirname(f"{output}/"):
+            os.makedirs(os.path.dirname(f"{output}/"), exist_ok=True)
+    large_inputs, small_inputs = [], inputs
+    if engine == "numpy" and large_cluster:
+        large_inputs, small_inputs = large_clusters.split_clusters(inputs, large_cluster)
+    cache = None
+    if cache_dir:
+        cache = result_cache.ResultCache(cache_dir, "nj", get_cache_params(engine, thresholds, replicates,
+                                                                          error_rate if adaptive else None, rapid_nj,
+                                                                          max_gaps, conserved, large_cluster))
+    cached_trees, large_keys = [], {}
+    if cache:
+        for source in list(large_inputs):
+            large_keys[get_cluster_name(source)] = key = get_source_key(cache, source, input_dir)
+            cached = read_cached_tree(cache, key, get_cluster_name(source))
+            if cached is not None:
+                large_inputs.remove(source)
+                cached_trees.append(cached)
+    no_cores = cores or max(1, int(0.75*multiprocessing.cpu_count()))
+    pool = worker_pool.get_pool(no_cores)
+    with ExitStack() as files:
+        large_trimmed = {}
+        large_alignments = read_large_clusters(large_inputs, input_dir, max_gaps, conserved, large_trimmed)
+        jobs = large_clusters.submit_large_clusters(pool, large_alignments, thresholds, replicates, no_cores, rapid_nj,
+                                                    large_jobs)
+        if store:
+            tree_func = partial(get_trimmed_nj_tree, replicates=replicates, error_rate=error_rate if adaptive else None,
+                                rapid_nj=rapid_nj, max_gaps=max_gaps, conserved=conserved)
+            build_func = partial(build_stored_tree, tree_func, thresholds, input_dir, cache=cache)
+        else:
+            tree_func = partial(get_nj_tree, engine=engine, replicates=replicates, error_rate=error_rate if adaptive else None,
+                                rapid_nj=rapid_nj, max_gaps=max_gaps, conserved=conserved)
+            build_func = partial(build_tree, tree_func, thresholds, cache=cache)
+        small_trees = pool.imap(build_func, small_inputs, chunksize=1)
+        large_trees = (build_large_cluster_tree(job, cache, large_keys.get(job.cluster_name),
+                                                large_trimmed[job.cluster_name]) for job in jobs)
+        trees_files = [(files.enter_context(open(f"{output}/nj_trees.nwk", "w")),
+                        files.enter_context(open(f"{output}/nj_trees_length_less.nwk", "w")), threshold)
+                       for output, threshold in outputs]
+        replicates_used, trimmed_columns, no_hits = [], [], 0
+        for cluster_tree in chain(cached_trees, large_trees, small_trees):
+            write_tree(trees_files, cluster_tree)
+            replicates_used.append((cluster_tree.cluster_name, cluster_tree.no_replicates))
+            trimmed_columns.append((cluster_tree.cluster_name, cluster_tree.no_trimmed))
+            no_hits += cluster_tree.cached
+    if cache:
+        cache.report(no_hits, len(replicates_used))
+        result_cache.evict(cache_dir, cache_size * 2**20)
+    if any(thresholds):
+        write_replicates_file(replicates_used, [f"{output}/bootstrap_replicates.tsv" for output, threshold in outputs
+                                                if threshold])
+    if max_gaps is not None or conserved is not None:
+        write_trimmed_file(trimmed_columns, [f"{output}/trimmed_columns.tsv" for output, _ in outputs])
+    if shard:
+        for output, _ in outputs:
+            shards.mark_done(output, len(replicates_used))
+
+
+def build_tree(tree_func: Callable, thresholds: list[float], mafft_file: str,
+               cache: result_cache.ResultCache = None) -> ClusterTree:
+    """
+    Builds tree with `tree_func` using an alignment from `mafft_file` for outputs with given bootstrap `thresholds`.
+    Trees with any branch with a negative length value are not saved. If `cache` is given, the tree is taken from it
+    if possible and saved in it otherwise.
+    """
+    key = cache.get_key(mafft_file) if cache else None
+    return build_cluster_tree(lambda: tree_func(read_mafft_output(mafft_file), thresholds), get_cluster_name(mafft_file),
+                              cache, key)
+
+
+def build_stored_tree(tree_func: Callable, thresholds: list[float], store_dir: str,
+                      alignment: alignment_store.StoredAlignment, cache: result_cache.ResultCache = None) -> ClusterTree:
+    """
+    Builds tree with `tree_func` (taking an encoded alignment, sequence ids and thresholds, see `get_trimmed_nj_tree`)
+    using a given `alignment` memory-mapped from the store in `store_dir` in the same way as `build_tree` does.
+    """
+    key = get_source_key(cache, alignment, store_dir) if cache else None
+    return build_cluster_tree(lambda: tree_func(*read_encoded_alignment(alignment, store_dir), thresholds),
+                              alignment.name, cache, key)
+
+
+def build_large_cluster_tree(job: large_clusters.LargeClusterJob, cache: result_cache.ResultCache = None,
+                             key: str = None, no_trimmed: int = 0) -> ClusterTree:
+    """
+    Returns tree of a large cluster built by tasks of a given `job` in the same way as `build_tree` does.
+    `no_trimmed` is the number of columns removed from its alignment before the job was submitted.
+    """
+    return build_cluster_tree(lambda: (*large_clusters.get_large_cluster_tree(job), no_trimmed), job.cluster_name,
+                              cache, key)
+
+
+def read_large_clusters(sources: list[str | alignment_store.StoredAlignment], store_dir: str, max_gaps: float,
+                        conserved: float, no_trimmed: dict[str, int]) -> Iterator[tuple[str, np.ndarray, list[str]]]:
+    """
+    Yields names, encoded alignments (with columns removed with `max_gaps` and `conserved` thresholds, see
+    `nj_engine.trim_alignment`) and sequence ids of clusters from `sources`, reading each one only when it is needed.
+    Numbers of removed columns are saved in `no_trimmed`.
+    """
+    for source in sources:
+        encoded, names = read_encoded_alignment(source, store_dir)
+        encoded, no_trimmed[get_cluster_name(source)] = nj_engine.trim_alignment(encoded, max_gaps, conserved)
+        yield get_cluster_name(source), encoded, names
+
+
+def build_cluster_tree(get_tree: Callable[[], tuple[Tree, float, int, int]], cluster_name: str,
+                       cache: result_cache.ResultCache = None, key: str = None) -> ClusterTree:
+    """
+    Returns tree of a given cluster built (with its average bootstrap support, the number of bootstrap trees
+    and the number of removed alignment columns) by `get_tree` or taken from `cache`. Trees with any branch
+    with a negative length value are not saved.
+    """
+    cached = read_cached_tree(cache, key, cluster_name) if cache else None
+    if cached is not None:
+        return cached
+    with telemetry.measure("cluster", cluster_name) as fields:
+        tree, support, no_replicates, no_trimmed = get_tree()
+        fields.update(support=support, replicates=no_replicates, trimmed=no_trimmed, saved=bool(tree))
+    is_saved = bool(tree and check_nj_tree(tree))
+    cluster_tree = ClusterTree(cluster_name, get_newick(tree) if is_saved else "",
+                               get_newick(tree, lengths=False) if is_saved else "", support, no_replicates, no_trimmed)
+    if cache:
+        write_cached_tree(cache, key, cluster_tree)
+    return cluster_tree
+
+
+def write_tree(trees_files: list[tuple[TextIO, TextIO, float]], cluster_tree: ClusterTree):
     """
-    This script takes .fasta files with MSAs from a `input_dir` and saves created trees in `output_dir`.
+    Writes a given tree (if it is saved) to every pair of files from `trees_files` ([(trees_file, length_less_file,
+    threshold)]) without a threshold or with a threshold not higher than the tree's average bootstrap support.
     """
-    input_files = glob.glob(f"{input_dir}/*.fasta")
-    if os.path.dirname(f"{output_dir}/nj_trees/"):
-        os.makedirs(os.path.dirname(f"{output_dir}/nj_trees/"), exist_ok=True)
-    no_cores = int(0.75*multiprocessing.cpu_count())
-    with multiprocessing.Pool(no_cores) as pool:
-        pool.map(partial(save_tree, get_nj_tree, output_dir, bootstrap), input_files)
-    output_name = f"{output_dir}/nj_trees.nwk"
-    write_trees_file(f"{output_dir}/nj_trees/", output_name)
-    write_length_less_trees_file(output_name, output_dir)
+    for trees_file, length_less_file, threshold in trees_files:
+        if cluster_tree.newick and (not threshold or cluster_tree.support >= threshold):
+            trees_file.write(f"{cluster_tree.newick};\n")
+            length_less_file.write(f"{cluster_tree.length_less}\n")
 
 
-def save_tree(tree_func: Callable, output_name: str, bootstrap: float, mafft_file: str):
+def get_newick(tree: Tree, lengths: bool = True) -> str:
     """
-    Saves tree created with `tree_func` using an alignment from `mafft_file` as `output_name`.
-    Trees with any branch with a negative length value are not saved.
+    Returns a given `tree` in Newick format without the final `;` and with "$" (used to differentiate headers)
+    removed from leaf names. With `lengths`, inner node names and branch lengths are written as Biopython writes them,
+    otherwise only the topology is written.
     """
-    output_name = f"{output_name}/nj_trees/{mafft_file.split('/')[-1].split('.')[0]}.nwk"
-    alignment = read_mafft_output(mafft_file)
-    tree = tree_func(alignment, bootstrap)
-    if tree and check_nj_tree(tree):
-        Phylo.write(tree, output_name, "newick")
+    tokens = []
+    stack = [(tree.root, 0)]
+    while stack:
+        clade, i = stack.pop()
+        if i < len(clade.clades):
+            tokens.append("," if i else "(")
+            stack.append((clade, i + 1))
+            stack.append((clade.clades[i], 0))
+            continue
+        if clade.clades:
+            tokens.append(")")
+            tokens.append((clade.name or "") if lengths else "")
+        else:
+            tokens.append("".join(clade.name.split("$")))
+        if lengths:
+            tokens.append(f":{clade.branch_length or 0:1.5f}")  # Biopython writes a missing length as 0
+    return "".join(tokens)
+
+
+def get_cluster_name(source: str | alignment_store.StoredAlignment) -> str:
+    """
+    Returns a name of a cluster from a given .fasta file name or alignment from the store (`source`).
+    """
+    if isinstance(source, alignment_store.StoredAlignment):
+        return source.name
+    return source.split('/')[-1].split('.')[0]
+
+
+def read_encoded_alignment(source: str | alignment_store.StoredAlignment, store_dir: str) -> tuple[np.ndarray, list[str]]:
+    """
+    Returns an alignment from a given .fasta file or the store in `store_dir` (`source`) encoded as a uint8 matrix
+    with sequence ids.
+    """
+    if isinstance(source, alignment_store.StoredAlignment):
+        return alignment_store.get_alignment(store_dir, source), source.names
+    return nj_engine.encode_alignment(read_mafft_output(source))
+
+
+def get_source_key(cache: result_cache.ResultCache, source: str | alignment_store.StoredAlignment, store_dir: str) -> str:
+    """
+    Returns a `cache` key of a tree for a given .fasta file or alignment from the store in `store_dir` (`source`).
+    """
+    if isinstance(source, alignment_store.StoredAlignment):
+        encoded = np.ascontiguousarray(alignment_store.get_alignment(store_dir, source))
+        return cache.get_data_key("\t".join(source.names).encode(), str(source.shape).encode(), encoded)
+    return cache.get_key(source)
+
+
+def get_cache_params(engine: str, thresholds: list[float], replicates: int, error_rate: float, rapid_nj: int,
+                     max_gaps: float = None, conserved: float = None, large_cluster: int = None) -> str:
+    """
+    Returns versions of libraries and parameters trees built by `get_nj_tree` (or `large_clusters` for clusters
+    with at least `large_cluster` sequences) depend on.
+    """
+    numpy_engine = engine == "numpy"
+    return f"{engine} biopython={Bio.__version__} numpy={np.__version__} thresholds={sorted(thresholds, key=str)} " \
+           f"replicates={replicates} error_rate={error_rate} rapid_nj={rapid_nj if numpy_engine else None} " \
+           f"max_gaps={max_gaps} conserved={conserved} large_cluster={large_cluster if numpy_engine else None}"
+
+
+def read_cached_tree(cache: result_cache.ResultCache, key: str, cluster_name: str) -> ClusterTree:
+    """
+    Returns a tree of a given cluster with a given `key` from `cache` or None if it is not cached.
+    """
+    cached = cache.get(key)
+    lines = cached.decode().split("\n") if cached is not None else []
+    if len(lines) != 4:  # not cached or saved in an older format
+        return None
+    header, newick, length_less, _ = lines
+    no_replicates, support, no_trimmed = header.split("\t")
+    return ClusterTree(cluster_name, newick, length_less, None if support == "None" else float(support),
+                       int(no_replicates), int(no_trimmed), cached=True)
+
+
+def write_cached_tree(cache: result_cache.ResultCache, key: str, cluster_tree: ClusterTree):
+    """
+    Saves a given tree with its average bootstrap support, the number of generated bootstrap trees and the number
+    of removed alignment columns in `cache`.
+    """
+    cache.put(key, f"{cluster_tree.no_replicates}\t{cluster_tree.support}\t{cluster_tree.no_trimmed}\n"
+                   f"{cluster_tree.newick}\n{cluster_tree.length_less}\n".encode())
 
 
 def read_mafft_output(mafft_file: str) -> Align.MultipleSeqAlignment:
@@ -64,10 +361,11 @@ def check_nj_tree(tree: Tree) -> bool:
 
 def check_nj_clade(clade: Clade) -> bool:
     """
-    Checks if any of a given clade's branches has a negative length value. Returns True if not.
+    Checks if any of a given clade's branches has a negative length value. Returns True if not. A missing length
+    (of the root of a tree of two sequences) is not negative.
     """
     clades = clade.clades
-    if clade.branch_length < 0:
+    if clade.branch_length is not None and clade.branch_length < 0:
         return False
     elif clades:
         return sum([check_nj_clade(c) for c in clades]) / len(clades) == 1
@@ -75,27 +373,62 @@ def check_nj_clade(clade: Clade) -> bool:
         return True
 
 
-def get_nj_tree(alignment: Bio.Align.MultipleSeqAlignment, bootstrap: float) -> Tree:
+def get_nj_tree(alignment: Bio.Align.MultipleSeqAlignment, thresholds: list[float], engine: str = "biopython",
+                replicates: int = 100, error_rate: float = None, rapid_nj: int = None, max_gaps: float = None,
+                conserved: float = None) -> tuple[Tree, float, int, int]:
     """
-    Returns tree for a given MSA (`alignment`).
+    Returns tree for a given MSA (`alignment`) built with a given `engine` ("biopython" or "numpy"), average support
+    of its bootstrap trees (None if no output has a threshold), the number of generated bootstrap trees and
+    the number of alignment columns removed before building it with `max_gaps` and `conserved` thresholds
+    (see `nj_engine.trim_alignment`). `thresholds` are bootstrap thresholds of outputs (None for an output without
+    bootstrap) - the tree is None if its support is lower than all of them. The "numpy" engine also computes bootstrap
+    support with clade bitmasks instead of `Bio.Phylo.Consensus`, stops generating bootstrap trees early
+    if `error_rate` is set and uses rapid NJ for alignments with at least `rapid_nj` sequences.
     """
+    if engine == "numpy":
+        return get_trimmed_nj_tree(*nj_engine.encode_alignment(alignment), thresholds, replicates, error_rate, rapid_nj,
+                                   max_gaps, conserved)
+    no_trimmed = 0
+    if max_gaps is not None or conserved is not None:
+        encoded, names = nj_engine.encode_alignment(alignment)
+        encoded, no_trimmed = nj_engine.trim_alignment(encoded, max_gaps, conserved)
+        alignment = nj_engine.decode_alignment(encoded, names)
+    telemetry.add_fields(no_sequences=len(alignment), length=alignment.get_alignment_length())
+    bootstrap = [threshold for threshold in thresholds if threshold]
+    support = None
+    if bootstrap:
+        with telemetry.measure("step", "bootstrap", replicates=replicates):
+            support = get_bootstrap_support(alignment, replicates)
+        if len(bootstrap) == len(thresholds) and support < min(bootstrap):
+            return None, support, replicates, no_trimmed
     constructor = DistanceTreeConstructor()
     calculator = DistanceCalculator('identity')
-    if not bootstrap or check_bootstrap(alignment, bootstrap):
-        return constructor.nj(calculator.get_distance(alignment))
+    with telemetry.measure("step", "nj"):
+        tree = constructor.nj(calculator.get_distance(alignment))
+    return tree, support, replicates if bootstrap else 0, no_trimmed
 
 
-def check_bootstrap(alignment: Bio.Align.MultipleSeqAlignment, bootstrap: float) -> bool:
+def get_trimmed_nj_tree(encoded: np.ndarray, names: list[str], thresholds: list[float], replicates: int = 100,
+                        error_rate: float = None, rapid_nj: int = None, max_gaps: float = None,
+                        conserved: float = None) -> tuple[Tree, float, int, int]:
     """
-    Generates 100 bootstrap trees for given alignment and returns True if average support value for then is
-    higher or equal given `bootstrap` value.
+    Returns tree for an alignment encoded as a uint8 matrix (`encoded`) with sequence ids (`names`) built
+    by `nj_engine.get_encoded_nj_tree` after removing columns with `max_gaps` and `conserved` thresholds
+    (see `nj_engine.trim_alignment`), together with the number of removed columns.
+    """
+    encoded, no_trimmed = nj_engine.trim_alignment(encoded, max_gaps, conserved)
+    return (*nj_engine.get_encoded_nj_tree(encoded, names, thresholds, replicates, error_rate, rapid_nj), no_trimmed)
+
+
+def get_bootstrap_support(alignment: Bio.Align.MultipleSeqAlignment, times: int = 100) -> float:
+    """
+    Generates `times` (100 by default) bootstrap trees for given alignment and returns average support value for them.
     """
     calculator = DistanceCalculator('identity')
     constructor = DistanceTreeConstructor(calculator)
-    trees = list(bootstrap_trees(alignment, 100, constructor))
+    trees = list(bootstrap_trees(alignment, times, constructor))
     avg_supps = [get_avg_supp(get_support(tree, trees)) for tree in trees]
-    if sum(avg_supps) / len(trees) >= bootstrap:
-        return True
+    return sum(avg_supps) / len(trees)
 
 
 def get_avg_supp(tree: Tree) -> float:
@@ -123,30 +456,28 @@ def get_clade_support(clade: Clade) -> tuple[float, int]:
         return 0, 0
 
 
-def write_trees_file(trees_dir: str, output_name: str):
+def write_replicates_file(replicates_used: list[tuple[str, int]], output_names: list[str]):
     """
-    Saves all trees from all .nwk files in a given directory to one .nwk file.
+    Saves the number of bootstrap trees generated for each cluster (`replicates_used`: [(cluster_name, no_replicates)])
+    to .tsv files (`output_names`) and prints the total.
     """
-    tree_files = glob.glob(f"{trees_dir}/*.nwk")
-    with open(output_name, "a") as output_file:
-        for tree_file in tree_files:
-            with open(tree_file, "r") as input_file:
-                for line in input_file:
-                    output_file.write("".join(line.split("$")))  # remove all `$` used to differentiate headers
+    for output_name in output_names:
+        with open(output_name, "w") as output_file:
+            for cluster_name, no_replicates in replicates_used:
+                output_file.write(f"{cluster_name}\t{no_replicates}\n")
+    print(f"Bootstrap trees generated: {sum(no for _, no in replicates_used)} for {len(replicates_used)} clusters.")
 
 
-def write_length_less_trees_file(trees_file: str, output_dir: str):
+def write_trimmed_file(trimmed_columns: list[tuple[str, int]], output_names: list[str]):
     """
-    Modifies given .nwk file to a format required for Fasturec - without branch lengths and Inner nodes.
+    Saves the number of alignment columns removed for each cluster (`trimmed_columns`: [(cluster_name, no_trimmed)])
+    to .tsv files (`output_names`) and prints the total.
     """
-    tmp_name = f"{output_dir}/tmp_nj_trees_length_less.nwk"
-    output_name = f"{output_dir}/nj_trees_length_less.nwk"
-    os.system(f"perl -ne '$_=~s/:[\d\.]+//g; print $_;' {output_dir}/nj_trees.nwk > {tmp_name}")
-    with open(tmp_name, "r") as tmp_file, open(output_name, "w") as output_file:
-        for line in tmp_file:
-            line_parts = line.strip().strip(";").split("Inner")
-            output_file.write(f"{''.join([part.strip('1234567890') for part in line_parts])}\n")
-    os.remove(tmp_name)
+    for output_name in output_names:
+        with open(output_name, "w") as output_file:
+            for cluster_name, no_trimmed in trimmed_columns:
+                output_file.write(f"{cluster_name}\t{no_trimmed}\n")
+    print(f"Alignment columns removed: {sum(no for _, no in trimmed_columns)} for {len(trimmed_columns)} clusters.")
 
 
 if __name__ == "__main__":
@@ -2,75 +2,167 @@
 Exemplary run: `python ./src/get_proteomes.py ./data/organisms.txt ./data/`
 """
 import click
-import glob
+import gzip
 import os
-import subprocess
+import telemetry
+import threading
 import time
-import wget
+import urllib.request
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from http.client import IncompleteRead
+from typing import Iterable, Iterator
+from urllib.error import HTTPError, URLError
+
+DATABASES = {
+    "UniProtKB": "{base_url}/uniprotkb/stream?compressed=true&download=true&format=fasta&query=%28%28proteome%3A{id}%29%29",
+    "UniParc": "{base_url}/uniparc/stream?compressed=true&download=true&format=fasta&query=%28%28upid%3A{id}%29%29",
+}
+CHUNK_SIZE = 1 << 16
+TIMEOUT = 60
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by all download threads - every request takes a token and tokens are refilled
+    at `rate` per second up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
 
 
 @click.command()
 @click.argument("species_file")
 @click.argument("output_path")
-def get_proteomes(species_file: str, output_path: str):
+@click.option("-j", "--jobs", "jobs", default=4, type=click.IntRange(1),
+              help="Maximal number of proteomes downloaded at the same time.")
+@click.option("--rate", "rate", default=1.0, type=click.FloatRange(0, min_open=True),
+              help="Maximal number of requests sent per second.")
+@click.option("--retries", "retries", default=5, type=click.IntRange(0),
+              help="Number of retries of an interrupted download (each one resumes it).")
+@click.option("--base_url", "base_url", default="https://rest.uniprot.org", help="UniProt REST API address.")
+@telemetry.stage
+def get_proteomes(species_file: str, output_path: str, jobs: int = 4, rate: float = 1.0, retries: int = 5,
+                  base_url: str = "https://rest.uniprot.org"):
     """
     The script reads a given file with species names (`species_file`) and downloads their proteomes from UniProt,
     merges them to one file and saves it in a desired directory (`output_path`).
+    Proteomes are downloaded concurrently and interrupted downloads are resumed, also by rerunning the script.
     File format: one line - one name.
     """
     proteomes_dir = f"{output_path}/proteomes/"
-    download_proteomes(get_ids(get_species(species_file)), proteomes_dir)
-    write_proteomes_file(proteomes_dir, f"{output_path}/proteomes.fasta")
+    if os.path.dirname(proteomes_dir):
+        os.makedirs(os.path.dirname(proteomes_dir), exist_ok=True)
+    proteomes = download_proteomes(get_ids(get_species(species_file)), proteomes_dir, jobs, TokenBucket(rate),
+                                   base_url, retries)
+    write_proteomes_file(proteomes, f"{output_path}/proteomes.fasta")
 
 
-def download_proteomes(ids: list[str], output_path: str):
+def download_proteomes(ids: list[str], output_path: str, jobs: int, bucket: TokenBucket,
+                       base_url: str = "https://rest.uniprot.org", retries: int = 5) -> Iterator[tuple[str, str]]:
+    """
+    Downloads proteomes for given ids from UniProtKB (if not possible - from UniParc) in `jobs` threads
+    and yields (id, file_name) of every received proteome as soon as it and all proteomes before it are downloaded.
+    """
+    missing = []
+    with ThreadPoolExecutor(jobs) as executor:
+        download = partial(download_proteome, output_path=output_path, bucket=bucket, base_url=base_url, retries=retries)
+        for id, (db, file_name) in zip(ids, executor.map(download, ids)):
+            if db:
+                print(f"Proteome for {id} downloaded from {db}.")
+                yield id, file_name
+            else:
+                missing.append(id)
+    if missing:
+        print(f"Could not receive proteome for: {missing}")
+
+
+def download_proteome(id: str, output_path: str, bucket: TokenBucket, base_url: str = "https://rest.uniprot.org",
+                      retries: int = 5) -> tuple[str, str]:
+    """
+    Downloads a proteome for a given id from the first database (UniProtKB, then UniParc) returning a non-empty file
+    and returns the database name and the file name (None, None if not possible). Downloaded files are reused.
+    """
+    for db, url in DATABASES.items():
+        file_name = f"{output_path}/{id}.{db}.fasta.gz"
+        if not os.path.exists(file_name):
+            try:
+                with telemetry.measure("step", "download", proteome=id, db=db):
+                    download_file(url.format(base_url=base_url, id=id), file_name, bucket, retries)
+                    telemetry.add_fields(size=os.path.getsize(file_name))
+            except Exception as e:
+                print(f"Could not download proteome for {id} from {db}: {e}")
+                continue
+        if check_proteome(file_name):
+            return db, file_name
+    return None, None
+
+
+def download_file(url: str, file_name: str, bucket: TokenBucket, retries: int = 5):
     """
-    Downloads proteomes for given ids from UniProtKB. If not possible tries to proteomes from UniParc.
+    Downloads a given `url` to `file_name` through a `.part` file. An interrupted download is retried up to `retries`
+    times, each time resuming from the end of the `.part` file with an HTTP range request.
     """
-    if os.path.dirname(output_path):
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    for id in ids:
-        file_name = f"{output_path}/{id}.fasta.gz"
+    part_name = f"{file_name}.part"
+    for attempt in range(retries + 1):
+        size = os.path.getsize(part_name) if os.path.exists(part_name) else 0
+        request = urllib.request.Request(url, headers={"Range": f"bytes={size}-"} if size else {})
+        bucket.acquire()
         try:
-            db = download_from_UniProtKB(id, file_name)
-        except IncompleteRead:
-            continue
-        except Exception as e:
-            print(e)
-            os.remove(file_name)
-            db = download_from_UniParc(id, file_name)
-        finally:
-            decompress(file_name)
-            time.sleep(10)
-
-        if os.stat(file_name.split(".gz")[0]).st_size == 0:
-            subprocess.run(["rm", f"{file_name.split('.gz')[0]}"])
-            db = download_from_UniParc(id, file_name)
-            decompress(file_name)
-        print(f"Proteome for {id} downloaded from {db}.")
-        print("---")
-    empty_files = [file_name.split(".")[0] for file_name in glob.glob(f"{output_path}/*.fasta")
-                   if os.stat(file_name).st_size == 0]
-    if empty_files:
-        print(f"Could not receive proteome for: {empty_files}")
-
-
-def download_from_UniProtKB(id: str, file_name: str) -> str:
-    wget.download(f"https://rest.uniprot.org/uniprotkb/stream?compressed=true&download=true&format=fasta&query=%28%28proteome%3A{id}%29%29",
-                  out=file_name)
-    return "UniProtKB"
-
-
-def download_from_UniParc(id: str, file_name: str) -> str:
-    wget.download(f"https://rest.uniprot.org/uniparc/stream?compressed=true&download=true&format=fasta&query=%28%28upid%3A{id}%29%29",
-                  out=file_name)
-    return "UniParc"
-
-
-def decompress(file_name: str):
-    os.popen(f"gunzip -f {file_name}")
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response, \
+                    open(part_name, "ab" if response.status == 206 else "wb") as part_file:
+                expected = response.headers.get("Content-Length")
+                received = 0
+                while chunk := response.read(CHUNK_SIZE):
+                    received += part_file.write(chunk)
+                if expected is not None and received < int(expected):
+                    raise IncompleteRead(b"", int(expected) - received)
+            break
+        except HTTPError as e:
+            if e.code == 416 and size:  # nothing left to download
+                break
+            if e.code < 500 and e.code != 429 or attempt == retries:
+                raise
+        except (IncompleteRead, URLError, ConnectionError, TimeoutError):
+            if attempt == retries:
+                raise
+        time.sleep(min(2 ** attempt, 60))
+    os.replace(part_name, file_name)
+
+
+def check_proteome(file_name: str) -> bool:
+    """
+    Checks if a given .fasta.gz file contains any sequence. Removes the file and returns False if not.
+    """
+    try:
+        with gzip.open(file_name, "rt") as proteome_file:
+            if any(line.strip() for line in proteome_file):
+                return True
+    except (OSError, EOFError) as e:
+        print(f"Wrong proteome file {file_name}: {e}")
+    os.remove(file_name)
+    return False
 
 
 def get_ids(species: list[str]) -> list[str]:
@@ -89,19 +181,20 @@ def get_species(species_file: str) -> list[str]:
         return [line.strip() for line in file if line.strip()]
 
 
-def write_proteomes_file(proteomes_dir: str, output_name: str):
+def write_proteomes_file(proteomes: Iterable[tuple[str, str]], output_name: str):
     """
-    Saves all proteomes from all .fasta files in a given directory to one .fasta file.
+    Decompresses all given proteomes (`proteomes`: [(id, file_name)]) straight into one .fasta file.
     Adds proteome UniProt ID at the end of every header.
     """
-    for file_name in glob.glob(f"{proteomes_dir}/*.fasta"):
-        with open(file_name, "r") as proteome_file, open(output_name, "a") as output_file:
-            for line in proteome_file:
-                if line.strip():
-                    if line.startswith(">"):
-                        output_file.write(f"{line.strip()} {file_name.split('/')[-1].split('.')[0]}\n")
-                    else:
-                        output_file.write(line)
+    with open(output_name, "w") as output_file:
+        for id, file_name in proteomes:
+            with gzip.open(file_name, "rt") as proteome_file:
+                for line in proteome_file:
+                    if line.strip():
+                        if line.startswith(">"):
+                            output_file.write(f"{line.strip()} {id}\n")
+                        else:
+                            output_file.write(line)
 
 
 if __name__ == "__main__":
@@ -1,35 +1,66 @@
 """
-Exemplary run: `python ./src/get_rf.py ./data/timetree/organisms_timetree.nwk ./data/ -t ./data/one2one/consensus_tree.nwk`
+Exemplary run: `python ./src/get_rf.py ./data/timetree/organisms_timetree.nwk ./data/ -t ./data/one2one/consensus_tree.nwk -g ./data/one2one/nj_trees.nwk -r ./data/ref_tree.nwk`
 """
+import bipartitions
 import click
-
-from ete3 import Tree
+import numpy as np
+import telemetry
 
 
 @click.command()
 @click.argument("original_tree")
 @click.argument("output_dir")
 @click.option("-t", "trees", multiple=True, help="Path to a .nwk tree to compare with `original_tree`.")
-def get_rf(original_tree: str, output_dir: str, trees: tuple):
+@click.option("-g", "gene_trees", multiple=True,
+              help="Path to a .nwk file with many trees (e.g. NJ trees) to compare with `original_tree` and all `-t` trees.")
+@click.option("-r", "references", multiple=True,
+              help="Path to another reference .nwk tree - reports are saved for it in the same way as for `original_tree`.")
+@telemetry.stage
+def get_rf(original_tree: str, output_dir: str, trees: tuple, gene_trees: tuple, references: tuple = ()):
     """
     This script computes Robinson-Folds distance between `original_tree` and each .nwk trees from a given `trees` tuple
-    and saves the output in `output_dir/report.txt`.
+    and saves the output in `output_dir/report_<original tree name>.txt`.
+    It also saves RF and normalized RF (RF / RF max) of all trees (including `gene_trees`) against `original_tree`
+    and `trees` in `output_dir/rf_matrix_<original tree name>.tsv`. The same files are saved for every tree
+    from `references`, compared with `trees` and the other reference trees. Every file is parsed only once
+    and distances are computed once for all reference trees.
+    """
+    taxa = {}
+    species_files = [original_tree, *references, *trees]
+    species_trees = [bipartitions.get_split_tree(tree, next(bipartitions.read_newick_trees(tree)), taxa)
+                     for tree in species_files]
+    all_trees = species_trees + [tree for file in gene_trees for tree in bipartitions.read_split_trees(file, taxa)]
+    rf, max_rf = bipartitions.get_rf_matrix(all_trees, species_trees)
+
+    trees_indices = list(range(1 + len(references), len(species_trees)))
+    for reference_index, reference in enumerate([original_tree, *references]):
+        reference_name = reference.split('/')[-1].split('.')[0]
+        other_indices = trees_indices + [index for index in range(1 + len(references)) if index != reference_index]
+        with open(f"{output_dir}/report_{reference_name}.txt", "w") as output_file:
+            for index in other_indices:
+                output_file.write(f"{species_files[index]} - {reference}\n")
+                output_file.write(f"RF: {rf[index, reference_index]}\n")
+                output_file.write(f"RF max: {max_rf[index, reference_index]}\n")
+                output_file.write("-----\n")
+        columns = [reference_index] + other_indices
+        rows = columns + list(range(len(species_trees), len(all_trees)))
+        write_rf_matrix([all_trees[index] for index in rows], [species_trees[index] for index in columns],
+                        rf[np.ix_(rows, columns)], max_rf[np.ix_(rows, columns)],
+                        f"{output_dir}/rf_matrix_{reference_name}.tsv")
+
+
+def write_rf_matrix(rows: list[bipartitions.SplitTree], columns: list[bipartitions.SplitTree], rf: np.ndarray,
+                    max_rf: np.ndarray, output_name: str):
+    """
+    Saves RF and normalized RF between `rows` and `columns` trees as a .tsv file (one row per tree from `rows`).
     """
-    with open(f"{output_dir}/report_{original_tree.split('/')[-1].split('.')[0]}.txt", "w") as output_file:
-        original_obj = Tree(original_tree, format=1)
-        for node in original_obj:
-            if not node.is_leaf():
-                node.support = float(node.name.split("/")[1])
-        for tree in trees:
-            tree_obj = Tree(tree, format=1)
-            for node in tree_obj:
-                if not node.is_leaf():
-                    node.support = float(node.name.split("/")[1])
-            rf_output = original_obj.robinson_foulds(tree_obj, unrooted_trees=True)
-            output_file.write(f"{tree} - {original_tree}\n")
-            output_file.write(f"RF: {rf_output[0]}\n")
-            output_file.write(f"RF max: {rf_output[1]}\n")
-            output_file.write("-----\n")
+    normalized_rf = np.divide(rf, max_rf, out=np.zeros(rf.shape), where=max_rf > 0)
+    with open(output_name, "w") as output_file:
+        header = [f"RF:{tree.name}" for tree in columns] + [f"nRF:{tree.name}" for tree in columns]
+        output_file.write("\t".join(["tree"] + header) + "\n")
+        for tree, rf_row, normalized_row in zip(rows, rf, normalized_rf):
+            values = [str(value) for value in rf_row] + [f"{value:.4f}" for value in normalized_row]
+            output_file.write("\t".join([tree.name] + values) + "\n")
 
 
 if __name__ == "__main__":
@@ -5,26 +5,56 @@ import os
 
 import click
 import glob
+import telemetry
 
 
 @click.command()
 @click.argument("fasturec_dir")
 @click.argument("output_dir")
+@telemetry.stage
 def get_supertree(fasturec_dir: str, output_dir: str):
     """
-    The script takes the most optimal supertree from Fasturec output and saves in `output_dir`.
+    The script takes the most optimal (the lowest cost) supertree from Fasturec output and saves in `output_dir`.
     """
     fasturec_output = glob.glob(f"{fasturec_dir}/*.fu.txt")
-    if fasturec_output:
-        fasturec_name = fasturec_output[-1]
-        output_name = f"{output_dir}/super_tree.nwk"
-        with open(fasturec_name, "r") as fasturec_file, open(output_name, "w") as output_file:
-            for line in fasturec_file:
-                output_file.write(f"{''.join(line.strip().split()[1:])};")
-                break
-    else:
+    if not fasturec_output:
         raise Exception("Fasturec output not found!")
-    os.remove(fasturec_name)
+    _, tree = get_best_supertree(fasturec_output)
+    write_supertree(tree, output_dir)
+    for fasturec_name in fasturec_output:
+        os.remove(fasturec_name)
+
+
+def read_fasturec_output(fasturec_name: str) -> list[tuple[float, str]]:
+    """
+    Reads supertrees with their costs from a given Fasturec output file (`fasturec_name`).
+    File format: one line - cost and tree.
+    """
+    supertrees = []
+    with open(fasturec_name, "r") as fasturec_file:
+        for line in fasturec_file:
+            if line.strip():
+                cost, *tree = line.strip().split()
+                supertrees.append((float(cost), "".join(tree)))
+    return supertrees
+
+
+def get_best_supertree(fasturec_output: list[str]) -> tuple[float, str]:
+    """
+    Returns the lowest cost supertree (with its cost) from all given Fasturec output files (`fasturec_output`).
+    """
+    supertrees = [supertree for fasturec_name in fasturec_output for supertree in read_fasturec_output(fasturec_name)]
+    if not supertrees:
+        raise Exception("Fasturec output is empty!")
+    return min(supertrees, key=lambda supertree: supertree[0])
+
+
+def write_supertree(tree: str, output_dir: str):
+    """
+    Saves a given supertree (`tree`) in `output_dir/super_tree.nwk`.
+    """
+    with open(f"{output_dir}/super_tree.nwk", "w") as output_file:
+        output_file.write(f"{tree};")
 
 
 if __name__ == "__main__":
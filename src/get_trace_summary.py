@@ -0,0 +1,76 @@
+"""
+Exemplary run: `python ./src/get_trace_summary.py ./data/workflow/trace.jsonl -n 10`
+"""
+import click
+import json
+
+from collections import defaultdict
+
+ARGUMENTS_WIDTH = 60
+
+
+@click.command()
+@click.argument("trace_file")
+@click.option("-n", "--top", "top", default=10, type=click.IntRange(1), help="Number of the slowest clusters shown.")
+def get_trace_summary(trace_file: str, top: int = 10):
+    """
+    The script summarizes a performance trace written by pipeline stages (see `telemetry`): it prints stages
+    and workflow tasks from the slowest one, the `top` slowest clusters, total time of steps (e.g. NJ and bootstrap)
+    per stage and runs of external tools with their failures.
+    """
+    records = defaultdict(list)
+    with open(trace_file, "r") as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                records[record["kind"]].append(record)
+
+    print_table("Stages", ["stage", "wall [s]", "CPU [s]", "peak RSS [MB]", "status", "arguments"],
+                [[record["name"], record["wall"], record["cpu"], record["peak_rss"], record["status"],
+                  " ".join(record["argv"])[:ARGUMENTS_WIDTH]]
+                 for record in sorted(records["stage"], key=lambda record: record["wall"], reverse=True)])
+    print_table("Workflow tasks", ["task", "wall [s]", "cores", "exit code"],
+                [[record["name"], record.get("wall", "-"), record.get("cores", "-"),
+                  record.get("exit_code", record.get("status"))]
+                 for record in sorted(records["workflow"], key=lambda record: record.get("wall", 0), reverse=True)])
+    print_table(f"The slowest {top} clusters", ["cluster", "stage", "sequences", "length", "trimmed", "wall [s]",
+                                                 "CPU [s]", "peak RSS [MB]"],
+                [[record["name"], record.get("stage", "-"), record.get("no_sequences", "-"), record.get("length", "-"),
+                  record.get("trimmed", "-"), record["wall"], record["cpu"], record["peak_rss"]]
+                 for record in sorted(records["cluster"], key=lambda record: record["wall"], reverse=True)[:top]])
+    print_table("Steps", ["stage", "step", "count", "wall [s]", "CPU [s]"],
+                [[stage, step, len(steps), sum(record["wall"] for record in steps), sum(record["cpu"] for record in steps)]
+                 for (stage, step), steps in sorted(group_records(records["step"], ["stage", "name"]).items(),
+                                                    key=lambda item: -sum(record["wall"] for record in item[1]))])
+    print_table("External tools", ["tool", "runs", "failed", "wall [s]", "max wall [s]"],
+                [[tool, len(runs), sum(record["exit_code"] != 0 for record in runs),
+                  sum(record["wall"] for record in runs), max(record["wall"] for record in runs)]
+                 for (tool,), runs in group_records(records["tool"], ["name"]).items()])
+
+
+def group_records(records: list[dict], keys: list[str]) -> dict[tuple, list[dict]]:
+    """
+    Groups `records` by values of given `keys`.
+    """
+    groups = defaultdict(list)
+    for record in records:
+        groups[tuple(record.get(key, "-") for key in keys)].append(record)
+    return groups
+
+
+def print_table(title: str, header: list[str], rows: list[list]):
+    """
+    Prints a table with a given `title` and `header` (floats are rounded). Tables without rows are skipped.
+    """
+    if not rows:
+        return
+    rows = [header] + [[f"{value:.2f}" if isinstance(value, float) else str(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    print(f"{title}:")
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+    print()
+
+
+if __name__ == "__main__":
+    get_trace_summary()
@@ -0,0 +1,238 @@
+"""
+Splits building NJ trees for large clusters into sub-tasks sharing one process pool with the other clusters -
+row blocks of the distance matrix and batches of bootstrap replicates, followed by the NJ itself, submitted once
+they are completed. Encoded alignments and condensed distance matrices are passed to workers through shared memory
+instead of being pickled, so only a bounded number of large clusters is processed at the same time.
+"""
+import alignment_store
+import nj_engine
+import numpy as np
+import telemetry
+import threading
+
+from Bio.Phylo.BaseTree import Tree
+from collections import deque
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import islice
+from multiprocessing.pool import AsyncResult, Pool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterable, Iterator
+
+
+@dataclass
+class LargeClusterJob:
+    """
+    Tasks submitted for one large cluster, shared memory blocks they use and the bootstrap support computed
+    from results of the sub-tasks. `submitted` is set once the NJ task is submitted (or not needed) or a task failed.
+    """
+    cluster_name: str
+    names: list[str]
+    shape: tuple[int, int]
+    rapid: bool
+    alignment_memory: SharedMemory
+    distances_memory: SharedMemory
+    distance_tasks: list[AsyncResult] = field(default_factory=list)
+    bootstrap_tasks: list[AsyncResult] = field(default_factory=list)
+    bootstrap_masks: list[list[list[int]]] = field(default_factory=list)
+    no_pending: int = 0
+    nj_task: AsyncResult = None
+    support: float = None
+    no_replicates: int = 0
+    error: BaseException = None
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    submitted: threading.Event = field(default_factory=threading.Event)
+
+
+def get_no_sequences(fasta_file: str) -> int:
+    """
+    Returns a number of sequences in a given .fasta file (`fasta_file`).
+    """
+    with open(fasta_file, "r") as file:
+        return sum(1 for line in file if line.startswith(">"))
+
+
+def split_clusters(inputs: list, min_size: int) -> tuple[list, list]:
+    """
+    Splits `inputs` (.fasta files or StoredAlignment) to clusters with at least `min_size` sequences and the rest.
+    """
+    large, small = [], []
+    for source in inputs:
+        if isinstance(source, alignment_store.StoredAlignment):
+            no_sequences = source.shape[0]
+        else:
+            no_sequences = get_no_sequences(source)
+        (large if no_sequences >= min_size else small).append(source)
+    return large, small
+
+
+def submit_large_clusters(pool: Pool, clusters: Iterable[tuple[str, np.ndarray, list[str]]], thresholds: list[float],
+                          replicates: int, no_tasks: int, rapid_nj: int = None,
+                          max_jobs: int = 4) -> Iterator[LargeClusterJob]:
+    """
+    Submits jobs of given `clusters` (names, alignments encoded as uint8 matrices and sequence ids) to the `pool`
+    with `submit_large_cluster` and returns an iterator over them. At most `max_jobs` jobs (with their shared memory)
+    are in flight - the first ones are submitted at once and every next one when a job returned before it has been
+    processed (the iterator is advanced).
+    """
+    clusters = iter(clusters)
+    submit = partial(submit_large_cluster, pool, thresholds=thresholds, replicates=replicates, no_tasks=no_tasks,
+                     rapid_nj=rapid_nj)
+    jobs = deque(submit(*cluster) for cluster in islice(clusters, max_jobs))
+
+    def get_jobs() -> Iterator[LargeClusterJob]:
+        while jobs:
+            yield jobs.popleft()
+            for cluster in islice(clusters, 1):
+                jobs.append(submit(*cluster))
+    return get_jobs()
+
+
+def submit_large_cluster(pool: Pool, cluster_name: str, encoded: np.ndarray, names: list[str], thresholds: list[float],
+                         replicates: int, no_tasks: int, rapid_nj: int = None) -> LargeClusterJob:
+    """
+    Copies an alignment of a given cluster (`encoded` as a uint8 matrix, with sequence ids - `names`) to shared memory
+    and submits to the `pool` computing the condensed distance matrix in `no_tasks` row blocks and, if any of
+    `thresholds` is set, `replicates` bootstrap trees in `no_tasks` batches. Once all of them are completed, NJ is
+    submitted as another task (see `submit_nj`). Alignments with at least `rapid_nj` sequences use rapid NJ.
+    """
+    rapid = bool(rapid_nj) and len(names) >= rapid_nj
+    alignment_memory = SharedMemory(create=True, size=max(encoded.nbytes, 1))
+    distances_memory = SharedMemory(create=True, size=max(len(names) * (len(names) - 1) // 2 * 8, 1))
+    np.ndarray(encoded.shape, dtype=np.uint8, buffer=alignment_memory.buf)[:] = encoded
+    memory_names = (alignment_memory.name, distances_memory.name)
+    job = LargeClusterJob(cluster_name, names, encoded.shape, rapid, alignment_memory, distances_memory)
+
+    blocks = [(int(rows[0]), int(rows[-1]) + 1) for rows in np.array_split(np.arange(len(names)), no_tasks)
+              if len(rows)]
+    batches = []
+    if any(thresholds):
+        seeds = np.random.SeedSequence().spawn(no_tasks)
+        batches = [(len(batch), seed) for batch, seed in zip(np.array_split(np.arange(replicates), no_tasks), seeds)
+                   if len(batch)]
+    job.bootstrap_masks = [[] for _ in batches]
+    with job.lock:  # sub-tasks completed before all of them are submitted wait for it
+        job.no_pending = len(blocks) + len(batches)
+        for start, stop in blocks:
+            job.distance_tasks.append(pool.apply_async(
+                fill_distances_block, (*memory_names, encoded.shape, start, stop),
+                callback=partial(complete_subtask, pool, job, thresholds, None), error_callback=partial(fail_job, job)))
+        for batch, (times, seed) in enumerate(batches):
+            job.bootstrap_tasks.append(pool.apply_async(
+                get_bootstrap_block, (alignment_memory.name, encoded.shape, times, seed, rapid),
+                callback=partial(complete_subtask, pool, job, thresholds, batch), error_callback=partial(fail_job, job)))
+    return job
+
+
+def complete_subtask(pool: Pool, job: LargeClusterJob, thresholds: list[float], batch: int, result: list[list[int]]):
+    """
+    Counts a completed sub-task of a given `job`, saves the `result` of a bootstrap `batch` (None for distances)
+    and submits NJ to the `pool` after the last one. It is run by the thread handling results of the pool before
+    the task is marked as ready, so results of tasks cannot be waited for here.
+    """
+    with job.lock:
+        if batch is not None:
+            job.bootstrap_masks[batch] = result
+        job.no_pending -= 1
+        if job.no_pending:
+            return
+    submit_nj(pool, job, thresholds)
+
+
+def fail_job(job: LargeClusterJob, error: BaseException):
+    """
+    Saves an `error` raised by a task of a given `job`, so it is raised by `get_large_cluster_tree`.
+    """
+    job.error = error
+    job.submitted.set()
+
+
+def submit_nj(pool: Pool, job: LargeClusterJob, thresholds: list[float]):
+    """
+    Computes average bootstrap support of a given `job` from its bootstrap trees and, unless it is lower than all
+    `thresholds` (as in `nj_engine.get_encoded_nj_tree`), submits NJ on its distance matrix to the `pool`.
+    """
+    try:
+        trees_masks = [masks for batch_masks in job.bootstrap_masks for masks in batch_masks]
+        job.support = nj_engine.get_avg_bootstrap_support(trees_masks) if trees_masks else None
+        job.no_replicates = len(trees_masks)
+        bootstrap = [threshold for threshold in thresholds if threshold]
+        if not bootstrap or len(bootstrap) < len(thresholds) or job.support >= min(bootstrap):
+            job.nj_task = pool.apply_async(get_nj_joins_block, (job.distances_memory.name, len(job.names), job.rapid,
+                                                                job.cluster_name))
+    except Exception as error:
+        job.error = error
+    finally:
+        job.submitted.set()
+
+
+def fill_distances_block(alignment_name: str, distances_name: str, shape: tuple[int, int], start: int, stop: int):
+    """
+    Computes rows from `start` to `stop` of the condensed identity distance matrix for an alignment of a given `shape`
+    stored in shared memory (`alignment_name`) and writes them to the shared condensed matrix (`distances_name`).
+    """
+    alignment_memory = SharedMemory(name=alignment_name)
+    distances_memory = SharedMemory(name=distances_name)
+    encoded = np.ndarray(shape, dtype=np.uint8, buffer=alignment_memory.buf)
+    condensed = np.ndarray((shape[0] * (shape[0] - 1) // 2,), buffer=distances_memory.buf)
+    condensed[start * (start - 1) // 2:stop * (stop - 1) // 2] = \
+        nj_engine.get_condensed_identity_distances(encoded, rows=slice(start, stop))
+    del encoded, condensed  # views have to be released before closing shared memory
+    alignment_memory.close()
+    distances_memory.close()
+
+
+def get_bootstrap_block(alignment_name: str, shape: tuple[int, int], times: int, seed: np.random.SeedSequence,
+                        rapid: bool = False) -> list[list[int]]:
+    """
+    Generates `times` bootstrap trees for an alignment of a given `shape` stored in shared memory (`alignment_name`)
+    and returns their inner clade bitmasks.
+    """
+    alignment_memory = SharedMemory(name=alignment_name)
+    encoded = np.ndarray(shape, dtype=np.uint8, buffer=alignment_memory.buf)
+    columns = nj_engine.get_bootstrap_columns(shape[1], times, np.random.default_rng(seed))
+    trees_masks = list(nj_engine.get_bootstrap_clade_masks(encoded, columns, rapid))
+    del encoded
+    alignment_memory.close()
+    return trees_masks
+
+
+def get_nj_joins_block(distances_name: str, no_leaves: int, rapid: bool, cluster_name: str) -> tuple[list, tuple]:
+    """
+    Runs NJ (rapid NJ if `rapid` is set) on the condensed distance matrix of `no_leaves` leaves stored in shared
+    memory (`distances_name`) and returns joins as `nj_engine.get_nj_joins` does (trees are not pickled, as deep
+    trees exceed the recursion limit). Its time is recorded as the "nj" step of a given cluster.
+    """
+    distances_memory = SharedMemory(name=distances_name)
+    condensed = np.ndarray((no_leaves * (no_leaves - 1) // 2,), buffer=distances_memory.buf)
+    with telemetry.measure("step", "nj", cluster=cluster_name, large=True):
+        if rapid:
+            joins = nj_engine.get_rapid_nj_joins(condensed, no_leaves)
+        else:
+            joins = nj_engine.get_nj_joins(nj_engine.condensed_to_square(condensed, no_leaves))
+    del condensed
+    distances_memory.close()
+    return joins
+
+
+def get_large_cluster_tree(job: LargeClusterJob) -> tuple[Tree, float, int]:
+    """
+    Waits for all tasks of a given `job`, releases its shared memory and returns NJ tree (None if its support is
+    too low), average bootstrap support and the number of generated bootstrap trees in the same way as
+    `nj_engine.get_encoded_nj_tree` does. Time of waiting for sub-tasks is recorded as the "subtasks" step
+    (see `telemetry`).
+    """
+    telemetry.add_fields(no_sequences=job.shape[0], length=job.shape[1], rapid=job.rapid, large=True)
+    try:
+        with telemetry.measure("step", "subtasks", no_tasks=len(job.distance_tasks) + len(job.bootstrap_tasks)):
+            job.submitted.wait()
+        tree = None
+        if job.nj_task:
+            tree = nj_engine.build_nj_tree(*job.nj_task.get(), job.names)
+        elif job.error:
+            raise job.error
+    finally:
+        for memory in (job.alignment_memory, job.distances_memory):
+            memory.close()
+            memory.unlink()
+    return tree, job.support, job.no_replicates
@@ -0,0 +1,56 @@
+"""
+Exemplary run: `python ./src/merge_shards.py ./data/one2one/ 4`
+"""
+import alignment_store
+import click
+import glob
+import os
+import shards
+import shutil
+import telemetry
+
+MERGED_FILES = ["nj_trees.nwk", "nj_trees_length_less.nwk", "bootstrap_replicates.tsv", "trimmed_columns.tsv"]
+
+
+@click.command()
+@click.argument("output_dir")
+@click.argument("no_shards", type=click.IntRange(1))
+@telemetry.stage
+def merge_shards(output_dir: str, no_shards: int):
+    """
+    The script combines results of all `no_shards` shards from `output_dir/shards/` (saved by `get_msa.py`
+    or `get_nj_trees.py` with `--shard`) into `output_dir`, so they are the same as results of a run without shards
+    (trees are ordered by shards). MSAs in `output_dir` which are not in any shard are removed. All shards have
+    to be completed.
+    """
+    shard_dirs = [shards.get_shard_dir(output_dir, (index, no_shards)) for index in range(no_shards)]
+    missing = [f"{index}/{no_shards}" for index, shard_dir in enumerate(shard_dirs) if not shards.is_done(shard_dir)]
+    if missing:
+        raise Exception(f"Shards not completed: {', '.join(missing)}. Run them again before merging.")
+    for file_name in MERGED_FILES:
+        if all(os.path.exists(f"{shard_dir}/{file_name}") for shard_dir in shard_dirs):
+            merge_files([f"{shard_dir}/{file_name}" for shard_dir in shard_dirs], f"{output_dir}/{file_name}")
+    msa_files = [msa_file for shard_dir in shard_dirs for msa_file in glob.glob(f"{shard_dir}/*.fasta")]
+    if msa_files:
+        merged_names = {msa_file.split('/')[-1] for msa_file in msa_files}
+        for stale_file in glob.glob(f"{output_dir}/*.fasta"):
+            if stale_file.split('/')[-1] not in merged_names:
+                os.remove(stale_file)
+        for msa_file in msa_files:
+            shutil.copyfile(msa_file, f"{output_dir}/{msa_file.split('/')[-1]}")
+        alignment_store.write_store(glob.glob(f"{output_dir}/*.fasta"), output_dir)
+    print(f"{no_shards} shards merged.")
+
+
+def merge_files(input_names: list[str], output_name: str):
+    """
+    Concatenates given files (`input_names`) into one file (`output_name`).
+    """
+    with open(output_name, "wb") as output_file:
+        for input_name in input_names:
+            with open(input_name, "rb") as input_file:
+                shutil.copyfileobj(input_file, output_file)
+
+
+if __name__ == "__main__":
+    merge_shards()
@@ -0,0 +1,470 @@
+"""
+NumPy engine for identity distances and Neighbor Joining used by `get_nj_trees.py`.
+It reproduces Biopython's `DistanceCalculator('identity')`, `DistanceTreeConstructor.nj` and bootstrap support
+from `Bio.Phylo.Consensus` without per-pair Python loops. Clades are represented as leaf bitmasks (int with
+the i-th bit set for the i-th sequence of the alignment).
+For clusters with thousands of sequences `get_rapid_nj_joins` runs NJ with bounded search (as in RapidNJ)
+on a condensed distance matrix (lower triangle stored row by row).
+"""
+import math
+import numpy as np
+import telemetry
+
+from collections import Counter
+from itertools import islice
+from statistics import NormalDist
+from typing import Iterable, Iterator
+
+from Bio.Align import MultipleSeqAlignment
+from Bio.Phylo.BaseTree import Clade, Tree
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+GAP = ord("-")
+
+
+def encode_alignment(alignment: MultipleSeqAlignment) -> tuple[np.ndarray, list[str]]:
+    """
+    Encodes a given `alignment` as a uint8 matrix (one row per sequence, one column per alignment position)
+    and returns it with a list of sequence ids.
+    """
+    names = [record.id for record in alignment]
+    length = alignment.get_alignment_length()
+    encoded = np.empty((len(names), length), dtype=np.uint8)
+    for i, record in enumerate(alignment):
+        encoded[i] = np.frombuffer(str(record.seq).encode("ascii"), dtype=np.uint8)
+    return encoded, names
+
+
+def decode_alignment(encoded: np.ndarray, names: list[str]) -> MultipleSeqAlignment:
+    """
+    Returns an alignment encoded as a uint8 matrix (`encoded`) with sequence ids (`names`) as a Biopython MSA.
+    """
+    return MultipleSeqAlignment([SeqRecord(Seq(row.tobytes().decode("ascii")), id=name)
+                                 for row, name in zip(encoded, names)])
+
+
+def get_removed_columns(encoded: np.ndarray, max_gaps: float = None, conserved: float = None) -> np.ndarray:
+    """
+    Returns a mask of columns of `encoded` alignment which are not informative for identity distances:
+    with a fraction of gaps higher than `max_gaps` or with one residue in at least `conserved` fraction of sequences
+    (1 marks constant columns). Thresholds which are not set are not checked. Columns are counted for every symbol
+    of the alignment at once, so there is no loop over columns.
+    """
+    removed = np.zeros(encoded.shape[1], dtype=bool)
+    if max_gaps is not None:
+        removed |= np.count_nonzero(encoded == GAP, axis=0) > max_gaps * len(encoded)
+    if conserved is not None:
+        top_counts = np.zeros(encoded.shape[1], dtype=np.int64)
+        for symbol in np.flatnonzero(np.bincount(encoded.ravel(), minlength=256)):
+            if symbol != GAP:
+                np.maximum(top_counts, np.count_nonzero(encoded == symbol, axis=0), out=top_counts)
+        removed |= top_counts >= conserved * len(encoded)
+    return removed
+
+
+def trim_alignment(encoded: np.ndarray, max_gaps: float = None, conserved: float = None) -> tuple[np.ndarray, int]:
+    """
+    Returns `encoded` alignment without columns marked by `get_removed_columns` and the number of removed columns.
+    If no column would be left, the alignment is returned whole (it has no informative columns to keep).
+    """
+    removed = get_removed_columns(encoded, max_gaps, conserved)
+    no_removed = int(np.count_nonzero(removed))
+    if no_removed in (0, encoded.shape[1]):
+        return encoded, 0
+    return np.ascontiguousarray(encoded[:, ~removed]), no_removed
+
+
+def get_identity_matches(encoded: np.ndarray, weights: np.ndarray = None, rows: slice = slice(None)) -> np.ndarray:
+    """
+    Returns a matrix with numbers of identical positions between sequences from `rows` of `encoded` alignment
+    and all of its sequences. Optional `weights` give the number of times each column is counted.
+    """
+    block = encoded[rows]
+    matches = np.zeros((len(block), len(encoded)), dtype=np.float32)
+    for symbol in np.unique(encoded):
+        block_mask = (block == symbol).astype(np.float32)
+        if weights is not None:
+            block_mask *= weights
+        matches += block_mask @ (encoded == symbol).astype(np.float32).T
+    return matches
+
+
+def get_identity_distances(encoded: np.ndarray, weights: np.ndarray = None, rows: slice = slice(None)) -> np.ndarray:
+    """
+    Returns a matrix of identity distances (1 - identical positions / alignment length) between sequences
+    from `rows` (all by default) of `encoded` alignment and all of its sequences, the same
+    as Biopython's `DistanceCalculator('identity')`.
+    """
+    length = encoded.shape[1] if weights is None else int(weights.sum())
+    indices = np.arange(len(encoded))[rows]
+    if length == 0:
+        distances = np.ones((len(indices), len(encoded)))
+    else:
+        distances = 1 - get_identity_matches(encoded, weights, rows).astype(np.float64) / length
+    distances[np.arange(len(indices)), indices] = 0
+    return distances
+
+
+def get_condensed_identity_distances(encoded: np.ndarray, weights: np.ndarray = None, rows: slice = slice(None),
+                                     dtype: type = np.float64, block_size: int = 256) -> np.ndarray:
+    """
+    Returns identity distances between sequences from `rows` (all by default) of `encoded` alignment and all sequences
+    preceding them in a condensed form - the lower triangle of the distance matrix stored row by row, so distance
+    between i-th and j-th (j < i) sequence is at i*(i-1)/2+j. Rows are computed in blocks of `block_size`.
+    """
+    start, stop, _ = rows.indices(len(encoded))
+    blocks = [np.empty(0, dtype=dtype)]
+    for block_start in range(start, stop, block_size):
+        block_stop = min(block_start + block_size, stop)
+        distances = get_identity_distances(encoded, weights, slice(block_start, block_stop))
+        lower = np.arange(len(encoded))[None, :] < np.arange(block_start, block_stop)[:, None]
+        blocks.append(distances[lower].astype(dtype))
+    return np.concatenate(blocks)
+
+
+def condensed_to_square(condensed: np.ndarray, size: int) -> np.ndarray:
+    """
+    Returns a full float64 distance matrix of a given `size` from its `condensed` form.
+    """
+    distances = np.zeros((size, size))
+    for i in range(1, size):
+        row = condensed[i * (i - 1) // 2:i * (i + 1) // 2]
+        distances[i, :i] = row
+        distances[:i, i] = row
+    return distances
+
+
+def get_nj_joins(distances: np.ndarray) -> tuple[list[tuple[int, int, float, float]], tuple[int, int, float]]:
+    """
+    Runs Neighbor Joining on a given `distances` matrix. Leaves are numbered from 0 to n-1, the k-th created
+    inner node gets number n+k. Returns a list of joins (first child, second child and their branch lengths)
+    and the last two nodes with the distance between them.
+    Pairs are chosen in the same order as in Biopython's `DistanceTreeConstructor.nj`, so ties are broken
+    the same way.
+    """
+    dm = np.array(distances, dtype=np.float64)
+    nodes = list(range(len(dm)))
+    joins = []
+    while len(nodes) > 2:
+        size = len(nodes)
+        node_dist = dm.sum(axis=0) / (size - 2)
+        q = dm - node_dist[:, None] - node_dist[None, :]
+        q[np.triu_indices(size)] = np.inf
+        min_i, min_j = (int(i) for i in np.unravel_index(np.argmin(q), q.shape))
+        if (min_i, min_j) == (1, 0):
+            min_i, min_j = 0, 1
+        branch_length = (dm[min_i, min_j] + node_dist[min_i] - node_dist[min_j]) / 2.0
+        joins.append((nodes[min_i], nodes[min_j], branch_length, dm[min_i, min_j] - branch_length))
+
+        new_dist = (dm[min_i] + dm[min_j] - dm[min_i, min_j]) / 2.0
+        new_dist[min_j] = 0
+        dm[min_j], dm[:, min_j] = new_dist, new_dist
+        dm = np.delete(np.delete(dm, min_i, axis=0), min_i, axis=1)
+        nodes[min_j] = len(distances) + len(joins) - 1
+        del nodes[min_i]
+    if len(nodes) == 2:
+        return joins, (nodes[0], nodes[1], dm[1, 0])
+    return joins, (nodes[0], None, 0)
+
+
+def build_nj_tree(joins: list[tuple[int, int, float, float]], last: tuple[int, int, float], names: list[str]) -> Tree:
+    """
+    Builds a Biopython tree from Neighbor Joining `joins` and `last` pair returned by `get_nj_joins`,
+    with the same clade names and rooting as `DistanceTreeConstructor.nj`.
+    """
+    clades = [Clade(None, name) for name in names]
+    if len(names) == 1:
+        return Tree(clades[0], rooted=False)
+    if len(names) == 2:
+        clades[1].branch_length = last[2] / 2.0
+        clades[0].branch_length = last[2] - clades[1].branch_length
+        return Tree(Clade(None, "Inner", clades=[clades[1], clades[0]]), rooted=False)
+    for inner_count, (first, second, first_length, second_length) in enumerate(joins, 1):
+        clades[first].branch_length = first_length
+        clades[second].branch_length = second_length
+        clades.append(Clade(None, f"Inner{inner_count}", clades=[clades[first], clades[second]]))
+    first, second, length = last
+    if first == len(clades) - 1:
+        root, child = clades[first], clades[second]
+    else:
+        root, child = clades[second], clades[first]
+    root.branch_length = 0
+    child.branch_length = length
+    root.clades.append(child)
+    return Tree(root, rooted=False)
+
+
+def nj(distances: np.ndarray, names: list[str]) -> Tree:
+    """
+    Returns Neighbor Joining tree for a given `distances` matrix with leaves named after `names`.
+    """
+    joins, last = get_nj_joins(distances)
+    return build_nj_tree(joins, last, names)
+
+
+def get_condensed_indices(first_slots: np.ndarray, second_slots: np.ndarray) -> np.ndarray:
+    """
+    Returns indices in a condensed distance matrix of distances between rows `first_slots` and `second_slots`
+    (broadcast against each other). Slots have to be different.
+    """
+    high = np.maximum(first_slots, second_slots)
+    low = np.minimum(first_slots, second_slots)
+    return high * (high - 1) // 2 + low
+
+
+def get_rapid_nj_joins(condensed: np.ndarray, no_leaves: int, no_candidates: int = 32, tie_tolerance: float = 1e-9,
+                       block_size: int = 256) -> tuple[list[tuple[int, int, float, float]], tuple[int, int, float]]:
+    """
+    Runs Neighbor Joining with bounded search on `condensed` distances between `no_leaves` leaves and returns joins
+    in the same form as `get_nj_joins`.
+    Every node keeps `no_candidates` nodes closest to it (at the time it was created or last scanned), so
+    the minimum of the NJ criterion is looked for only among them. Whole rows (in blocks of `block_size`) are scanned
+    only for nodes whose candidates cannot prove that no better pair is left (the farthest candidate distance minus
+    the node's and the largest node distance is lower than the current minimum), so every chosen pair minimizes
+    the criterion. Distances and the criterion are float64, but sums of node distances are updated incrementally, so
+    they are not rounded as in `get_nj_joins`: values closer than `tie_tolerance` (relative) are treated as ties
+    and the first of them in Biopython's order is chosen, while `get_nj_joins` (and Biopython) choose between them
+    by rounding errors. Thus the tree has the same unrooted topology as the one from `get_nj_joins` unless
+    the alignment has ties (e.g. identical sequences) - then it may join tied pairs differently. The inner node takes
+    the position of the second node in Biopython's list of clades, so clades are named the same way, but the tree
+    may be rooted differently, as the criterion always ties when four nodes are left.
+    """
+    if no_leaves < 3:
+        return get_nj_joins(condensed_to_square(condensed, no_leaves))
+    dm = condensed.astype(np.float64)
+    no_nodes = 2 * no_leaves - 2
+    sentinel = no_nodes  # id used to pad candidate lists, never alive
+    slots = np.full(no_nodes + 1, -1, dtype=np.int64)
+    slots[:no_leaves] = np.arange(no_leaves)
+    ranks = slots.copy()  # the order of nodes in Biopython's list of clades
+    alive = np.zeros(no_nodes + 1, dtype=bool)
+    alive[:no_leaves] = True
+    sums = np.zeros(no_nodes + 1)
+    node_dist = np.zeros(no_nodes + 1)
+    candidates = np.full((no_nodes + 1, no_candidates), sentinel, dtype=np.int64)
+    candidates_dist = np.full((no_nodes + 1, no_candidates), np.inf)
+    bound_dist = np.full(no_nodes + 1, np.inf)
+
+    def get_rows(block: np.ndarray, others: np.ndarray) -> np.ndarray:
+        is_self = block[:, None] == others[None, :]
+        distances = dm[np.where(is_self, 0, get_condensed_indices(slots[block][:, None], slots[others][None, :]))]
+        distances[is_self] = np.inf
+        return distances
+
+    def set_candidates(block: np.ndarray, others: np.ndarray, distances: np.ndarray, no_others: int):
+        no_kept = min(no_candidates, no_others)
+        if no_kept < distances.shape[1]:
+            kept = np.argpartition(distances, no_kept - 1, axis=1)[:, :no_kept]
+        else:
+            kept = np.broadcast_to(np.arange(no_kept), (len(block), no_kept))
+        kept_dist = np.take_along_axis(distances, kept, axis=1)
+        order = np.argsort(kept_dist, axis=1, kind="stable")
+        candidates[block], candidates_dist[block] = sentinel, np.inf
+        candidates[block, :no_kept] = others[np.take_along_axis(kept, order, axis=1)]
+        candidates_dist[block, :no_kept] = np.take_along_axis(kept_dist, order, axis=1)
+        bound_dist[block] = candidates_dist[block, no_kept - 1] if no_kept < no_others else np.inf
+
+    leaves = np.arange(no_leaves)
+    for block in np.array_split(leaves, math.ceil(no_leaves / block_size)):
+        distances = get_rows(block, leaves)
+        sums[block] = np.where(np.isinf(distances), 0, distances).sum(axis=1, dtype=np.float64)
+        set_candidates(block, leaves, distances, no_leaves - 1)
+
+    joins = []
+    while len(nodes := np.flatnonzero(alive)) > 2:
+        node_dist[nodes] = sums[nodes] / (len(nodes) - 2)
+        max_node_dist = node_dist[nodes].max()
+        nodes_candidates = candidates[nodes]
+        q = candidates_dist[nodes] - node_dist[nodes][:, None] - node_dist[nodes_candidates]
+        q[~alive[nodes_candidates]] = np.inf
+        min_q = q.min()
+        bounds = bound_dist[nodes] - node_dist[nodes] - max_node_dist
+        is_scanned = np.zeros(len(nodes), dtype=bool)
+        scanned = []
+        while (to_scan := np.flatnonzero(~is_scanned & (bounds <= min_q + tie_tolerance * max(1, abs(min_q))))).size:
+            for rows in np.array_split(to_scan, math.ceil(len(to_scan) / block_size)):
+                distances = get_rows(nodes[rows], nodes)
+                rows_q = distances - node_dist[nodes[rows]][:, None] - node_dist[nodes][None, :]
+                min_q = min(min_q, rows_q.min())
+                scanned.append((nodes[rows], rows_q))
+                set_candidates(nodes[rows], nodes, distances, len(nodes) - 1)
+                is_scanned[rows] = True
+
+        # pairs equal up to rounding are chosen in Biopython's order (row by row of the lower triangle)
+        tie_limit = min_q + tie_tolerance * max(1, abs(min_q))
+        rows, columns = np.nonzero(q <= tie_limit)
+        ties = list(zip(nodes[rows], nodes_candidates[rows, columns]))
+        for block, rows_q in scanned:
+            rows, columns = np.nonzero(rows_q <= tie_limit)
+            ties += list(zip(block[rows], nodes[columns]))
+        pair = min(ties, key=lambda pair: (max(ranks[pair[0]], ranks[pair[1]]), min(ranks[pair[0]], ranks[pair[1]])))
+
+        first, second = sorted((int(pair[0]), int(pair[1])), key=lambda node: ranks[node], reverse=True)
+        if np.count_nonzero(ranks[nodes] < ranks[first]) == 1:  # Biopython's special case for the first two clades
+            first, second = second, first
+        pair_dist = float(dm[get_condensed_indices(slots[first], slots[second])])
+        branch_length = (pair_dist + node_dist[first] - node_dist[second]) / 2.0
+        joins.append((first, second, branch_length, pair_dist - branch_length))
+
+        new_node = no_leaves + len(joins) - 1
+        others = nodes[(nodes != first) & (nodes != second)]
+        first_dist = dm[get_condensed_indices(slots[first], slots[others])]
+        second_dist = dm[get_condensed_indices(slots[second], slots[others])]
+        new_dist = (first_dist + second_dist - pair_dist) / 2.0
+        sums[others] += new_dist - first_dist - second_dist
+        alive[[first, second]] = False
+        alive[new_node] = True
+        slots[new_node], ranks[new_node] = slots[second], ranks[second]
+        dm[get_condensed_indices(slots[new_node], slots[others])] = new_dist
+        sums[new_node] = new_dist.sum(dtype=np.float64)
+        set_candidates(np.array([new_node]), others, new_dist[None, :], len(others))
+
+    first, second = sorted(nodes.tolist(), key=lambda node: ranks[node])
+    return joins, (first, second, float(dm[get_condensed_indices(slots[first], slots[second])]))
+
+
+def get_clade_masks(joins: list[tuple[int, int, float, float]], no_leaves: int) -> list[int]:
+    """
+    Returns leaf bitmasks of all inner clades of a tree built from Neighbor Joining `joins` of `no_leaves` leaves,
+    rooted the same way as `build_nj_tree` roots it (the last inner clade becomes the root).
+    """
+    if no_leaves == 2:
+        return [0b11]
+    masks = [1 << i for i in range(no_leaves)]
+    for first, second, _, _ in joins:
+        masks.append(masks[first] | masks[second])
+    clade_masks = masks[no_leaves:]
+    if clade_masks:
+        clade_masks[-1] = (1 << no_leaves) - 1
+    return clade_masks
+
+
+def get_bootstrap_columns(length: int, times: int, rng: np.random.Generator = None) -> Iterator[np.ndarray]:
+    """
+    Yields `times` arrays of column indices drawn with replacement from an alignment of a given `length`.
+    """
+    rng = rng or np.random.default_rng()
+    for _ in range(times):
+        yield rng.integers(0, length, size=length)
+
+
+def get_bootstrap_clade_masks(encoded: np.ndarray, columns: Iterable[np.ndarray],
+                              rapid: bool = False) -> Iterator[list[int]]:
+    """
+    Yields inner clade bitmasks of a NJ tree (built with `get_rapid_nj_joins` if `rapid` is set) for every bootstrap
+    replicate of `encoded` alignment. Replicates are given as arrays of resampled column indices (`columns`) and
+    are never materialized - each column is weighted by the number of times it was drawn.
+    """
+    for replicate_columns in columns:
+        weights = np.bincount(replicate_columns, minlength=encoded.shape[1]).astype(np.float32)
+        if rapid:
+            condensed = get_condensed_identity_distances(encoded, weights)
+            joins, _ = get_rapid_nj_joins(condensed, len(encoded))
+        else:
+            joins, _ = get_nj_joins(get_identity_distances(encoded, weights))
+        yield get_clade_masks(joins, len(encoded))
+
+
+def get_avg_bootstrap_support(trees_masks: list[list[int]]) -> float:
+    """
+    Returns average support of bootstrap trees given as lists of their inner clade bitmasks (`trees_masks`).
+    Support of every tree is computed against all of the trees (including itself) in a single pass over a table
+    of clade counts - it is the same value as the mean of `get_avg_supp(get_support(tree, trees))` in
+    `get_nj_trees.py`.
+    """
+    counts = Counter(mask for masks in trees_masks for mask in masks)
+    avg_supps = get_trees_supports(trees_masks, counts)
+    return sum(avg_supps) / len(trees_masks)
+
+
+def get_trees_supports(trees_masks: list[list[int]], counts: Counter) -> list[float]:
+    """
+    Returns average support of every tree from `trees_masks` given `counts` of clades in all of the trees.
+    """
+    no_trees = len(trees_masks)
+    return [sum(counts[mask] for mask in masks) * 100.0 / no_trees / len(masks) for masks in trees_masks]
+
+
+def get_projected_supports(trees_masks: list[list[int]], counts: Counter, no_replicates: int) -> np.ndarray:
+    """
+    Returns average support of every tree from `trees_masks` expected once `no_replicates` bootstrap trees are
+    generated. Clade frequencies are estimated from the other trees (leave-one-out) and the tree's own clades are
+    then counted in the way `get_trees_supports` counts them. For `no_replicates` equal to the number of trees
+    the result is the same as `get_trees_supports`.
+    """
+    no_trees = len(trees_masks)
+    loo_supps = np.array([sum(counts[mask] - 1 for mask in masks) * 100.0 / (no_trees - 1) / len(masks)
+                          for masks in trees_masks])
+    return loo_supps + (100.0 - loo_supps) / no_replicates
+
+
+def check_bootstrap(encoded: np.ndarray, bootstrap: float, max_replicates: int = 100, error_rate: float = None,
+                    batch_size: int = 10, rng: np.random.Generator = None, rapid: bool = False) -> tuple[bool, int]:
+    """
+    Returns True if average support of bootstrap trees for `encoded` alignment is higher or equal given `bootstrap`
+    value, together with the number of generated trees (see `estimate_bootstrap_support`).
+    """
+    support, no_replicates = estimate_bootstrap_support(encoded, [bootstrap], max_replicates, error_rate, batch_size,
+                                                        rng, rapid)
+    return support >= bootstrap, no_replicates
+
+
+def estimate_bootstrap_support(encoded: np.ndarray, thresholds: list[float], max_replicates: int = 100,
+                               error_rate: float = None, batch_size: int = 10, rng: np.random.Generator = None,
+                               rapid: bool = False) -> tuple[float, int]:
+    """
+    Returns average support of bootstrap trees for `encoded` alignment, together with the number of generated trees.
+    Without `error_rate` all `max_replicates` trees are generated. Otherwise trees are generated in batches
+    of `batch_size` and it stops once the support projected for `max_replicates` trees differs from every value
+    from `thresholds` by more than its confidence interval, so no decision can change with probability higher than
+    `error_rate` (normal approximation with Bonferroni correction for the number of checks and thresholds).
+    The projected support is returned then.
+    """
+    columns = get_bootstrap_columns(encoded.shape[1], max_replicates, rng)
+    if not error_rate:
+        trees_masks = list(get_bootstrap_clade_masks(encoded, columns, rapid))
+        return get_avg_bootstrap_support(trees_masks), len(trees_masks)
+
+    no_checks = math.ceil(max_replicates / batch_size) * len(thresholds)
+    z = NormalDist().inv_cdf(1 - error_rate / (2 * no_checks))
+    trees_masks = []
+    counts = Counter()
+    while len(trees_masks) < max_replicates:
+        batch = list(get_bootstrap_clade_masks(encoded, islice(columns, batch_size), rapid))
+        trees_masks += batch
+        counts.update(mask for masks in batch for mask in masks)
+        if len(trees_masks) >= max(2 * batch_size, 2) and len(trees_masks) < max_replicates:
+            avg_supps = get_projected_supports(trees_masks, counts, max_replicates)
+            std_error = avg_supps.std(ddof=1) / math.sqrt(len(avg_supps))
+            if all(abs(avg_supps.mean() - threshold) > z * std_error for threshold in thresholds):
+                return float(avg_supps.mean()), len(trees_masks)
+    return get_avg_bootstrap_support(trees_masks), len(trees_masks)
+
+
+def get_encoded_nj_tree(encoded: np.ndarray, names: list[str], thresholds: list[float] = (), max_replicates: int = 100,
+                        error_rate: float = None, rapid_nj: int = None) -> tuple[Tree, float, int]:
+    """
+    Returns Neighbor Joining tree for an alignment encoded as a uint8 matrix (`encoded`) with sequence ids (`names`),
+    average support of its bootstrap trees (None if not computed) and the number of generated bootstrap trees.
+    `thresholds` are bootstrap thresholds of outputs the tree is built for (None or 0 for an output without
+    bootstrap). The tree is None if its support is lower than thresholds of all outputs.
+    Alignments with at least `rapid_nj` sequences use `get_rapid_nj_joins`.
+    """
+    rapid = bool(rapid_nj) and len(names) >= rapid_nj
+    telemetry.add_fields(no_sequences=encoded.shape[0], length=encoded.shape[1], rapid=rapid)
+    bootstrap = [threshold for threshold in thresholds if threshold]
+    support, no_replicates = None, 0
+    if bootstrap:
+        with telemetry.measure("step", "bootstrap") as fields:
+            support, no_replicates = estimate_bootstrap_support(encoded, bootstrap, max_replicates, error_rate,
+                                                                rapid=rapid)
+            fields.update(replicates=no_replicates)
+        if len(bootstrap) == len(thresholds) and support < min(bootstrap):
+            return None, support, no_replicates
+    with telemetry.measure("step", "nj"):
+        if rapid:
+            tree = build_nj_tree(*get_rapid_nj_joins(get_condensed_identity_distances(encoded), len(names)), names)
+        else:
+            tree = nj(get_identity_distances(encoded), names)
+    return tree, support, no_replicates
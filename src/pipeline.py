@@ -0,0 +1,57 @@
+"""
+Exemplary run: `python ./src/pipeline.py run ./data/organisms.txt ./data/ bin/fasturec -j 8`
+"""
+import click
+import importlib
+
+COMMANDS = {  # {subcommand: (module, command, short help)}
+    "run": ("run_pipeline", "run_pipeline", "Run the whole pipeline as a graph of stages."),
+    "batch": ("run_pipeline", "run_batch", "Run subcommands one by one in one process sharing workers."),
+    "proteomes": ("get_proteomes", "get_proteomes", "Download proteomes of species from UniProt."),
+    "clusters": ("get_clusters", "get_clusters", "Cluster proteomes with MMseqs2."),
+    "filtered_clusters": ("get_filtered_clusters", "get_filtered_clusters", "Select one-to-one and paralog clusters."),
+    "msa": ("get_msa", "get_msa", "Align clusters with MAFFT."),
+    "nj_trees": ("get_nj_trees", "get_nj_trees", "Build NJ trees of aligned clusters."),
+    "merge_shards": ("merge_shards", "merge_shards", "Combine results of shards."),
+    "consensus_tree": ("get_consensus_tree", "get_consensus_tree", "Build a majority-rule consensus tree."),
+    "supertree": ("get_supertree", "get_supertree", "Build a supertree with one Fasturec run."),
+    "multistart_supertree": ("get_multistart_supertree", "get_multistart_supertree",
+                             "Search a supertree with parallel Fasturec runs."),
+    "rf": ("get_rf", "get_rf", "Compute Robinson-Foulds distances to a reference tree."),
+    "show_tree": ("show_tree", "get_supertree", "Draw a tree."),
+    "trace_summary": ("get_trace_summary", "get_trace_summary", "Summarize a performance trace."),
+    "synthetic_data": ("synthetic_data", "synthetic_data", "Generate a synthetic dataset."),
+    "benchmarks": ("run_benchmarks", "run_benchmarks", "Benchmark hot paths on synthetic data."),
+}
+
+
+class LazyGroup(click.Group):
+    """
+    Group of subcommands from `COMMANDS` - the module of a subcommand (with libraries it uses, e.g. Biopython
+    or matplotlib) is imported only when the subcommand is run.
+    """
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return list(COMMANDS)
+
+    def get_command(self, ctx: click.Context, name: str) -> click.Command:
+        if name not in COMMANDS:
+            return None
+        module, command, _ = COMMANDS[name]
+        return getattr(importlib.import_module(module), command)
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter):
+        with formatter.section("Commands"):
+            formatter.write_dl([(name, short_help) for name, (_, _, short_help) in COMMANDS.items()])
+
+
+@click.group(cls=LazyGroup)
+def pipeline():
+    """
+    Single entry point of the pipeline with a subcommand for every script (see `python ./src/pipeline.py COMMAND
+    --help`). Only the module of the run subcommand is imported. Subcommands run by the batch subcommand
+    (`pipeline.py batch msa ... :: nj_trees ...`) share one pool of workers.
+    """
+
+
+if __name__ == "__main__":
+    pipeline()
@@ -0,0 +1,109 @@
+"""
+Content-addressed cache of per-cluster results shared by pipeline stages. A result is stored under a hash of the stage
+name, parameters (with tool versions) and bytes of the input file, so reruns reuse results of unchanged clusters.
+The cache is bounded in size by removing the least recently used results.
+"""
+import hashlib
+import os
+
+from dataclasses import dataclass
+
+READ_SIZE = 1 << 20
+
+
+@dataclass
+class ResultCache:
+    """
+    Results of a given `stage` computed with given `params` (tool versions and parameters the results depend on)
+    stored in `cache_dir`.
+    """
+    cache_dir: str
+    stage: str
+    params: str
+
+    def get_key(self, input_file: str) -> str:
+        """
+        Returns a key of a result for a given `input_file`.
+        """
+        key = hashlib.sha256(f"{self.stage}\n{self.params}\n".encode())
+        with open(input_file, "rb") as file:
+            while data := file.read(READ_SIZE):
+                key.update(data)
+        return key.hexdigest()
+
+    def get_data_key(self, *data: bytes) -> str:
+        """
+        Returns a key of a result for given input `data` (any objects supporting the buffer protocol).
+        """
+        key = hashlib.sha256(f"{self.stage}\n{self.params}\n".encode())
+        for part in data:
+            key.update(part)
+        return key.hexdigest()
+
+    def get_path(self, key: str) -> str:
+        """
+        Returns a path of a result with a given `key`.
+        """
+        return f"{self.cache_dir}/{self.stage}/{key[:2]}/{key}"
+
+    def get(self, key: str) -> bytes:
+        """
+        Returns a result with a given `key` (None if not cached) and marks it as recently used.
+        """
+        path = self.get_path(key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, key: str, data: bytes):
+        """
+        Saves a result (`data`) with a given `key`. The file is replaced at once, so results may be saved
+        by many processes.
+        """
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+    def report(self, no_hits: int, no_results: int):
+        """
+        Prints numbers of results taken from the cache (`no_hits`) and computed (`no_results` - `no_hits`).
+        """
+        print(f"Cache ({self.stage}): {no_hits} hits, {no_results - no_hits} misses.")
+
+
+def evict(cache_dir: str, max_size: int):
+    """
+    Removes the least recently used results from `cache_dir` until their total size is at most `max_size` bytes.
+    Results being saved or removed in the meantime by another process sharing the cache are skipped.
+    """
+    if not os.path.isdir(cache_dir):  # nothing has been saved yet
+        return
+    entries = []
+    for stage_dir in os.scandir(cache_dir):
+        if stage_dir.is_dir():
+            for prefix_dir in os.scandir(stage_dir.path):
+                if prefix_dir.is_dir():
+                    for entry in os.scandir(prefix_dir.path):
+                        if entry.name.endswith(".tmp"):  # being saved
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
@@ -0,0 +1,270 @@
+"""
+Exemplary run: `python ./src/run_benchmarks.py ./benchmarks/results.json -t 8 -t 16 -t 32 -c 100 -c 200 -p ./benchmarks/`
+"""
+import click
+import get_clusters
+import get_filtered_clusters
+import get_nj_trees
+import get_rf
+import glob
+import json
+import matplotlib.pyplot as plt
+import nj_engine
+import numpy as np
+import os
+import platform
+import subprocess
+import synthetic_data
+import tempfile
+import time
+
+from Bio import AlignIO
+from Bio.Align import MultipleSeqAlignment
+from Bio.Phylo.BaseTree import Tree
+from datetime import datetime, timezone
+from typing import Callable
+
+
+@click.command()
+@click.argument("output_file")
+@click.option("-t", "--taxa", "taxa", multiple=True, type=click.IntRange(3), default=(8, 16, 32, 64),
+              help="Numbers of species in the taxa sweep (can be given multiple times).")
+@click.option("-c", "--clusters", "clusters", multiple=True, type=click.IntRange(1), default=(50, 100, 200, 400),
+              help="Numbers of clusters in the clusters sweep (can be given multiple times).")
+@click.option("--no_taxa", "no_taxa", default=16, type=click.IntRange(3), help="Number of species in the clusters sweep.")
+@click.option("--no_clusters", "no_clusters", default=100, type=click.IntRange(1),
+              help="Number of clusters in the taxa sweep.")
+@click.option("-l", "--length", "length", default=300, type=click.IntRange(10), help="Mean length of sequences.")
+@click.option("--paralog_rate", "paralog_rate", default=0.1, type=click.FloatRange(0, 1),
+              help="Probability that a species has a paralog in a cluster.")
+@click.option("-r", "--replicates", "replicates", default=100, type=click.IntRange(2),
+              help="Number of bootstrap trees in the `check_bootstrap` benchmark.")
+@click.option("--sample", "sample", default=10, type=click.IntRange(1),
+              help="Number of alignments used by per-alignment benchmarks (NJ and bootstrap).")
+@click.option("--repeats", "repeats", default=3, type=click.IntRange(1),
+              help="Number of runs of every benchmark - the fastest one is reported.")
+@click.option("-s", "--seed", "seed", default=0, help="Seed of the synthetic data generator.")
+@click.option("-b", "--benchmark", "selected", multiple=True, help="Run only given benchmarks (can be given multiple times).")
+@click.option("-p", "--plot_dir", "plot_dir", required=False, help="Set to save scaling curves as .png files there.")
+@click.option("--baseline", "baseline", required=False, help="Results of a previous run (.json) to compare with.")
+def run_benchmarks(output_file: str, taxa: tuple[int], clusters: tuple[int], no_taxa: int = 16, no_clusters: int = 100,
+                   length: int = 300, paralog_rate: float = 0.1, replicates: int = 100, sample: int = 10,
+                   repeats: int = 3, seed: int = 0, selected: tuple[str] = (), plot_dir: str = None,
+                   baseline: str = None):
+    """
+    The script benchmarks hot paths of the pipeline (see `BENCHMARKS`) on synthetic data (see `synthetic_data.py`)
+    generated offline with a given `seed`. Benchmarks run on datasets of the taxa sweep (`taxa` species,
+    `no_clusters` clusters) and of the clusters sweep (`no_taxa` species, `clusters` clusters) and results are saved
+    in `output_file` (.json), so runs can be compared over time (`baseline`).
+    """
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        raise click.UsageError(f"Unknown benchmarks: {', '.join(sorted(unknown))}. Available: {', '.join(BENCHMARKS)}.")
+    options = {"length": length, "paralog_rate": paralog_rate, "replicates": replicates, "sample": sample,
+               "repeats": repeats, "seed": seed}
+    points = {}  # {(no_taxa, no_clusters): [sweep]}
+    for point in [(no, no_clusters) for no in taxa]:
+        points.setdefault(point, []).append("taxa")
+    for point in [(no_taxa, no) for no in clusters]:
+        points.setdefault(point, []).append("clusters")
+    results = []
+    for (point_taxa, point_clusters), sweeps in sorted(points.items()):
+        with tempfile.TemporaryDirectory(prefix="benchmark_") as data_dir:
+            synthetic_data.write_dataset(data_dir, point_taxa, point_clusters, length, paralog_rate, seed)
+            for name, (benchmark_sweeps, setup) in BENCHMARKS.items():
+                if (selected and name not in selected) or not set(sweeps) & set(benchmark_sweeps):
+                    continue
+                function, no_items = setup(data_dir, options)
+                times = measure(function, repeats)
+                results.append({"benchmark": name, "taxa": point_taxa, "clusters": point_clusters, "items": no_items,
+                                "sweeps": sorted(set(sweeps) & set(benchmark_sweeps)), "seconds": min(times),
+                                "times": times})
+                print(f"{name} ({point_taxa} taxa, {point_clusters} clusters): {min(times):.4f} s")
+    if os.path.dirname(output_file):
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, "w") as file:
+        json.dump({"date": datetime.now(timezone.utc).isoformat(), "commit": get_commit(), "python": platform.python_version(),
+                   "machine": platform.platform(), "options": options, "results": results}, file, indent=2)
+    if plot_dir:
+        os.makedirs(plot_dir, exist_ok=True)
+        for sweep in ("taxa", "clusters"):
+            plot_scaling(results, sweep, f"{plot_dir}/scaling_{sweep}.png")
+    if baseline:
+        compare_results(results, baseline)
+
+
+def measure(function: Callable[[], None], repeats: int) -> list[float]:
+    """
+    Returns wall times (in seconds) of `repeats` runs of a given `function`.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def setup_parse_clustering_output(data_dir: str, options: dict) -> tuple[Callable[[], None], int]:
+    """
+    Returns a function parsing the whole MMseqs2 clustering output with `get_clusters.parse_clustering_output`
+    and the number of sequences.
+    """
+    def function():
+        for _ in get_clusters.parse_clustering_output(data_dir):
+            pass
+    return function, sum(1 for _ in get_clusters.parse_clustering_output(data_dir))
+
+
+def setup_get_filtered_clusters(data_dir: str, options: dict) -> tuple[Callable[[], None], int]:
+    """
+    Returns a function running `get_filtered_clusters.py` for one-to-one clusters and paralogs (as the pipeline does)
+    on packed clusters and the number of clusters.
+    """
+    get_clusters.write_clusters_files(get_clusters.parse_clustering_output(data_dir), data_dir)
+    function = lambda: get_filtered_clusters.get_filtered_clusters.callback(
+        f"{data_dir}/organisms.txt", f"{data_dir}/clusters/", (f"{data_dir}/full/",), ((f"{data_dir}/para/", 3),))
+    return function, len(get_filtered_clusters.read_manifest(f"{data_dir}/clusters/"))
+
+
+def setup_get_nj_tree(engine: str) -> Callable[[str, dict], tuple[Callable[[], None], int]]:
+    """
+    Returns a setup of a benchmark building NJ trees (without bootstrap) for sampled alignments
+    with `get_nj_trees.get_nj_tree` and a given `engine`.
+    """
+    def setup(data_dir: str, options: dict) -> tuple[Callable[[], None], int]:
+        alignments = read_alignments(data_dir, options["sample"])
+        function = lambda: [get_nj_trees.get_nj_tree(alignment, [None], engine) for alignment in alignments]
+        return function, len(alignments)
+    return setup
+
+
+def setup_check_bootstrap(data_dir: str, options: dict) -> tuple[Callable[[], None], int]:
+    """
+    Returns a function checking bootstrap support of sampled alignments with `nj_engine.check_bootstrap`
+    (`replicates` bootstrap trees with a fixed seed) and the number of alignments.
+    """
+    encoded = [nj_engine.encode_alignment(alignment)[0] for alignment in read_alignments(data_dir, options["sample"])]
+    function = lambda: [nj_engine.check_bootstrap(matrix, 70, options["replicates"], rng=np.random.default_rng(0))
+                        for matrix in encoded]
+    return function, len(encoded)
+
+
+def setup_trim_alignment(data_dir: str, options: dict) -> tuple[Callable[[], None], int]:
+    """
+    Returns a function removing gappy and constant columns of sampled alignments with `nj_engine.trim_alignment`
+    and the number of alignments.
+    """
+    encoded = [nj_engine.encode_alignment(alignment)[0] for alignment in read_alignments(data_dir, options["sample"])]
+    function = lambda: [nj_engine.trim_alignment(matrix, 0.5, 1) for matrix in encoded]
+    return function, len(encoded)
+
+
+def setup_write_length_less_trees(data_dir: str, options: dict) -> tuple[Callable[[], None], int]:
+    """
+    Returns a function writing NJ trees of all clusters (built in advance) without branch lengths, as Fasturec input
+    written by `get_nj_trees.py`, and the number of trees.
+    """
+    trees = get_cluster_trees(data_dir)
+    def function():
+        with open(f"{data_dir}/nj_trees_length_less.nwk", "w") as trees_file:
+            for tree in trees:
+                trees_file.write(f"{get_nj_trees.get_newick(tree, lengths=False)}\n")
+    return function, len(trees)
+
+
+def setup_get_rf(data_dir: str, options: dict) -> tuple[Callable[[], None], int]:
+    """
+    Returns a function running `get_rf.py` for the species tree against itself and NJ trees of all clusters
+    (without paralogs) and the number of trees.
+    """
+    trees = get_cluster_trees(data_dir)
+    with open(f"{data_dir}/nj_trees.nwk", "w") as trees_file:
+        for tree in trees:
+            trees_file.write(f"{get_nj_trees.get_newick(tree)};\n")
+    species_tree = f"{data_dir}/species_tree.nwk"
+    function = lambda: get_rf.get_rf.callback(species_tree, data_dir, (species_tree,), (f"{data_dir}/nj_trees.nwk",))
+    return function, len(trees) + 2
+
+
+BENCHMARKS = {  # {name: (sweeps, setup)}
+    "parse_clustering_output": (["taxa", "clusters"], setup_parse_clustering_output),
+    "get_filtered_clusters": (["taxa", "clusters"], setup_get_filtered_clusters),
+    "get_nj_tree_biopython": (["taxa"], setup_get_nj_tree("biopython")),
+    "get_nj_tree_numpy": (["taxa"], setup_get_nj_tree("numpy")),
+    "check_bootstrap": (["taxa"], setup_check_bootstrap),
+    "trim_alignment": (["taxa"], setup_trim_alignment),
+    "write_length_less_trees": (["taxa", "clusters"], setup_write_length_less_trees),
+    "get_rf": (["taxa", "clusters"], setup_get_rf),
+}
+
+
+def read_alignments(data_dir: str, sample: int = None) -> list[MultipleSeqAlignment]:
+    """
+    Reads MSAs of the first `sample` clusters (all if not set) of a synthetic dataset from `data_dir`.
+    """
+    msa_files = sorted(glob.glob(f"{data_dir}/msa/*.fasta"), key=lambda name: int(name.split("family")[-1].split(".")[0]))
+    return [AlignIO.read(msa_file, "fasta") for msa_file in msa_files[:sample]]
+
+
+def get_cluster_trees(data_dir: str) -> list[Tree]:
+    """
+    Returns NJ trees (numpy engine) of all clusters of a synthetic dataset from `data_dir` with paralogs removed,
+    so every tree has all species once.
+    """
+    trees = []
+    for alignment in read_alignments(data_dir):
+        alignment = MultipleSeqAlignment([record for record in alignment if "$" not in record.id])
+        trees.append(get_nj_trees.get_nj_tree(alignment, [None], "numpy")[0])
+    return trees
+
+
+def get_commit() -> str:
+    """
+    Returns the current git commit of the repository (None if not available).
+    """
+    try:
+        process = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)))
+    except FileNotFoundError:
+        return None
+    return process.stdout.strip() or None
+
+
+def plot_scaling(results: list[dict], sweep: str, output_name: str):
+    """
+    Saves scaling curves (time against the number of taxa or clusters, log-log) of all benchmarks run in a given
+    `sweep` ("taxa" or "clusters") as a .png file.
+    """
+    figure, axes = plt.subplots(figsize=(8, 5))
+    for name in BENCHMARKS:
+        points = sorted((result[sweep], result["seconds"]) for result in results
+                        if result["benchmark"] == name and sweep in result["sweeps"])
+        if points:
+            axes.plot(*zip(*points), marker="o", label=name)
+    axes.set_xscale("log")
+    axes.set_yscale("log")
+    axes.set_xlabel(f"number of {sweep}")
+    axes.set_ylabel("time [s]")
+    axes.legend(fontsize="small")
+    figure.tight_layout()
+    figure.savefig(output_name)
+    plt.close(figure)
+
+
+def compare_results(results: list[dict], baseline: str):
+    """
+    Prints time ratios (current / baseline) of benchmarks run on the same datasets as in a `baseline` .json file.
+    """
+    with open(baseline, "r") as file:
+        previous = {(result["benchmark"], result["taxa"], result["clusters"]): result["seconds"]
+                    for result in json.load(file)["results"]}
+    for result in results:
+        key = (result["benchmark"], result["taxa"], result["clusters"])
+        if key in previous:
+            print(f"{result['benchmark']} ({result['taxa']} taxa, {result['clusters']} clusters): "
+                  f"{result['seconds'] / previous[key]:.2f}x of baseline")
+
+
+if __name__ == "__main__":
+    run_benchmarks()
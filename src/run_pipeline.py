@@ -0,0 +1,275 @@
+"""
+Exemplary run: `python ./src/run_pipeline.py ./data/organisms.txt ./data/ bin/fasturec`
+"""
+import click
+import multiprocessing
+import os
+import pipeline
+import shutil
+import subprocess
+import sys
+import telemetry
+import time
+import worker_pool
+
+from dataclasses import dataclass, field
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKFLOW_DIR = "workflow"
+POLL_INTERVAL = 0.5
+BATCH_SEPARATOR = "::"
+
+
+@dataclass
+class Stage:
+    """
+    One step of the pipeline - a command run once all stages it depends on (`dependencies`) are done. `command` may
+    contain `{cores}` replaced with the number of cores given to the stage: a fixed number (`cores`) or, if it is 0,
+    an equal share of free cores. The stage is up to date if its `outputs` exist and it was finished with the same
+    command after its dependencies and external `inputs` had been changed. If `workdir` is set, the command is run
+    in this (emptied) directory.
+    """
+    name: str
+    command: list[str]
+    dependencies: list[str] = field(default_factory=list)
+    inputs: list[str] = field(default_factory=list)
+    outputs: list[str] = field(default_factory=list)
+    cores: int = 1
+    workdir: str = None
+
+
+@click.command()
+@click.argument("species_file")
+@click.argument("output_dir")
+@click.argument("fasturec_path")
+@click.option("-j", "--cores", "cores", type=click.IntRange(1), required=False,
+              help="Number of cores shared by all stages running at the same time (default: 75% of all cores).")
+@click.option("-f", "--force", "force", is_flag=True, required=False,
+              help="Set to run all stages, also the ones which are up to date.")
+@click.option("--supertree_time", "supertree_time", type=click.FloatRange(0, min_open=True), required=False,
+              help="Time budget in seconds of the supertree search for each set of NJ trees.")
+@click.option("--trace", "trace", required=False,
+              help="JSONL file the performance trace is appended to (default: `output_dir/workflow/trace.jsonl`).")
+def run_pipeline(species_file: str, output_dir: str, fasturec_path: str, cores: int = None, force: bool = False,
+                 supertree_time: float = None, trace: str = None):
+    """
+    This script runs the whole pipeline for species from `species_file` and saves all results in `output_dir`.
+    Stages (see `get_stages`) are run as soon as the stages they depend on are done, so independent branches (e.g.
+    supertrees of one-to-one and paralog clusters) run at the same time within the budget of `cores`. MSAs and NJ
+    trees of all clusters are built by one stage (see `run_batch`), so workers are started once. Stages which are
+    up to date are skipped, so an interrupted run can be continued by running the script again. Output of every stage
+    is saved in `output_dir/workflow/<stage>.log`. Every supertree is searched by parallel Fasturec runs
+    (see `get_multistart_supertree.py`), each in its own working directory. All stages append their performance
+    records to the trace (see `telemetry` and `get_trace_summary.py`).
+    """
+    output_dir = os.path.abspath(output_dir)
+    workflow_dir = f"{output_dir}/{WORKFLOW_DIR}"
+    os.makedirs(workflow_dir, exist_ok=True)
+    os.environ[telemetry.TRACE_VARIABLE] = os.path.abspath(trace or f"{workflow_dir}/trace.jsonl")
+    stages = get_stages(os.path.abspath(species_file), output_dir, get_command_path(fasturec_path), supertree_time)
+    no_cores = cores or max(1, int(0.75 * multiprocessing.cpu_count()))
+    failed = run_stages(stages, workflow_dir, no_cores, force)
+    if failed:
+        raise Exception(f"Pipeline stages failed: {', '.join(failed)}. See logs in {workflow_dir}/.")
+
+
+def get_stages(species_file: str, output_dir: str, fasturec_path: str, supertree_time: float = None) -> list[Stage]:
+    """
+    Returns stages of the pipeline for given absolute paths to `species_file`, `output_dir` and Fasturec.
+    Supertrees are searched by parallel Fasturec runs for at most `supertree_time` seconds (if set).
+    """
+    supertree_options = ["-t", str(supertree_time)] if supertree_time else []
+    clusters_dir = f"{output_dir}/clusters"
+    cache_dir = f"{output_dir}/cache/"
+    stages = [
+        Stage("proteomes", get_script("proteomes", species_file, output_dir), inputs=[species_file],
+              outputs=[f"{output_dir}/proteomes.fasta"]),
+        Stage("clusters", get_script("clusters", "-j", "{cores}", f"{output_dir}/proteomes.fasta", output_dir),
+              ["proteomes"], outputs=[f"{clusters_dir}/parsed.fasta", f"{clusters_dir}/manifest.tsv"], cores=0),
+        Stage("filtered_clusters", get_script("filtered_clusters", "-o", f"{clusters_dir}/full/",
+                                              "-p", f"{clusters_dir}/para/", "3", species_file, f"{clusters_dir}/"),
+              ["clusters"], [species_file], [f"{clusters_dir}/full/", f"{clusters_dir}/para/"]),
+    ]
+    trees_commands, trees_outputs = [], []
+    for clusters, outputs in (("full", ["one2one", "bootstrap"]), ("para", ["paralogs"])):
+        msa_dir = f"{clusters_dir}/{clusters}_msa/"
+        threshold_outputs = [option for output in outputs[1:] for option in ("-t", f"{output_dir}/{output}/", "70")]
+        trees_commands += [["msa", "-q", "-c", cache_dir, "-j", "{cores}", f"{clusters_dir}/{clusters}/", msa_dir],
+                           ["nj_trees", "-e", "numpy", "-s", *threshold_outputs, "-c", cache_dir, "-j", "{cores}",
+                            msa_dir, f"{output_dir}/{outputs[0]}/"]]
+        trees_outputs += [f"{msa_dir}alignments.tsv", *[f"{output_dir}/{output}/nj_trees.nwk" for output in outputs]]
+    stages.append(Stage("trees", get_batch(trees_commands), ["filtered_clusters"], outputs=trees_outputs, cores=0))
+    for output in ("one2one", "paralogs", "bootstrap"):
+        if output != "paralogs":
+            stages.append(Stage(f"consensus_{output}", get_script("consensus_tree",
+                                                                  f"{output_dir}/{output}/nj_trees.nwk",
+                                                                  f"{output_dir}/{output}/"),
+                                ["trees"], outputs=[f"{output_dir}/{output}/consensus_tree.nwk"]))
+        stages.append(Stage(f"supertree_{output}", get_script("multistart_supertree", "-f", fasturec_path,
+                                                              "-j", "{cores}", "-w", ".", *supertree_options,
+                                                              f"{output_dir}/{output}/nj_trees_length_less.nwk",
+                                                              f"{output_dir}/{output}/"),
+                            ["trees"], outputs=[f"{output_dir}/{output}/super_tree.nwk"], cores=0,
+                            workdir=f"{output_dir}/{output}/fasturec/"))
+    species_trees = [f"{output_dir}/one2one/consensus_tree.nwk", f"{output_dir}/one2one/super_tree.nwk",
+                     f"{output_dir}/bootstrap/consensus_tree.nwk", f"{output_dir}/bootstrap/super_tree.nwk",
+                     f"{output_dir}/paralogs/super_tree.nwk"]
+    species_stages = ["consensus_one2one", "supertree_one2one", "consensus_bootstrap", "supertree_bootstrap",
+                      "supertree_paralogs"]
+    ref_tree, timetree = f"{output_dir}/ref_tree.nwk", f"{output_dir}/timetree/organisms_timetree.nwk"
+    stages.append(Stage("rf", get_script("rf", "-g", f"{output_dir}/one2one/nj_trees.nwk",
+                                         *[option for tree in species_trees for option in ("-t", tree)],
+                                         "-r", timetree, ref_tree, output_dir),
+                        species_stages, [ref_tree, timetree],
+                        [f"{output_dir}/report_ref_tree.txt", f"{output_dir}/report_organisms_timetree.txt"]))
+    return stages
+
+
+def get_script(command: str, *args: str) -> list[str]:
+    """
+    Returns a command running a given subcommand of `pipeline.py` with given arguments.
+    """
+    return [sys.executable, f"{SCRIPTS_DIR}/pipeline.py", command, *args]
+
+
+def get_batch(commands: list[list[str]]) -> list[str]:
+    """
+    Returns a command running given subcommands of `pipeline.py` (with their arguments) one by one in one process
+    (see `run_batch`).
+    """
+    return get_script("batch", *[arg for command in commands for arg in (BATCH_SEPARATOR, *command)][1:])
+
+
+def get_command_path(command: str) -> str:
+    """
+    Returns an absolute path to a given command if it is a path (so it can be run from any directory).
+    """
+    return os.path.abspath(command) if os.sep in command else command
+
+
+@click.command(context_settings={"allow_interspersed_args": False})
+@click.argument("commands", nargs=-1, type=click.UNPROCESSED)
+def run_batch(commands: tuple[str]):
+    """
+    This script runs subcommands of `pipeline.py` (`commands` with their arguments, separated by `::`) one by one
+    in one process, so the pool of workers (see `worker_pool`) is started once and reused by all of them. It stops
+    at the first failed subcommand. Every subcommand is measured as a separate stage (see `telemetry`).
+    """
+    argv = sys.argv
+    try:
+        for command in get_batch_commands(commands):
+            print(f"Running {' '.join(command)}", flush=True)
+            sys.argv = [argv[0], *command]  # the stage records its arguments as in a run of its own
+            pipeline.pipeline.main(command, prog_name=os.path.basename(argv[0]), standalone_mode=False)
+    finally:
+        sys.argv = argv
+        worker_pool.close_pools()
+
+
+def get_batch_commands(args: tuple[str]) -> list[list[str]]:
+    """
+    Splits arguments of `run_batch` (`args`) into subcommands with their arguments.
+    """
+    commands = [[]]
+    for arg in args:
+        if arg == BATCH_SEPARATOR:
+            commands.append([])
+        else:
+            commands[-1].append(arg)
+    return [command for command in commands if command]
+
+
+def run_stages(stages: list[Stage], workflow_dir: str, no_cores: int, force: bool = False) -> list[str]:
+    """
+    Runs `stages` in the given order as soon as their dependencies are done, using at most `no_cores` cores at a time.
+    Stages up to date are skipped unless `force` is set. Stages depending on a failed stage are not run.
+    Returns names of failed stages.
+    """
+    pending = list(stages)
+    running = []  # [(process, stage, cores, start_time)]
+    done, failed = set(), []
+    free_cores = no_cores
+    while pending or running:
+        for stage in [stage for stage in pending if any(dependency in failed for dependency in stage.dependencies)]:
+            pending.remove(stage)
+            failed.append(stage.name)
+            print(f"Stage {stage.name} not run - a stage it depends on failed.")
+        ready = [stage for stage in pending if all(dependency in done for dependency in stage.dependencies)]
+        stage = next((stage for stage in ready if max(1, min(stage.cores, no_cores)) <= free_cores), None)
+        if stage:
+            pending.remove(stage)
+            if not force and check_stage(stage, workflow_dir):
+                print(f"Stage {stage.name} is up to date.")
+                telemetry.record("workflow", stage.name, status="skipped")
+                done.add(stage.name)
+                continue
+            cores = min(stage.cores, no_cores) or max(1, free_cores // sum(not other.cores for other in ready))
+            running.append((start_stage(stage, cores, workflow_dir), stage, cores, time.monotonic()))
+            free_cores -= cores
+            print(f"Stage {stage.name} started on {cores} core(s).")
+            continue
+        time.sleep(POLL_INTERVAL)
+        for process, stage, cores, start_time in [job for job in running if job[0].poll() is not None]:
+            running.remove((process, stage, cores, start_time))
+            free_cores += cores
+            telemetry.record("workflow", stage.name, wall=round(time.monotonic() - start_time, 6),
+                             exit_code=process.returncode, cores=cores)
+            if process.returncode == 0 and all(os.path.exists(output) for output in stage.outputs):
+                write_stamp(stage, workflow_dir)
+                done.add(stage.name)
+                print(f"Stage {stage.name} finished in {time.monotonic() - start_time:.1f} s.")
+            else:
+                failed.append(stage.name)
+                print(f"Stage {stage.name} failed (exit status: {process.returncode}), "
+                      f"see {workflow_dir}/{stage.name}.log.")
+    return failed
+
+
+def start_stage(stage: Stage, cores: int, workflow_dir: str) -> subprocess.Popen:
+    """
+    Starts a command of a given `stage` with `cores` cores, writing its output to a log file in `workflow_dir`.
+    The stage is marked as not done until it finishes.
+    """
+    if os.path.exists(f"{workflow_dir}/{stage.name}.done"):
+        os.remove(f"{workflow_dir}/{stage.name}.done")
+    if stage.workdir:
+        shutil.rmtree(stage.workdir, ignore_errors=True)
+        os.makedirs(stage.workdir)
+    command = [arg.format(cores=cores) for arg in stage.command]
+    with open(f"{workflow_dir}/{stage.name}.log", "w") as log_file:
+        return subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, cwd=stage.workdir)
+
+
+def check_stage(stage: Stage, workflow_dir: str) -> bool:
+    """
+    Checks if a given `stage` is up to date - it was finished with the same command, all its outputs exist and neither
+    its dependencies nor its inputs were changed after that.
+    """
+    stamp_name = f"{workflow_dir}/{stage.name}.done"
+    if not os.path.exists(stamp_name) or not all(os.path.exists(output) for output in stage.outputs):
+        return False
+    with open(stamp_name, "r") as stamp_file:
+        if stamp_file.read() != get_stamp(stage):
+            return False
+    sources = [f"{workflow_dir}/{dependency}.done" for dependency in stage.dependencies] + stage.inputs
+    return all(os.path.exists(source) and os.path.getmtime(source) <= os.path.getmtime(stamp_name)
+               for source in sources)
+
+
+def write_stamp(stage: Stage, workflow_dir: str):
+    """
+    Marks a given `stage` as done in `workflow_dir`.
+    """
+    with open(f"{workflow_dir}/{stage.name}.done", "w") as stamp_file:
+        stamp_file.write(get_stamp(stage))
+
+
+def get_stamp(stage: Stage) -> str:
+    """
+    Returns content of a file marking a given `stage` as done - its command (without the number of cores).
+    """
+    return " ".join(stage.command) + "\n"
+
+
+if __name__ == "__main__":
+    run_pipeline()
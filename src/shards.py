@@ -0,0 +1,58 @@
+"""
+Sharded execution of per-cluster stages (`get_msa.py`, `get_nj_trees.py`) on many nodes. Clusters are assigned to
+shards by a stable hash of their names, so every node given `--shard i/N` processes the same slice of clusters
+in every stage. Results of each shard are saved in its own directory with a completion marker, so a failed shard
+can be rerun alone, and are combined by `merge_shards.py`.
+"""
+import click
+import hashlib
+import os
+
+SHARDS_DIR = "shards"
+SHARD_DONE = "shard.done"
+
+
+def parse_shard(ctx: click.Context, param: click.Parameter, value: str) -> tuple[int, int]:
+    """
+    Parses `--shard` option given as "i/N" (shard i of N, counted from 0) to (i, N).
+    """
+    if value is None:
+        return None
+    try:
+        index, no_shards = map(int, value.split("/"))
+    except ValueError:
+        raise click.BadParameter("Shard has to be given as i/N, e.g. 0/4.")
+    if not 0 <= index < no_shards:
+        raise click.BadParameter(f"Shard index has to be between 0 and {no_shards - 1}.")
+    return index, no_shards
+
+
+def get_shard_index(cluster_name: str, no_shards: int) -> int:
+    """
+    Returns the index of a shard of a given cluster. MSA files have the same shard as the clusters they come from.
+    """
+    key = cluster_name.removeprefix("mafft_").encode()
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], "big") % no_shards
+
+
+def get_shard_dir(output_dir: str, shard: tuple[int, int]) -> str:
+    """
+    Returns a directory with results of a given shard of results saved in `output_dir`.
+    """
+    index, no_shards = shard
+    return f"{output_dir}/{SHARDS_DIR}/{index}_of_{no_shards}"
+
+
+def is_done(shard_dir: str) -> bool:
+    """
+    Checks if the shard with results in `shard_dir` is completed.
+    """
+    return os.path.exists(f"{shard_dir}/{SHARD_DONE}")
+
+
+def mark_done(shard_dir: str, no_clusters: int):
+    """
+    Marks the shard with results in `shard_dir` (of `no_clusters` clusters) as completed.
+    """
+    with open(f"{shard_dir}/{SHARD_DONE}", "w") as marker_file:
+        marker_file.write(f"{no_clusters}\n")
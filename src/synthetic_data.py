@@ -0,0 +1,180 @@
+"""
+Exemplary run: `python ./src/synthetic_data.py ./data/synthetic/ -t 16 -c 200`
+
+Deterministic generator of synthetic pipeline inputs used by `run_benchmarks.py`: a random species tree,
+gene families evolved along it (with paralogs) and files in the formats of pipeline stages - species file,
+proteomes, MMseqs2 clustering output and MSAs. The same seed gives the same data.
+"""
+import click
+import numpy as np
+import os
+
+from Bio.Phylo.BaseTree import Clade, Tree
+from dataclasses import dataclass
+
+AMINO_ACIDS = np.frombuffer(b"ACDEFGHIKLMNPQRSTVWY", dtype=np.uint8)
+MEAN_BRANCH_LENGTH = 0.1
+PARALOG_BRANCH_LENGTH = 0.05
+GAP_RATE = 0.02
+
+
+@dataclass
+class Species:
+    """
+    A synthetic species given by its proteome id (as in UniProt) and name (as in the species file).
+    """
+    id: str
+    name: str
+
+
+@dataclass
+class GeneFamily:
+    """
+    Sequences of one gene family: [(species, sequence)] with paralogs of a species following each other.
+    Sequences are aligned (the same length, gaps as "-").
+    """
+    name: str
+    sequences: list[tuple[Species, str]]
+
+
+@click.command()
+@click.argument("output_dir")
+@click.option("-t", "--taxa", "no_taxa", default=16, type=click.IntRange(3), help="Number of species.")
+@click.option("-c", "--clusters", "no_families", default=200, type=click.IntRange(1), help="Number of gene families.")
+@click.option("-l", "--length", "length", default=300, type=click.IntRange(10), help="Mean length of sequences.")
+@click.option("-p", "--paralog_rate", "paralog_rate", default=0.1, type=click.FloatRange(0, 1),
+              help="Probability that a species has a paralog in a gene family.")
+@click.option("-s", "--seed", "seed", default=0, help="Seed of the generator.")
+def synthetic_data(output_dir: str, no_taxa: int = 16, no_families: int = 200, length: int = 300,
+                   paralog_rate: float = 0.1, seed: int = 0):
+    """
+    The script generates a synthetic dataset and saves it in `output_dir` (see `write_dataset`).
+    """
+    write_dataset(output_dir, no_taxa, no_families, length, paralog_rate, seed)
+
+
+def write_dataset(output_dir: str, no_taxa: int, no_families: int, length: int = 300, paralog_rate: float = 0.1,
+                  seed: int = 0) -> tuple[Tree, list[Species], list[GeneFamily]]:
+    """
+    Generates `no_families` gene families of `no_taxa` species and saves: the species tree (`species_tree.nwk`),
+    species file (`organisms.txt`), proteomes (`proteomes.fasta`), MMseqs2 clustering output
+    (`clusters/clusters_all_seqs.fasta`) and MSAs of families (`msa/`) in `output_dir`. Returns the generated data.
+    """
+    rng = np.random.default_rng(seed)
+    species = [Species(f"UP{i:09d}", f"Genus species{i}") for i in range(no_taxa)]
+    tree = get_species_tree([item.name.replace(" ", "_") for item in species], rng)
+    families = [get_gene_family(f"family{i}", tree, species, length, paralog_rate, rng) for i in range(no_families)]
+    for directory in (output_dir, f"{output_dir}/clusters", f"{output_dir}/msa"):
+        os.makedirs(directory, exist_ok=True)
+    with open(f"{output_dir}/species_tree.nwk", "w") as tree_file:
+        tree_file.write(f"{tree.format('newick').strip()}\n")
+    with open(f"{output_dir}/organisms.txt", "w") as species_file:
+        species_file.writelines(f"{item.id} {item.name} strain{i}\n" for i, item in enumerate(species))
+    write_proteomes(families, species, f"{output_dir}/proteomes.fasta")
+    write_clustering_output(families, f"{output_dir}/clusters/clusters_all_seqs.fasta")
+    for family in families:
+        write_msa(family, f"{output_dir}/msa/mafft_{family.name}.fasta")
+    return tree, species, families
+
+
+def get_species_tree(names: list[str], rng: np.random.Generator) -> Tree:
+    """
+    Returns a random binary tree with leaves named `names`: random pairs of subtrees are joined until one is left.
+    Branch lengths are exponential with mean `MEAN_BRANCH_LENGTH`.
+    """
+    subtrees = [Clade(branch_length=rng.exponential(MEAN_BRANCH_LENGTH), name=name) for name in names]
+    while len(subtrees) > 1:
+        first, second = sorted(rng.choice(len(subtrees), 2, replace=False), reverse=True)
+        clades = [subtrees.pop(first), subtrees.pop(second)]
+        subtrees.append(Clade(branch_length=rng.exponential(MEAN_BRANCH_LENGTH), clades=clades))
+    subtrees[0].branch_length = 0
+    return Tree(subtrees[0], rooted=True)
+
+
+def mutate(sequence: np.ndarray, branch_length: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Returns a copy of a given `sequence` (amino acid codes) evolved along a branch of a given length: every site
+    is replaced by a random amino acid with probability 1 - exp(-branch_length).
+    """
+    mutated = sequence.copy()
+    sites = rng.random(len(sequence)) < -np.expm1(-branch_length)
+    mutated[sites] = rng.choice(AMINO_ACIDS, int(sites.sum()))
+    return mutated
+
+
+def get_gene_family(name: str, tree: Tree, species: list[Species], length: int, paralog_rate: float,
+                    rng: np.random.Generator) -> GeneFamily:
+    """
+    Returns a gene family evolved along a species `tree` (with leaves in the order of `species`) from a random root
+    sequence of length between half and 1.5 of `length`. Each species gets a paralog with probability `paralog_rate`.
+    Gaps are added at random sites with probability `GAP_RATE`.
+    """
+    root = rng.choice(AMINO_ACIDS, int(rng.integers(max(1, length // 2), length * 3 // 2 + 1)))
+    leaf_sequences = {}
+    stack = [(tree.root, root)]
+    while stack:
+        clade, sequence = stack.pop()
+        sequence = mutate(sequence, clade.branch_length or 0, rng)
+        if clade.is_terminal():
+            leaf_sequences[clade.name] = sequence
+        stack.extend((child, sequence) for child in clade.clades)
+    sequences = []
+    for item in species:
+        copies = [leaf_sequences[item.name.replace(" ", "_")]]
+        if rng.random() < paralog_rate:
+            copies.append(mutate(copies[0], PARALOG_BRANCH_LENGTH, rng))
+        for sequence in copies:
+            sequence = sequence.copy()
+            sequence[rng.random(len(sequence)) < GAP_RATE] = ord("-")
+            sequences.append((item, sequence.tobytes().decode()))
+    return GeneFamily(name, sequences)
+
+
+def write_proteomes(families: list[GeneFamily], species: list[Species], output_name: str):
+    """
+    Saves sequences of all families (without gaps) as proteomes merged by `get_proteomes.py` - grouped by species,
+    with the proteome id at the end of every header.
+    """
+    proteomes = {item.id: [] for item in species}
+    for family in families:
+        for i, (item, sequence) in enumerate(family.sequences):
+            proteomes[item.id].append(f"{get_header(family, i, item)}\n{sequence.replace('-', '')}\n")
+    with open(output_name, "w") as output_file:
+        for proteome in proteomes.values():
+            output_file.writelines(proteome)
+
+
+def write_clustering_output(families: list[GeneFamily], output_name: str):
+    """
+    Saves all families as MMSeqs2's `_all_seqs.fasta` output: every cluster starts with a line with an identifier
+    of its representative sequence followed by all its sequences.
+    """
+    with open(output_name, "w") as output_file:
+        for family in families:
+            output_file.write(f"{get_header(family, 0, family.sequences[0][0]).split()[0]}\n")
+            for i, (item, sequence) in enumerate(family.sequences):
+                output_file.write(f"{get_header(family, i, item)}\n{sequence.replace('-', '')}\n")
+
+
+def write_msa(family: GeneFamily, output_name: str):
+    """
+    Saves an MSA of a given `family` with headers unified as by `get_filtered_clusters.py` (species names, "$" added
+    for every repeating one).
+    """
+    seen = {}
+    with open(output_name, "w") as output_file:
+        for item, sequence in family.sequences:
+            name = item.name.replace(" ", "_")
+            seen[name] = seen.get(name, -1) + 1
+            output_file.write(f">{name}{'$' * seen[name]}\n{sequence}\n")
+
+
+def get_header(family: GeneFamily, index: int, species: Species) -> str:
+    """
+    Returns a UniProt-like header of the `index`-th sequence of a given `family` of given `species`.
+    """
+    return f">tr|{family.name.upper()}_{index}|{family.name.upper()}_{index}_{species.id} Synthetic protein {species.id}"
+
+
+if __name__ == "__main__":
+    synthetic_data()
@@ -0,0 +1,145 @@
+"""
+Telemetry of pipeline stages. If the `PIPELINE_TRACE` environment variable is set (`run_pipeline.py` sets it),
+records are appended to this JSONL file by every stage, its pool workers and subprocesses: stages, clusters, steps
+of processing a cluster (e.g. NJ and bootstrap), external tools and workflow tasks, with wall time, CPU time, peak RSS
+and fields describing the input. Without the variable nothing is measured. See `get_trace_summary.py`.
+"""
+import json
+import os
+import resource
+import sys
+import time
+
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator
+
+TRACE_VARIABLE = "PIPELINE_TRACE"
+
+context = {}  # names of the current stage and cluster added to all records of the process
+active = []  # fields of records being measured, the innermost one is the last
+live_children = []  # lists of child processes kept alive across stages (workers of `worker_pool`)
+
+
+def is_enabled() -> bool:
+    """
+    Checks if records are saved.
+    """
+    return bool(os.environ.get(TRACE_VARIABLE))
+
+
+def record(kind: str, name: str, **fields):
+    """
+    Appends a record of a given `kind` ("stage", "cluster", "step", "tool" or "workflow") named `name` with given
+    `fields` to the trace. A record is written with one call, so records of many processes are not mixed.
+    """
+    if not is_enabled():
+        return
+    line = json.dumps({"kind": kind, "name": name, **context, **fields, "pid": os.getpid(), "time": time.time()})
+    with open(os.environ[TRACE_VARIABLE], "a") as trace_file:
+        trace_file.write(f"{line}\n")
+
+
+@contextmanager
+def measure(kind: str, name: str, **fields) -> Iterator[dict]:
+    """
+    Records wall time, CPU time (of the process, its finished children and live workers), peak RSS (in MB, of the
+    process or its largest child so far) and status ("ok" or "error") of the code run in the context. Fields can be
+    added while it runs with `add_fields`. Stage and cluster names are added to records measured inside.
+    """
+    if not is_enabled():
+        yield fields
+        return
+    previous = dict(context)
+    if kind in ("stage", "cluster"):
+        context[kind] = name
+    active.append(fields)
+    start_wall, start_cpu = time.perf_counter(), get_cpu_time()
+    status = "error"
+    try:
+        yield fields
+        status = "ok"
+    finally:
+        wall, cpu = time.perf_counter() - start_wall, get_cpu_time() - start_cpu
+        active.pop()
+        context.clear()
+        context.update(previous)
+        record(kind, name, **fields, wall=round(wall, 6), cpu=round(cpu, 6), peak_rss=get_peak_rss(), status=status)
+
+
+def add_fields(**fields):
+    """
+    Adds given `fields` (e.g. input size) to the innermost record being measured.
+    """
+    if active:
+        active[-1].update(fields)
+
+
+def stage(function: Callable) -> Callable:
+    """
+    Decorator measuring a whole stage (a script's main function) with its command line arguments.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with measure("stage", function.__name__, argv=sys.argv[1:]):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def run_in_context(stage_context: dict, function: Callable, *args, **kwargs):
+    """
+    Runs `function` with a given `stage_context` (names of the stage and cluster of the process which submitted it),
+    so records of a worker reused by many stages are added to the right one.
+    """
+    previous = dict(context)
+    context.clear()
+    context.update(stage_context)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        context.clear()
+        context.update(previous)
+
+
+def get_cpu_time() -> float:
+    """
+    Returns user and system CPU time (in seconds) of the process, its finished children and live workers. Once
+    a worker finishes, its time is counted with the finished children, so differences of the time stay right.
+    """
+    usage, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    workers = sum(get_process_cpu_time(process.pid) for processes in live_children for process in list(processes))
+    return usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime + workers
+
+
+def get_peak_rss() -> float:
+    """
+    Returns peak resident set size (in MB) of the process, its largest finished child or live worker.
+    """
+    usage, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    workers = [get_process_peak_rss(process.pid) for processes in live_children for process in list(processes)]
+    return round(max(usage.ru_maxrss, children.ru_maxrss, *workers) / 1024, 1)
+
+
+def get_process_cpu_time(pid: int) -> float:
+    """
+    Returns user and system CPU time (in seconds) of a running process with a given `pid` read from /proc
+    (0 if it cannot be read, e.g. outside Linux).
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as stat_file:
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return 0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def get_process_peak_rss(pid: int) -> int:
+    """
+    Returns peak resident set size (in kB) of a running process with a given `pid` read from /proc (0 if it cannot
+    be read).
+    """
+    try:
+        with open(f"/proc/{pid}/status", "r") as status_file:
+            return next((int(line.split()[1]) for line in status_file if line.startswith("VmHWM:")), 0)
+    except OSError:
+        return 0
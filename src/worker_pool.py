@@ -0,0 +1,53 @@
+"""
+Process pool shared by all stages run in one process (see the batch subcommand of `pipeline.py`). Workers are started
+once, when a stage needs them for the first time, and are reused by the next stages instead of being started again.
+Tasks run with the telemetry context of the stage which submitted them and CPU time of the live workers is counted
+in records of the stage (see `telemetry.live_children`).
+"""
+import atexit
+import telemetry
+
+from functools import partial
+from multiprocessing import resource_tracker
+from multiprocessing.pool import Pool
+
+pools = {}  # {number of processes: pool} - at most one pool is kept
+
+
+class StagePool(Pool):
+    """
+    Pool running tasks (submitted with `apply_async` or `imap`) with the telemetry context of the stage which
+    submitted them, not the one of the stage which started the workers.
+    """
+    def apply_async(self, func, args=(), kwds={}, callback=None, error_callback=None):
+        return super().apply_async(partial(telemetry.run_in_context, dict(telemetry.context), func), args, kwds,
+                                   callback, error_callback)
+
+    def imap(self, func, iterable, chunksize=1):
+        return super().imap(partial(telemetry.run_in_context, dict(telemetry.context), func), iterable, chunksize)
+
+
+def get_pool(no_processes: int) -> Pool:
+    """
+    Returns the pool of `no_processes` workers started before in this process or starts it. A pool of another size
+    is stopped first. The resource tracker is started before workers, so they share it and shared memory they use
+    is not reported as leaked.
+    """
+    if no_processes not in pools:
+        close_pools()
+        resource_tracker.ensure_running()
+        pools[no_processes] = StagePool(no_processes)
+        telemetry.live_children.append(pools[no_processes]._pool)  # the list of workers is replaced in place
+    return pools[no_processes]
+
+
+@atexit.register
+def close_pools():
+    """
+    Stops workers of the pool (tasks which are not finished are cancelled).
+    """
+    while pools:
+        _, pool = pools.popitem()
+        pool.terminate()
+        pool.join()
+        telemetry.live_children.remove(pool._pool)
@@ -0,0 +1,45 @@
+import large_clusters
+import multiprocessing
+import nj_engine
+import numpy as np
+import pytest
+
+from multiprocessing import resource_tracker
+
+
+@pytest.fixture(scope="module")
+def pool():
+    resource_tracker.ensure_running()  # shared by workers, as in `get_nj_trees`
+    with multiprocessing.Pool(2) as pool:
+        yield pool
+
+
+def get_clusters(no_clusters: int, read: list[str]):
+    rng = np.random.default_rng(0)
+    for i in range(no_clusters):
+        read.append(f"cluster{i}")
+        encoded = rng.integers(ord("A"), ord("E"), (30 + i, 50)).astype(np.uint8)
+        yield f"cluster{i}", encoded, [f"seq{j}" for j in range(len(encoded))]
+
+
+@pytest.mark.parametrize("thresholds", [[None], [1, None], [100]])
+def test_large_cluster_trees_equal_nj_trees(pool, thresholds):
+    jobs = large_clusters.submit_large_clusters(pool, get_clusters(3, []), thresholds, 10, 3)
+    for job, (_, encoded, names) in zip(jobs, get_clusters(3, [])):
+        tree, support, no_replicates = large_clusters.get_large_cluster_tree(job)
+        assert no_replicates == (10 if any(thresholds) else 0)
+        if thresholds == [100] and support < 100:
+            assert tree is None
+        else:
+            expected = nj_engine.nj(nj_engine.get_identity_distances(encoded), names)
+            assert tree.format("newick") == expected.format("newick")
+
+
+def test_submit_large_clusters_bounds_jobs_in_flight(pool):
+    read = []
+    jobs = large_clusters.submit_large_clusters(pool, get_clusters(5, read), [None], 10, 2, max_jobs=2)
+    assert read == ["cluster0", "cluster1"]
+    for no_processed, job in enumerate(jobs, 1):
+        assert len(read) == min(no_processed + 1, 5)
+        large_clusters.get_large_cluster_tree(job)
+    assert len(read) == 5
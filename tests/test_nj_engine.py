@@ -0,0 +1,62 @@
+import nj_engine
+import numpy as np
+import pytest
+
+
+def get_alignment(seed: int, no_sequences: int, length: int, duplicates: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    ancestor = rng.integers(0, 4, length)
+    rates = rng.uniform(0.2, 0.6, (no_sequences, 1))
+    encoded = np.where(rng.random((no_sequences, length)) < rates, rng.integers(0, 4, (no_sequences, length)), ancestor)
+    encoded[rng.integers(1, no_sequences, duplicates)] = encoded[0]
+    return (encoded + ord("A")).astype(np.uint8)
+
+
+def get_criterion_excesses(distances: np.ndarray, joins: list[tuple[int, int, float, float]]) -> list[float]:
+    """
+    Replays `joins` on exact `distances` and returns, for every join, how much its NJ criterion exceeds the minimum
+    (relative to the minimum).
+    """
+    dm, nodes, excesses = distances.copy(), list(range(len(distances))), []
+    for no_joins, (first, second, _, _) in enumerate(joins, 1):
+        node_dist = dm.sum(axis=0) / (len(nodes) - 2)
+        q = dm - node_dist[:, None] - node_dist[None, :]
+        q[np.diag_indices(len(nodes))] = np.inf
+        i, j = nodes.index(first), nodes.index(second)
+        excesses.append((q[i, j] - q.min()) / max(1, abs(q.min())))
+        new_dist = (dm[i] + dm[j] - dm[i, j]) / 2.0
+        new_dist[j] = 0
+        dm[j], dm[:, j] = new_dist, new_dist
+        dm = np.delete(np.delete(dm, i, axis=0), i, axis=1)
+        nodes[j] = len(distances) + no_joins - 1
+        del nodes[i]
+    return excesses
+
+
+def get_splits(joins: list[tuple[int, int, float, float]], no_leaves: int) -> set[int]:
+    """
+    Returns non-trivial splits of an unrooted tree built from `joins` as bitmasks of the side without the first leaf.
+    """
+    all_leaves = (1 << no_leaves) - 1
+    splits = {mask if not mask & 1 else all_leaves ^ mask for mask in nj_engine.get_clade_masks(joins, no_leaves)}
+    return {split for split in splits if 1 < split.bit_count() < no_leaves - 1}
+
+
+@pytest.mark.parametrize("no_candidates", [32, 3])
+@pytest.mark.parametrize("seed", range(5))
+def test_rapid_nj_tree_equals_exact_nj_tree_without_ties(seed, no_candidates):
+    encoded = get_alignment(seed, 40, 2000)
+    joins, _ = nj_engine.get_nj_joins(nj_engine.get_identity_distances(encoded))
+    rapid_joins, _ = nj_engine.get_rapid_nj_joins(nj_engine.get_condensed_identity_distances(encoded), len(encoded),
+                                                  no_candidates)
+    assert get_splits(rapid_joins, len(encoded)) == get_splits(joins, len(encoded))
+
+
+@pytest.mark.parametrize("no_candidates", [32, 3])
+@pytest.mark.parametrize("seed", range(5))
+def test_rapid_nj_joins_minimize_criterion_with_ties(seed, no_candidates):
+    encoded = get_alignment(seed, 50, 12, duplicates=10)
+    distances = nj_engine.get_identity_distances(encoded)
+    rapid_joins, _ = nj_engine.get_rapid_nj_joins(nj_engine.get_condensed_identity_distances(encoded), len(encoded),
+                                                  no_candidates)
+    assert max(get_criterion_excesses(distances, rapid_joins)) < 1e-12
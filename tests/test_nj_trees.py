@@ -0,0 +1,60 @@
+import Bio.Phylo.Consensus
+import get_nj_trees
+import glob
+import nj_engine
+import numpy as np
+import os
+import pytest
+import synthetic_data
+
+from Bio.Align import MultipleSeqAlignment
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from click.testing import CliRunner
+
+
+@pytest.fixture(scope="module")
+def msa_dir(tmp_path_factory) -> str:
+    """
+    Synthetic MSAs of families of 12 species (some with paralogs) and an MSA of two sequences.
+    """
+    data_dir = tmp_path_factory.mktemp("data")
+    synthetic_data.write_dataset(str(data_dir), 12, 4, length=80, paralog_rate=0.2, seed=1)
+    (data_dir / "msa" / "mafft_pair.fasta").write_text(">Genus_species0\nMKV-LA\n>Genus_species1\nMKIQLA\n")
+    return str(data_dir / "msa")
+
+
+def get_trees(msa_dir: str, output_dir: str, engine: str, *options: str) -> dict[str, list[str]]:
+    result = CliRunner().invoke(get_nj_trees.get_nj_trees, [msa_dir, output_dir, "-e", engine, "-j", "1", *options])
+    assert result.exit_code == 0, result.output
+    return {file_name: sorted(open(f"{output_dir}/{file_name}").read().splitlines())
+            for file_name in os.listdir(output_dir)}
+
+
+@pytest.mark.parametrize("options", [(), ("-l", "10"), ("--max_gaps", "0.5", "--conserved", "1"),
+                                     ("-b", "1", "-r", "10"), ("-b", "1", "-r", "10", "-l", "10")])
+def test_numpy_engine_builds_biopython_trees(msa_dir, tmp_path, options):
+    trees = get_trees(msa_dir, str(tmp_path / "numpy"), "numpy", *options)
+    assert trees == get_trees(msa_dir, str(tmp_path / "biopython"), "biopython", *options)
+    assert len(trees["nj_trees.nwk"]) == 5
+
+
+@pytest.mark.parametrize("sequences", [["MKV-LA", "MKIQLA"], ["MKV-LA", "MKIQLA", "MRIQLA", "MKVQLS"]])
+def test_get_newick_writes_trees_as_biopython(sequences):
+    encoded = np.array([list(sequence.encode()) for sequence in sequences], dtype=np.uint8)
+    tree = nj_engine.nj(nj_engine.get_identity_distances(encoded), [f"Genus_species{i}" for i in range(len(sequences))])
+    assert f"{get_nj_trees.get_newick(tree)};" == tree.format("newick").strip()
+
+
+@pytest.mark.parametrize("no_file", range(4))  # families, without the pair
+def test_numpy_bootstrap_support_equals_biopython_support(msa_dir, monkeypatch, no_file):
+    alignment = get_nj_trees.read_mafft_output(sorted(glob.glob(f"{msa_dir}/*.fasta"))[no_file])
+    rng = np.random.default_rng(no_file)
+    columns = list(nj_engine.get_bootstrap_columns(alignment.get_alignment_length(), 20, rng))
+    replicates = [MultipleSeqAlignment([SeqRecord(Seq("".join(record.seq[i] for i in replicate_columns)), id=record.id)
+                                        for record in alignment]) for replicate_columns in columns]
+    monkeypatch.setattr(Bio.Phylo.Consensus, "bootstrap", lambda msa, times: iter(replicates))
+    encoded, _ = nj_engine.encode_alignment(alignment)
+    support = nj_engine.get_avg_bootstrap_support(list(nj_engine.get_bootstrap_clade_masks(encoded, columns)))
+    assert 0 < support < 100
+    assert support == pytest.approx(get_nj_trees.get_bootstrap_support(alignment, len(columns)))
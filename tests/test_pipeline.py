@@ -0,0 +1,66 @@
+import json
+import pipeline
+import run_pipeline
+import synthetic_data
+import telemetry
+import worker_pool
+
+from click.testing import CliRunner
+
+
+def test_run_accepts_options_after_arguments(tmp_path, monkeypatch):
+    """
+    The form documented in readme.md: `pipeline.py run <organisms> <out> <fasturec> [-j <cores>] [--force]`.
+    """
+    monkeypatch.setenv(telemetry.TRACE_VARIABLE, str(tmp_path / "trace.jsonl"))  # restored after the test
+    calls = []
+    monkeypatch.setattr(run_pipeline, "run_stages",
+                        lambda stages, workflow_dir, no_cores, force: calls.append((no_cores, force)) or [])
+    species_file = tmp_path / "organisms.txt"
+    species_file.write_text("UP000005640 Homo sapiens\n")
+    result = CliRunner().invoke(pipeline.pipeline, ["run", str(species_file), str(tmp_path / "out"), "bin/fasturec",
+                                                    "-j", "2", "--force"])
+    assert result.exit_code == 0, result.output
+    assert calls == [(2, True)]
+
+
+def test_msa_and_nj_stages_run_in_one_batch():
+    stages = {stage.name: stage for stage in run_pipeline.get_stages("/data/organisms.txt", "/data", "fasturec")}
+    assert run_pipeline.get_batch_commands(stages["trees"].command[3:]) == [
+        ["msa", "-q", "-c", "/data/cache/", "-j", "{cores}", "/data/clusters/full/", "/data/clusters/full_msa/"],
+        ["nj_trees", "-e", "numpy", "-s", "-t", "/data/bootstrap/", "70", "-c", "/data/cache/", "-j", "{cores}",
+         "/data/clusters/full_msa/", "/data/one2one/"],
+        ["msa", "-q", "-c", "/data/cache/", "-j", "{cores}", "/data/clusters/para/", "/data/clusters/para_msa/"],
+        ["nj_trees", "-e", "numpy", "-s", "-c", "/data/cache/", "-j", "{cores}", "/data/clusters/para_msa/",
+         "/data/paralogs/"]]
+    assert all(stage.dependencies == ["trees"] for name, stage in stages.items()
+               if name.startswith(("consensus", "supertree")))
+
+
+def test_batch_reuses_one_pool(tmp_path, monkeypatch):
+    monkeypatch.setenv(telemetry.TRACE_VARIABLE, str(tmp_path / "trace.jsonl"))
+    synthetic_data.write_dataset(str(tmp_path), 8, 4, length=60, seed=2)
+    pools = []
+    get_pool = worker_pool.get_pool
+    monkeypatch.setattr(worker_pool, "get_pool", lambda no_processes: pools.append(get_pool(no_processes)) or pools[-1])
+    nj_trees = ["nj_trees", "-e", "numpy", "-j", "2", str(tmp_path / "msa")]
+    result = CliRunner().invoke(pipeline.pipeline, ["batch", *nj_trees, str(tmp_path / "out1"),
+                                                    "::", *nj_trees, str(tmp_path / "out2")])
+    assert result.exit_code == 0, result.output
+    assert len(pools) == 2 and pools[0] is pools[1]
+    assert not worker_pool.pools  # closed after the batch
+    assert (tmp_path / "out1" / "nj_trees.nwk").read_text() == (tmp_path / "out2" / "nj_trees.nwk").read_text()
+    records = [json.loads(line) for line in (tmp_path / "trace.jsonl").read_text().splitlines()]
+    stages = [record for record in records if record["kind"] == "stage"]
+    assert [stage["argv"][-1] for stage in stages] == [str(tmp_path / "out1"), str(tmp_path / "out2")]
+    assert all(stage["status"] == "ok" and stage["cpu"] > 0 for stage in stages)
+    clusters = [record for record in records if record["kind"] == "cluster"]
+    assert len(clusters) == 8 and all(record["stage"] == "get_nj_trees" for record in clusters)
+
+
+def test_rf_reports_are_built_by_one_stage():
+    stages = [stage for stage in run_pipeline.get_stages("/data/organisms.txt", "/data", "fasturec")
+              if stage.command[2] == "rf"]
+    assert len(stages) == 1
+    assert stages[0].command[-4:] == ["-r", "/data/timetree/organisms_timetree.nwk", "/data/ref_tree.nwk", "/data"]
+    assert stages[0].outputs == ["/data/report_ref_tree.txt", "/data/report_organisms_timetree.txt"]
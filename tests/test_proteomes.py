@@ -0,0 +1,76 @@
+import get_proteomes
+import gzip
+import pytest
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PROTEOMES = {"UP1": ">sp|P1|A_HUMAN Protein A\nMKVLA\nMKI\n", "UP2": ">tr|Q2|B_MOUSE Protein B\nMRIL\n",
+             "UP3": ">sp|P3|C_YEAST Protein C\nMSTL\n"}
+BODIES = {id: gzip.compress(fasta.encode() * 1000) for id, fasta in PROTEOMES.items()}
+
+
+class ProteomesHandler(BaseHTTPRequestHandler):
+    """
+    UniProt REST API serving `BODIES`: UP2 is only in UniParc and the first download of UP1 is cut in half.
+    """
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        db, id = url.path.split("/")[1], parse_qs(url.query)["query"][0].strip("()").split(":")[1]
+        start = int(self.headers["Range"].removeprefix("bytes=").rstrip("-")) if self.headers["Range"] else 0
+        self.requests.append((db, id, start))
+        if db == "uniprotkb" and id == "UP2":
+            self.send_error(404)
+            return
+        body = BODIES[id]
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+        if (db, id, start) == ("uniprotkb", "UP1", 0):
+            self.wfile.write(body[:len(body) // 2])  # the connection is closed before the rest is sent
+        else:
+            self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    ProteomesHandler.requests = []
+    server = ThreadingHTTPServer(("localhost", 0), ProteomesHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield f"http://localhost:{server.server_address[1]}"
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_get_proteomes_resumes_downloads_and_falls_back_to_uniparc(tmp_path, monkeypatch, base_url):
+    monkeypatch.setattr(get_proteomes.time, "sleep", lambda seconds: None)  # no waiting before retries
+    species_file = tmp_path / "organisms.txt"
+    species_file.write_text("UP1 Homo sapiens\nUP2 Mus musculus\nUP3 Saccharomyces cerevisiae\n")
+    (tmp_path / "proteomes").mkdir()
+    (tmp_path / "proteomes" / "UP3.UniProtKB.fasta.gz.part").write_bytes(BODIES["UP3"][:100])  # interrupted run
+    get_proteomes.get_proteomes.callback(str(species_file), str(tmp_path), jobs=2, rate=100, retries=2,
+                                         base_url=base_url)
+    expected = "".join(line if not line.startswith(">") else f"{line.strip()} {id}\n"
+                       for id, fasta in PROTEOMES.items() for line in (fasta * 1000).splitlines(keepends=True))
+    assert (tmp_path / "proteomes.fasta").read_text() == expected
+    assert sorted(ProteomesHandler.requests) == [("uniparc", "UP2", 0), ("uniprotkb", "UP1", 0),
+                                                 ("uniprotkb", "UP1", len(BODIES["UP1"]) // 2),
+                                                 ("uniprotkb", "UP2", 0), ("uniprotkb", "UP3", 100)]
+    assert not list(tmp_path.glob("proteomes/*.part"))
+
+
+def test_token_bucket_limits_rate():
+    bucket = get_proteomes.TokenBucket(rate=50)
+    start = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    assert time.monotonic() - start >= 10 / 50 * 0.9  # the first token is available at once
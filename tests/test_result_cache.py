@@ -0,0 +1,22 @@
+import get_nj_trees
+import os
+import result_cache
+
+
+def test_evict_skips_missing_cache_dir(tmp_path):
+    result_cache.evict(str(tmp_path / "cache"), 0)
+    assert not (tmp_path / "cache").exists()
+
+
+def test_evict_removes_least_recently_used_results(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path), "nj", "")
+    for key, mtime in [("aa1", 1), ("bb2", 2)]:
+        cache.put(key, b"tree")
+        os.utime(cache.get_path(key), (mtime, mtime))
+    result_cache.evict(str(tmp_path), 4)
+    assert cache.get("aa1") is None and cache.get("bb2") == b"tree"
+
+
+def test_cache_params_depend_on_large_cluster_size():
+    assert get_nj_trees.get_cache_params("numpy", [70], 100, None, 1000, large_cluster=300) != \
+           get_nj_trees.get_cache_params("numpy", [70], 100, None, 1000, large_cluster=0)
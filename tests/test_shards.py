@@ -0,0 +1,37 @@
+import get_nj_trees
+import merge_shards
+import os
+import shards
+import synthetic_data
+
+from click.testing import CliRunner
+
+NO_SHARDS = 3
+
+
+def invoke(command, *args: str):
+    result = CliRunner().invoke(command, args)
+    assert result.exit_code == 0, result.output
+
+
+def read_outputs(output_dir: str) -> dict[str, list[str]]:
+    return {file_name: sorted(open(f"{output_dir}/{file_name}").read().splitlines())
+            for file_name in merge_shards.MERGED_FILES if os.path.exists(f"{output_dir}/{file_name}")}
+
+
+def test_merged_shards_equal_unsharded_run(tmp_path):
+    synthetic_data.write_dataset(str(tmp_path), 10, 12, length=60, seed=2)  # every shard has a family
+    msa_dir, options = str(tmp_path / "msa"), ("-e", "numpy", "-b", "1", "-r", "5", "--max_gaps", "0.5", "-j", "1")
+    invoke(get_nj_trees.get_nj_trees, msa_dir, str(tmp_path / "unsharded"), *options)
+    for index in range(NO_SHARDS):
+        invoke(get_nj_trees.get_nj_trees, msa_dir, str(tmp_path / "sharded"), *options,
+               "--shard", f"{index}/{NO_SHARDS}")
+    invoke(merge_shards.merge_shards, str(tmp_path / "sharded"), str(NO_SHARDS))
+    outputs = read_outputs(str(tmp_path / "unsharded"))
+    assert len(outputs) == len(merge_shards.MERGED_FILES) and len(outputs["nj_trees.nwk"]) == 12
+    assert read_outputs(str(tmp_path / "sharded")) == outputs
+
+    os.remove(f"{shards.get_shard_dir(str(tmp_path / 'sharded'), (1, NO_SHARDS))}/{shards.SHARD_DONE}")
+    result = CliRunner().invoke(merge_shards.merge_shards, [str(tmp_path / "sharded"), str(NO_SHARDS)])
+    assert result.exit_code != 0
+    assert f"Shards not completed: 1/{NO_SHARDS}" in str(result.exception)
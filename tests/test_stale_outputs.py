@@ -0,0 +1,30 @@
+import alignment_store
+import get_clusters
+import get_filtered_clusters
+import get_msa
+
+
+def test_get_filtered_clusters_removes_stale_clusters(tmp_path):
+    species_file = tmp_path / "organisms.txt"
+    species_file.write_text("UP1 Genus species1 strain1\nUP2 Genus species2 strain2\n")
+    get_clusters.write_clusters_files([(">a", ">a x UP1", "MKV"), (">a", ">b x UP2", "MKI")], str(tmp_path))
+    output_dir = tmp_path / "full"
+    output_dir.mkdir()
+    (output_dir / "unified_2_removed.fasta").write_text(">Genus_species1\nMKV\n")
+    get_filtered_clusters.get_filtered_clusters.callback(str(species_file), str(tmp_path / "clusters"),
+                                                         (str(output_dir),), ())
+    assert sorted(path.name for path in output_dir.iterdir()) == ["unified_2_a.fasta"]
+
+
+def test_get_msa_removes_stale_msas(tmp_path):
+    mafft = tmp_path / "mafft"
+    mafft.write_text('#!/bin/sh\nfor last; do :; done\n[ "$last" = --version ] && echo v7 || cat "$last"\n')
+    mafft.chmod(0o755)
+    input_dir, output_dir = tmp_path / "full", tmp_path / "full_msa"
+    input_dir.mkdir()
+    (input_dir / "unified_2_a.fasta").write_text(">Genus_species1\nMKV\n>Genus_species2\nMKI\n")
+    output_dir.mkdir()
+    (output_dir / "mafft_unified_2_removed.fasta").write_text(">Genus_species1\nMKV\n>Genus_species2\nMKI\n")
+    get_msa.get_msa.callback(str(input_dir), str(output_dir), True, str(mafft), cores=1)
+    assert sorted(path.name for path in output_dir.glob("*.fasta")) == ["mafft_unified_2_a.fasta"]
+    assert [alignment.name for alignment in alignment_store.read_store_index(str(output_dir))] == ["mafft_unified_2_a"]